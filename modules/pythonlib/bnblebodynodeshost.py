@@ -47,6 +47,11 @@ from bleak import BleakClient
 
 
 from bncommon import BnConstants
+from bnhostcapture import BnCaptureWriter
+from bnhostframes import BnFrameAssembler
+from bnhoststats import BnConnectionStats, BnStatsReporter
+from bnhoststreams import BnSubscriptions
+from bnhostutils import BnListenerRoutes, BnStreamTable
 
 
 def current_milli_time():
@@ -64,7 +69,9 @@ class BodynodeListener:
         )
 
     def is_of_interest(self, player, bodypart, sensortype):
-        """By overriding this function you can set which set of player / bodypart / sensortype the listerner returns data of"""
+        """By overriding this function you can set which set of player / bodypart / sensortype the listerner returns data of.
+        It is called once per stream, the answer is kept until listeners are added or removed
+        """
         print(
             f"is_of_interest: returning True for player={player} bodypart={bodypart} sensortype={sensortype}"
         )
@@ -78,7 +85,7 @@ class BodynodeListenerTest(BodynodeListener):
         print("This is a test class")
 
 
-class BnBLEHostCommunicator:
+class BnBLEHostCommunicator:  # pylint: disable=too-many-instance-attributes,too-many-public-methods # reason: The API mirrors the other hosts, further splitting would not help readability
     """Bodynodes BLE Host ommunicator implementation"""
 
     def __init__(self):
@@ -88,17 +95,26 @@ class BnBLEHostCommunicator:
         self.blec_to_stop = True
 
         self.blec_maps = {
-            # Json object containing the messages for each player+bodypart+sensortype combination (key)
-            "messages": {},
+            # Table with the latest message of each player+bodypart+sensortype stream
+            "messages": BnStreamTable(),
             # Map the BLE client address to the player+bodypart combination
             "BLEAddress_PlayerBodypart": {},
             # Map the player+bodypart combination to the BLE client
             "PlayerBodypart_BLEdevices": {},
+            # Map the BLE client address to the stats of its notifications
+            "stats": {},
         }
         # List of actions to send
         self.blec_actions_to_send = []
-        self.blec_bodynodes_listeners = []
+        self.blec_bodynodes_listeners = BnListenerRoutes()
+        self.blec_subscriptions = BnSubscriptions()
         self.blec_identifiers = None
+        # Samples kept in the history of each stream, 0 means no history
+        self.blec_history_capacity = 0
+        self.blec_stats_reporter = None
+        self.blec_frames = BnFrameAssembler()
+        self.blec_capture = None
+        self.blec_frames.set_table(self.blec_maps["messages"])
 
     # Public functions
 
@@ -113,16 +129,20 @@ class BnBLEHostCommunicator:
         self.blec_to_stop = True
         self.blec_identifiers = identifiers
         self.blec_maps = {
-            "messages": {},
+            "messages": BnStreamTable(),
             "BLEAddress_PlayerBodypart": {},
             "PlayerBodypart_BLEdevices": {},
+            "stats": {},
         }
+        self.blec_maps["messages"].set_history_capacity(self.blec_history_capacity)
+        self.blec_frames.set_table(self.blec_maps["messages"])
         self.blec_actions_to_send = []
         self.blec_data_connection_thread = threading.Thread(
             target=self.run_data_connection_background
         )
 
         self.blec_to_stop = False
+        self.blec_subscriptions.start()
         self.blec_data_connection_thread.start()
 
     def stop(self):
@@ -130,18 +150,24 @@ class BnBLEHostCommunicator:
 
         print("BnBLEHostCommunicator - Stopping")
 
+        self.stop_stats_report()
+        # The receiving thread can be waiting for room in a subscription
+        self.blec_subscriptions.close_all()
         self.blec_to_stop = True
         if self.blec_data_connection_thread.is_alive():
             self.blec_data_connection_thread.join()
+        self.stop_capture()
 
         self.blec_maps = {
-            "messages": {},
+            "messages": BnStreamTable(),
             "BLEAddress_PlayerBodypart": {},
             "PlayerBodypart_BLEdevices": {},
+            "stats": {},
         }
+        self.blec_frames.set_table(self.blec_maps["messages"])
 
         self.blec_actions_to_send = []
-        self.blec_bodynodes_listeners = []
+        self.blec_bodynodes_listeners.clear()
         self.blec_identifiers = None
 
     def is_running(self):
@@ -238,12 +264,117 @@ class BnBLEHostCommunicator:
         print("Closing the data connection thread")
 
     def get_message_value(self, player, bodypart, sensortype):
-        """Returns the message associated to the requested player+bodypart+sensortype combination"""
+        """Returns the message associated to the requested player+bodypart+sensortype combination as a string,
+        None if there is none"""
 
-        pbs_key = f"{player}|{bodypart}|{sensortype}"
-        if pbs_key in self.blec_maps["messages"]:
-            return self.blec_maps["messages"][pbs_key]
-        return None
+        value = self.blec_frames.get_message_value(player, bodypart, sensortype)
+        return None if value is None else str(value)
+
+    def get_stream_id(self, player, bodypart, sensortype):
+        """Returns the id of the player+bodypart+sensortype stream, None if it was never received.
+        The id stays the same until the communicator is restarted"""
+
+        return self.blec_maps["messages"].get_stream_id(player, bodypart, sensortype)
+
+    def get_message_value_by_id(self, stream_id):
+        """Returns the message associated to the stream id given by get_stream_id, as get_message_value does"""
+
+        value = self.blec_frames.get_value(stream_id)
+        return None if value is None else str(value)
+
+    def set_history_capacity(self, capacity):
+        """Keeps the latest capacity samples of each stream with their receive time, 0 disables the history"""
+
+        self.blec_history_capacity = capacity
+        self.blec_maps["messages"].set_history_capacity(capacity)
+
+    def get_history(self, player, bodypart, sensortype, since_ms):
+        """Returns (timestamps, values) of the samples received after since_ms (same clock as time.time() * 1000).
+        They are zero-copy memoryviews, overwritten by the following samples. None if there is no history
+        """
+
+        stream_id = self.get_stream_id(player, bodypart, sensortype)
+        if stream_id is None:
+            return None
+        return self.blec_maps["messages"].get_history(stream_id, since_ms)
+
+    def get_window(self, player, bodypart, sensortype, num_samples):
+        """Returns (timestamps, values) of the latest num_samples samples, as get_history does"""
+
+        stream_id = self.get_stream_id(player, bodypart, sensortype)
+        if stream_id is None:
+            return None
+        return self.blec_maps["messages"].get_window(stream_id, num_samples)
+
+    def get_stats(self):
+        """Returns a dict with the counters and statistics of each connection (BLE address), it can be dumped as json"""
+
+        return {
+            ble_address: connection_stats.get_snapshot()
+            for ble_address, connection_stats in list(self.blec_maps["stats"].items())
+        }
+
+    def start_stats_report(self, interval_s, path=None):
+        """Reports the connection stats every interval_s seconds, printing them or appending them as json lines to path"""
+
+        self.stop_stats_report()
+        self.blec_stats_reporter = BnStatsReporter(self.get_stats, interval_s, path)
+        self.blec_stats_reporter.start()
+
+    def stop_stats_report(self):
+        """Stops reporting the connection stats"""
+
+        if self.blec_stats_reporter is not None:
+            self.blec_stats_reporter.stop()
+            self.blec_stats_reporter = None
+
+    def start_capture(self, path):
+        """Appends every received BLE notification to the capture file in path. Returns True if the capture started"""
+
+        self.stop_capture()
+        try:
+            self.blec_capture = BnCaptureWriter(path, "ble")
+        except OSError as err:
+            print("Cannot start the capture: ", err)
+            return False
+        return True
+
+    def stop_capture(self):
+        """Stops the capture, writing the buffered BLE notifications to the file"""
+
+        if self.blec_capture is not None:
+            capture = self.blec_capture
+            self.blec_capture = None
+            capture.close()
+
+    def get_frame(self, player, wait_ms=0):
+        """Returns a BnFrame, an immutable snapshot of the latest value of each stream of the player taken at once.
+        With wait_ms it first waits up to wait_ms for all of them to refresh. None if the player was never received
+        """
+
+        return self.blec_frames.get_frame(player, wait_ms)
+
+    def wait_for_update(self, keys, timeout_ms, versions=None):
+        """Waits up to timeout_ms for a new value of any of the (player, bodypart, sensortype) keys.
+        Returns the list of the keys with a new value, empty if none came.
+        A loop passing the same versions dict does not miss the values received between two calls
+        """
+
+        return self.blec_frames.wait_for_update(keys, timeout_ms, versions)
+
+    def wait_for_frame(self, player, timeout_ms, since=None):
+        """Waits up to timeout_ms for a new value of any stream of the player. Returns its BnFrame, None if none came.
+        A loop passing the previous frame as since does not miss the values received between two calls
+        """
+
+        return self.blec_frames.wait_for_frame(player, timeout_ms, since)
+
+    def set_frame_callback(self, on_frame, window_ms=None):
+        """Calls on_frame(frame) each time all the streams of a player refreshed, or window_ms after the first of them did.
+        It is called in the receiving thread. None removes the callback
+        """
+
+        self.blec_frames.set_callback(on_frame, window_ms)
 
     def add_action(self, action):
         """Adds an action to the list of actions to be sent"""
@@ -269,7 +400,7 @@ class BnBLEHostCommunicator:
         if not isinstance(listener, BodynodeListener):
             print("Given listener does not extend BodynodeListener")
             return False
-        self.blec_bodynodes_listeners.append(listener)
+        self.blec_bodynodes_listeners.add(listener)
         return True
 
     def remove_listener(self, listener):
@@ -280,7 +411,21 @@ class BnBLEHostCommunicator:
     def remove_all_listeners(self):
         """Remove all listeners in the communicator"""
 
-        self.blec_bodynodes_listeners = []
+        self.blec_bodynodes_listeners.clear()
+
+    def stream(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Returns a generator of the BnSample of the streams matching stream_filter, it blocks until they come.
+        stream_filter is None for all the streams, a (player, bodypart, sensortype) tuple where None matches anything,
+        or a function (player, bodypart, sensortype) => bool. When queue_size samples are not read yet, backpressure
+        "latest" drops the oldest of them and "block" makes the receiving thread wait. It ends when the communicator stops
+        """
+
+        return self.blec_subscriptions.stream(stream_filter, queue_size, backpressure)
+
+    def astream(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Returns an async iterator of the BnSample of the streams matching stream_filter, see stream"""
+
+        return self.blec_subscriptions.astream(stream_filter, queue_size, backpressure)
 
     # Private functions
 
@@ -320,10 +465,22 @@ class BnBLEHostCommunicator:
         """Receive a notification with a value"""
 
         # print(f"Notification from {ble_address} {characteristic_uuid}")
+        capture = self.blec_capture
+        if capture is not None:
+            # The characteristic is needed to decode the value
+            capture.write((ble_address, characteristic_uuid), value)
+
+        if ble_address not in self.blec_maps["stats"]:
+            self.blec_maps["stats"][ble_address] = BnConnectionStats()
+        connection_stats = self.blec_maps["stats"][ble_address]
+        connection_stats.add_datagram()
 
         json_message = self.__create_json_message_from_ble_chara(
             characteristic_uuid, value
         )
+        if not json_message:
+            connection_stats.add_decode_errors()
+            return
 
         # print(sender) # example: 0000cca3-0000-1000-8000-00805f9b34fb (Handle: 168): Vendor specific
         player = self.blec_maps["BLEAddress_PlayerBodypart"][ble_address]["player"]
@@ -335,18 +492,21 @@ class BnBLEHostCommunicator:
             print(f"{sender}:Missing bodypart")
             return
 
-        sensortype = json_message[BnConstants.MESSAGE_SENSORTYPE_TAG]
-        self.blec_maps["messages"][player + "|" + bodypart + "|" + sensortype] = str(
-            json_message[BnConstants.MESSAGE_VALUE_TAG]
+        messages = self.blec_maps["messages"]
+        stream_id = messages.intern_stream(
+            player, bodypart, json_message[BnConstants.MESSAGE_SENSORTYPE_TAG]
         )
-        for listener in self.blec_bodynodes_listeners:
-            if listener.is_of_interest(player, bodypart, sensortype):
-                listener.on_message_received(
-                    player,
-                    bodypart,
-                    sensortype,
-                    json_message[BnConstants.MESSAGE_VALUE_TAG],
-                )
+        if stream_id is None:
+            print(f"{sender}:Malformed message")
+            connection_stats.add_decode_errors()
+            return
+        self.blec_frames.store(stream_id, json_message[BnConstants.MESSAGE_VALUE_TAG])
+        messages.set_source(stream_id, ble_address)
+        connection_stats.add_sample(json_message[BnConstants.MESSAGE_SENSORTYPE_TAG])
+        stream_key = messages.get_stream_key(stream_id)
+        value = json_message[BnConstants.MESSAGE_VALUE_TAG]
+        self.blec_bodynodes_listeners.dispatch(stream_id, stream_key, value)
+        self.blec_subscriptions.dispatch(stream_id, stream_key, value)
 
     def __check_chara(self, client, uuid, value):
         """Check characteristic validity and set in map"""
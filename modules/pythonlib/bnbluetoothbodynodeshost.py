@@ -34,6 +34,11 @@ import subprocess
 import re
 
 from bncommon import BnConstants
+from bnhostcapture import BnCaptureWriter
+from bnhostframes import BnFrameAssembler
+from bnhoststats import BnConnectionStats, BnStatsReporter
+from bnhoststreams import BnSubscriptions
+from bnhostutils import BnJsonDecoder, BnJsonFramer, BnListenerRoutes, BnStreamTable
 
 # Note: based on "sdptool"
 # $ sdptool browse --tree 24:95:2F:64:68:A6 | grep -B 10 -A 10 "0x1101" | grep Channel
@@ -76,10 +81,14 @@ from bncommon import BnConstants
 bodynodes_bt = {
     "buffer_size": 1024,
     "connection_keep_alive_rec_interval_ms": 60000,
+    # Time without data after which a connection is stale, it is disconnected after connection_keep_alive_rec_interval_ms
+    "connection_stale_ms": 3000,
     "connection_ack_interval_ms": 1000,
     # This is the common UUID of the service to look for
     "nodes_UUID128": "00001101-0000-1000-8000-00805f9b34fb",
     "nodes_UUID16": "0x1101",
+    # Json backend of the single message chunks: "orjson", "ujson", "json". None picks the fastest installed one
+    "json_backend": None,
 }
 
 
@@ -132,7 +141,9 @@ class BodynodeListener:
         )
 
     def is_of_interest(self, player, bodypart, sensortype):
-        """By overriding this function you can set which set of player / bodypart / sensortype the listerner returns data of"""
+        """By overriding this function you can set which set of player / bodypart / sensortype the listerner returns data of.
+        It is called once per stream, the answer is kept until listeners are added or removed
+        """
         print(
             f"is_of_interest: returning True for player={player} bodypart={bodypart} sensortype={sensortype}"
         )
@@ -146,7 +157,7 @@ class BodynodeListenerTest(BodynodeListener):
         print("This is a test class")
 
 
-class BnBluetoothHostCommunicator:
+class BnBluetoothHostCommunicator:  # pylint: disable=too-many-instance-attributes,too-many-public-methods # reason: The API mirrors the other hosts, further splitting would not help readability
     """Bodynodes Bluetooth Host ommunicator implementation"""
 
     def __init__(self):
@@ -158,9 +169,9 @@ class BnBluetoothHostCommunicator:
         self.bthc_to_stop = True
 
         self.bthc_maps = {
-            # Json object containing the messages for each player+bodypart+sensortype combination (key)
-            "messages": {},
-            # Map the connections (bt_address) to the player+bodypart combination (key)
+            # Table with the latest message of each player+bodypart+sensortype stream
+            "messages": BnStreamTable(),
+            # Map the connections (bt_address) to the (player, bodypart) combination (key)
             "connections": {},
             # Map temporary connections data to an arbitrary string representation of a connection (key)
             "tempConnectionsData": {},
@@ -170,7 +181,16 @@ class BnBluetoothHostCommunicator:
         self.bthc_connectors = {}
         # List of actions to send
         self.bthc_actions_to_send = []
-        self.bthc_bodynodes_listeners = []
+        self.bthc_bodynodes_listeners = BnListenerRoutes()
+        self.bthc_subscriptions = BnSubscriptions()
+        # Samples kept in the history of each stream, 0 means no history
+        self.bthc_history_capacity = 0
+        self.bthc_stats_reporter = None
+        self.bthc_frames = BnFrameAssembler()
+        self.bthc_capture = None
+        # Json decoder shared by the framers of all the connections
+        self.bthc_json_decoder = BnJsonDecoder(bodynodes_bt["json_backend"])
+        self.bthc_frames.set_table(self.bthc_maps["messages"])
 
     # Public functions
 
@@ -183,13 +203,15 @@ class BnBluetoothHostCommunicator:
         print("BnBluetoothHostCommunicator - Starting")
 
         self.bthc_maps = {
-            "messages": {},
+            "messages": BnStreamTable(),
             "connections": {},
             "tempConnectionsData": {},
         }
+        self.bthc_maps["messages"].set_history_capacity(self.bthc_history_capacity)
+        self.bthc_frames.set_table(self.bthc_maps["messages"])
         self.bthc_connectors = {}
         self.bthc_actions_to_send = []
-        self.bthc_bodynodes_listeners = []
+        self.bthc_bodynodes_listeners.clear()
 
         for bt_addr in identifiers:
             print(f"Trying to connect to {bt_addr}")
@@ -215,24 +237,30 @@ class BnBluetoothHostCommunicator:
                 sock.close()
 
         self.bthc_to_stop = False
+        self.bthc_subscriptions.start()
         self.bthc_data_connection_thread.start()
 
     def stop(self):
         """Stops the communicator"""
 
         print("BnBluetoothHostCommunicator - Stopping")
+        self.stop_stats_report()
+        # The receiving thread can be waiting for room in a subscription
+        self.bthc_subscriptions.close_all()
         self.bthc_to_stop = True
+        self.stop_capture()
         for _, conn in self.bthc_connectors.items():
             conn.close()
 
         self.bthc_maps = {
-            "messages": {},
+            "messages": BnStreamTable(),
             "connections": {},
             "tempConnectionsData": {},
         }
+        self.bthc_frames.set_table(self.bthc_maps["messages"])
         self.bthc_connectors = {}
         self.bthc_actions_to_send = []
-        self.bthc_bodynodes_listeners = []
+        self.bthc_bodynodes_listeners.clear()
 
     def is_running(self):
         """Returns true if the communicator is running, false otherwise"""
@@ -254,10 +282,117 @@ class BnBluetoothHostCommunicator:
     def get_message_value(self, player, bodypart, sensortype):
         """Returns the message associated to the requested player+bodypart+sensortype combination"""
 
-        pbs_key = f"{player}|{bodypart}|{sensortype}"
-        if pbs_key in self.bthc_maps["messages"]:
-            return self.bthc_maps["messages"][pbs_key]
-        return None
+        return self.bthc_frames.get_message_value(player, bodypart, sensortype)
+
+    def get_stream_id(self, player, bodypart, sensortype):
+        """Returns the id of the player+bodypart+sensortype stream, None if it was never received.
+        The id stays the same until the communicator is restarted"""
+
+        return self.bthc_maps["messages"].get_stream_id(player, bodypart, sensortype)
+
+    def get_message_value_by_id(self, stream_id):
+        """Returns the message associated to the stream id given by get_stream_id"""
+
+        return self.bthc_frames.get_value(stream_id)
+
+    def set_history_capacity(self, capacity):
+        """Keeps the latest capacity samples of each stream with their receive time, 0 disables the history"""
+
+        self.bthc_history_capacity = capacity
+        self.bthc_maps["messages"].set_history_capacity(capacity)
+
+    def get_history(self, player, bodypart, sensortype, since_ms):
+        """Returns (timestamps, values) of the samples received after since_ms (same clock as time.time() * 1000).
+        They are zero-copy memoryviews, overwritten by the following samples. None if there is no history
+        """
+
+        stream_id = self.get_stream_id(player, bodypart, sensortype)
+        if stream_id is None:
+            return None
+        return self.bthc_maps["messages"].get_history(stream_id, since_ms)
+
+    def get_window(self, player, bodypart, sensortype, num_samples):
+        """Returns (timestamps, values) of the latest num_samples samples, as get_history does"""
+
+        stream_id = self.get_stream_id(player, bodypart, sensortype)
+        if stream_id is None:
+            return None
+        return self.bthc_maps["messages"].get_window(stream_id, num_samples)
+
+    def get_stats(self):
+        """Returns a dict with the counters and statistics of each connection (bt_address), it can be dumped as json"""
+
+        stats = {}
+        for connection_str, connection_data in list(
+            self.bthc_maps["tempConnectionsData"].items()
+        ):
+            connection_stats = connection_data["stats"]
+            connection_stats.set_json_errors(connection_data["framer"].get_num_errors())
+            stats[connection_str] = connection_stats.get_snapshot()
+            stats[connection_str]["status"] = connection_data["STATUS"]
+        return stats
+
+    def start_stats_report(self, interval_s, path=None):
+        """Reports the connection stats every interval_s seconds, printing them or appending them as json lines to path"""
+
+        self.stop_stats_report()
+        self.bthc_stats_reporter = BnStatsReporter(self.get_stats, interval_s, path)
+        self.bthc_stats_reporter.start()
+
+    def stop_stats_report(self):
+        """Stops reporting the connection stats"""
+
+        if self.bthc_stats_reporter is not None:
+            self.bthc_stats_reporter.stop()
+            self.bthc_stats_reporter = None
+
+    def start_capture(self, path):
+        """Appends every received RFCOMM chunk to the capture file in path. Returns True if the capture started"""
+
+        self.stop_capture()
+        try:
+            self.bthc_capture = BnCaptureWriter(path, "bluetooth")
+        except OSError as err:
+            print("Cannot start the capture: ", err)
+            return False
+        return True
+
+    def stop_capture(self):
+        """Stops the capture, writing the buffered RFCOMM chunks to the file"""
+
+        if self.bthc_capture is not None:
+            capture = self.bthc_capture
+            self.bthc_capture = None
+            capture.close()
+
+    def get_frame(self, player, wait_ms=0):
+        """Returns a BnFrame, an immutable snapshot of the latest value of each stream of the player taken at once.
+        With wait_ms it first waits up to wait_ms for all of them to refresh. None if the player was never received
+        """
+
+        return self.bthc_frames.get_frame(player, wait_ms)
+
+    def wait_for_update(self, keys, timeout_ms, versions=None):
+        """Waits up to timeout_ms for a new value of any of the (player, bodypart, sensortype) keys.
+        Returns the list of the keys with a new value, empty if none came.
+        A loop passing the same versions dict does not miss the values received between two calls
+        """
+
+        return self.bthc_frames.wait_for_update(keys, timeout_ms, versions)
+
+    def wait_for_frame(self, player, timeout_ms, since=None):
+        """Waits up to timeout_ms for a new value of any stream of the player. Returns its BnFrame, None if none came.
+        A loop passing the previous frame as since does not miss the values received between two calls
+        """
+
+        return self.bthc_frames.wait_for_frame(player, timeout_ms, since)
+
+    def set_frame_callback(self, on_frame, window_ms=None):
+        """Calls on_frame(frame) each time all the streams of a player refreshed, or window_ms after the first of them did.
+        It is called in the receiving thread. None removes the callback
+        """
+
+        self.bthc_frames.set_callback(on_frame, window_ms)
 
     def add_action(self, action):
         """Adds an action to the list of actions to be sent"""
@@ -268,7 +403,7 @@ class BnBluetoothHostCommunicator:
         """Sends all actions in the list"""
 
         for action in self.bthc_actions_to_send:
-            player_bodypart = action["player"] + "_" + action["bodypart"]
+            player_bodypart = (action["player"], action["bodypart"])
             if (
                 player_bodypart not in self.bthc_maps["connections"]
                 or self.bthc_maps["connections"][player_bodypart] is None
@@ -285,35 +420,19 @@ class BnBluetoothHostCommunicator:
     def check_all_ok(self):
         """Checks if everything is ok. Returns true if it is indeed ok, false otherwise"""
 
-        self.__receive_bytes()
-        for _, tmp_connection in self.bthc_maps["tempConnectionsData"].items():
+        now = current_milli_time()
+        for tmp_connection in self.__receive_bytes():
+            self.__check_connection(tmp_connection, now)
+        self.__check_keep_alive(now)
+        return not self.bthc_to_stop
 
-            # print("Connection to check "+tmp_connection_str+"\n", )
-            # if tmp_connection["received_bytes"] is not None:
-            # print("Connection to check "+tmp_connection_str+"\n", )
-            # received_bytes_str = tmp_connection["received_bytes"].decode("utf-8")
-            # print("Data in the received bytes "+received_bytes_str+"\n" )
-            # print("Status connection "+tmp_connection["STATUS"] )
+    def inject_bytes(self, bt_address, message_bytes):
+        """Handles bytes as if they were received from bt_address, e.g. replaying a capture.
+        The connection of a new address starts as connected, a capture might not include its ACKN
+        """
 
-            if tmp_connection["STATUS"] == "IS_WAITING_ACK":
-                # print("Connetion is waiting ACKN")
-                if self.__check_for_ackn(tmp_connection):
-                    self.__send_ackh(tmp_connection)
-                    tmp_connection["STATUS"] = "CONNECTED"
-            else:
-                if (
-                    current_milli_time() - tmp_connection["last_rec_time"]
-                    > bodynodes_bt["connection_keep_alive_rec_interval_ms"]
-                ):
-                    tmp_connection["STATUS"] = "DISCONNECTED"
-                if self.__check_for_ackn(tmp_connection):
-                    print("Received ACKN")
-                    self.__send_ackh(tmp_connection)
-                else:
-                    self.__check_for_messages(tmp_connection)
-            tmp_connection["received_bytes"] = None
-            tmp_connection["num_received_bytes"] = 0
-        return not self.bthc_to_stop
+        tmp_connection = self.__store_bytes(bt_address, message_bytes, "CONNECTED")
+        self.__check_connection(tmp_connection, current_milli_time())
 
     def add_listener(self, listener):
         """Add a listener to the communicator"""
@@ -324,7 +443,7 @@ class BnBluetoothHostCommunicator:
         if not isinstance(listener, BodynodeListener):
             print("Given listener does not extend BodynodeListener")
             return False
-        self.bthc_bodynodes_listeners.append(listener)
+        self.bthc_bodynodes_listeners.add(listener)
         return True
 
     def remove_listener(self, listener):
@@ -335,44 +454,108 @@ class BnBluetoothHostCommunicator:
     def remove_all_listeners(self):
         """Remove all listeners in the communicator"""
 
-        self.bthc_bodynodes_listeners = []
+        self.bthc_bodynodes_listeners.clear()
+
+    def stream(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Returns a generator of the BnSample of the streams matching stream_filter, it blocks until they come.
+        stream_filter is None for all the streams, a (player, bodypart, sensortype) tuple where None matches anything,
+        or a function (player, bodypart, sensortype) => bool. When queue_size samples are not read yet, backpressure
+        "latest" drops the oldest of them and "block" makes the receiving thread wait. It ends when the communicator stops
+        """
+
+        return self.bthc_subscriptions.stream(stream_filter, queue_size, backpressure)
+
+    def astream(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Returns an async iterator of the BnSample of the streams matching stream_filter, see stream"""
+
+        return self.bthc_subscriptions.astream(stream_filter, queue_size, backpressure)
 
     # Private functions
 
     def __receive_bytes(self):
-        """Receive bytes from the socket"""
+        """Receive bytes from the sockets. Returns the connections that received bytes"""
 
+        received_connections = []
         for bt_addr, sock in self.bthc_connectors.items():
             message_bytes = None
             try:
                 message_bytes = sock.recv(bodynodes_bt["buffer_size"])
             except socket.error:
                 # print(f"Error reading from socket: {e}")
-                break
+                continue
 
             if not message_bytes:
-                break
+                continue
+            capture = self.bthc_capture
+            if capture is not None:
+                capture.write(bt_addr, message_bytes)
 
             # print(bt_addr)
             # print(message_bytes)
-            connection_str = bt_addr + ""
-            if connection_str not in self.bthc_maps["tempConnectionsData"]:
-                new_connection_data = {}
-                new_connection_data["STATUS"] = "IS_WAITING_ACK"
-                new_connection_data["bt_address"] = bt_addr
-                self.bthc_maps["tempConnectionsData"][
-                    connection_str
-                ] = new_connection_data
-
-            connection_data = self.bthc_maps["tempConnectionsData"][connection_str]
-            connection_data["num_received_bytes"] = len(message_bytes)
-            connection_data["received_bytes"] = message_bytes
+            received_connections.append(
+                self.__store_bytes(bt_addr, message_bytes, "IS_WAITING_ACK")
+            )
+        return received_connections
+
+    def __store_bytes(self, bt_addr, message_bytes, status):
+        """Puts the received bytes in their connection, a new connection starts in status. Returns the connection"""
+
+        connection_str = bt_addr + ""
+        if connection_str not in self.bthc_maps["tempConnectionsData"]:
+            new_connection_data = {}
+            new_connection_data["STATUS"] = status
+            new_connection_data["bt_address"] = bt_addr
+            new_connection_data["last_rec_time"] = current_milli_time()
+            new_connection_data["framer"] = BnJsonFramer(self.bthc_json_decoder)
+            new_connection_data["stats"] = BnConnectionStats()
+            self.bthc_maps["tempConnectionsData"][connection_str] = new_connection_data
+
+        connection_data = self.bthc_maps["tempConnectionsData"][connection_str]
+        connection_data["stats"].add_datagram()
+        connection_data["num_received_bytes"] = len(message_bytes)
+        connection_data["received_bytes"] = message_bytes
+        return connection_data
+
+    def __check_connection(self, tmp_connection, now):
+        """Checks a connection, handling ACKN and messages of its received bytes"""
+
+        if tmp_connection["STATUS"] == "IS_WAITING_ACK":
+            if self.__check_for_ackn(tmp_connection):
+                self.__send_ackh(tmp_connection)
+                tmp_connection["STATUS"] = "CONNECTED"
+                tmp_connection["last_rec_time"] = now
+        else:
+            # Any data brings the connection back to CONNECTED
+            tmp_connection["STATUS"] = "CONNECTED"
+            tmp_connection["last_rec_time"] = now
+            if self.__check_for_ackn(tmp_connection):
+                print("Received ACKN")
+                self.__send_ackh(tmp_connection)
+            else:
+                self.__check_for_messages(tmp_connection)
+        tmp_connection["received_bytes"] = None
+        tmp_connection["num_received_bytes"] = 0
+
+    def __check_keep_alive(self, now):
+        """Moves the silent connections to STALE or DISCONNECTED, there are only a few bluetooth links to go through"""
+
+        for tmp_connection in self.bthc_maps["tempConnectionsData"].values():
+            if tmp_connection["STATUS"] == "IS_WAITING_ACK":
+                continue
+            silent_ms = now - tmp_connection["last_rec_time"]
+            if silent_ms >= bodynodes_bt["connection_keep_alive_rec_interval_ms"]:
+                tmp_connection["STATUS"] = "DISCONNECTED"
+            elif silent_ms >= bodynodes_bt["connection_stale_ms"]:
+                tmp_connection["STATUS"] = "STALE"
 
     def __send_ackh(self, connection_data):
         """Sends ACKH to a connection"""
 
         # print("Sending ACKH to = " + connection_data["bt_address"])
         # print(self.bthc_connectors[connection_data["bt_address"]])
+        if connection_data["bt_address"] not in self.bthc_connectors:
+            # Injected bytes, there is no socket to answer to
+            return
         try:
             self.bthc_connectors[connection_data["bt_address"]].send(
                 "ACKH".encode("utf-8")
@@ -384,21 +567,10 @@ class BnBluetoothHostCommunicator:
     def __check_for_ackn(self, connection_data):
         """Checks if there is an ACK in the connection data. Returns true if there is, false otherwise"""
 
-        if connection_data["num_received_bytes"] < 4:
-            # print( "Check for ACKN - not enough bytes = " +str(connection_data["num_received_bytes"]) )
+        if connection_data["received_bytes"].find(b"ACKN") < 0:
             return False
-
-        for index in range(0, connection_data["num_received_bytes"] - 2):
-            # ACKN
-            if (
-                connection_data["received_bytes"][index] == 65
-                and connection_data["received_bytes"][index + 1] == 67
-                and connection_data["received_bytes"][index + 2] == 75
-                and connection_data["received_bytes"][index + 3] == 78
-            ):
-                connection_data["last_rec_time"] = current_milli_time()
-                return True
-        return False
+        connection_data["stats"].add_ackn()
+        return True
 
     def __check_for_messages(self, connection_data):
         """Checks if there are messages in the connection data and puts them in jsons"""
@@ -406,34 +578,11 @@ class BnBluetoothHostCommunicator:
         if connection_data["num_received_bytes"] == 0:
             return
 
-        message_str = connection_data["received_bytes"].decode("utf-8")
-
-        index_st = 0
-        json_messages = []
-        # print( "Original message_str = " + str(message_str) )
-        while index_st != -1:
-            index_st = message_str.find("{")
-            message_str = message_str[index_st:]
-            index_end = message_str.find("}")
-            remaining_message_str = message_str[index_end + 1 :]
-            message_str = message_str[: index_end + 1]
-            if message_str == "":
-                break
-
-            json_message = None
-            try:
-                # It loads arrays too
-                json_message = json.loads(message_str)
-                json_messages.append(json_message)
-            except json.decoder.JSONDecodeError as err:
-                print(message_str)
-                print("Not a valid json: ", err)
-            message_str = remaining_message_str
-
-        tmp_connection_str = connection_data["bt_address"]
-        self.bthc_maps["tempConnectionsData"][tmp_connection_str][
-            "last_rec_time"
-        ] = current_milli_time()
+        # The framer keeps partial messages until the next bytes complete them
+        json_messages = connection_data["framer"].feed(
+            connection_data["received_bytes"]
+        )
+
         self.__parse_messages(connection_data["bt_address"], json_messages)
 
     def __parse_messages(self, bt_address, json_messages):
@@ -448,19 +597,28 @@ class BnBluetoothHostCommunicator:
             ):
                 print("Json message received is incomplete\n")
                 continue
-            player = message["player"]
-            bodypart = message["bodypart"]
-            sensortype = message["sensortype"]
-            self.bthc_maps["connections"][player + "_" + bodypart] = bt_address
-            self.bthc_maps["messages"][player + "_" + bodypart + "_" + sensortype] = (
-                message["value"]
+            messages = self.bthc_maps["messages"]
+            stream_id = messages.intern_stream(
+                message["player"], message["bodypart"], message["sensortype"]
             )
+            if stream_id is None:
+                print("Json message received is malformed\n")
+                self.bthc_maps["tempConnectionsData"][bt_address][
+                    "stats"
+                ].add_decode_errors()
+                continue
+            self.bthc_frames.store(stream_id, message["value"])
+            stream_key = messages.get_stream_key(stream_id)
+            self.bthc_maps["tempConnectionsData"][bt_address]["stats"].add_sample(
+                stream_key[2]
+            )
+            if messages.set_source(stream_id, bt_address):
+                self.bthc_maps["connections"][stream_key[:2]] = bt_address
 
-            for listener in self.bthc_bodynodes_listeners:
-                if listener.is_of_interest(player, bodypart, sensortype):
-                    listener.on_message_received(
-                        player, bodypart, sensortype, message["value"]
-                    )
+            self.bthc_bodynodes_listeners.dispatch(
+                stream_id, stream_key, message["value"]
+            )
+            self.bthc_subscriptions.dispatch(stream_id, stream_key, message["value"])
 
 
 def main():
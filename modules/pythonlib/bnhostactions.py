@@ -0,0 +1,169 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Module with the actions sending of the WiFi Bodynode Host.
+"""
+
+import json
+import threading
+from collections import deque
+
+from bncommon import BnConstants
+
+# Action types coalesced when the actions are sent: the latest action of a player+bodypart+type, and of the same
+# value of the given tag if any, replaces the ones queued before it. The actions of the other types are all sent
+coalesced_actions = {
+    BnConstants.ACTION_TYPE_HAPTIC_TAG: None,
+    BnConstants.ACTION_TYPE_ENABLESENSOR_TAG: BnConstants.ACTION_ENABLESENSOR_SENSORTYPE_TAG,
+}
+
+
+class BnActionSender:
+    """Thread that sends the queued actions each time they are flushed, the types in coalesced_actions
+    only send their latest action. get_address(player, bodypart) gives the (ip_address, port) of a node
+    """
+
+    def __init__(self, get_address):
+        self.asn_get_address = get_address
+        # (payload, address) => None, set by start()
+        self.asn_send_payload = None
+        # Longest datagram of batched actions, None sends each action in its own datagram
+        self.asn_batch_size = None
+        # Queue of (player, bodypart, coalesce key, encoded action), emptied when flushed
+        self.asn_queue = deque()
+        self.asn_flush_event = threading.Event()
+        self.asn_to_stop = False
+        self.asn_thread = None
+
+    def start(self, send_payload, batch_size=None):
+        """Starts sending the actions with send_payload(payload, address)"""
+
+        self.asn_send_payload = send_payload
+        self.asn_batch_size = batch_size
+        self.asn_to_stop = False
+        self.asn_flush_event.clear()
+        self.asn_thread = threading.Thread(target=self.run_actions_background)
+        self.asn_thread.start()
+
+    def stop(self):
+        """Stops sending, the actions queued until then are still sent"""
+
+        if self.asn_thread is None:
+            return
+        self.asn_to_stop = True
+        self.asn_flush_event.set()
+        self.asn_thread.join()
+        self.asn_thread = None
+
+    def add(self, action):
+        """Queues an action"""
+
+        player = action.get(BnConstants.ACTION_PLAYER_TAG)
+        bodypart = action.get(BnConstants.ACTION_BODYPART_TAG)
+        action_type = action.get(BnConstants.ACTION_TYPE_TAG)
+        coalesce_key = None
+        if action_type in coalesced_actions:
+            coalesce_tag = coalesced_actions[action_type]
+            coalesce_key = (
+                player,
+                bodypart,
+                action_type,
+                None if coalesce_tag is None else action.get(coalesce_tag),
+            )
+        # Encoded once here, the actions thread only sends the bytes
+        self.asn_queue.append(
+            (player, bodypart, coalesce_key, json.dumps(action).encode("utf-8"))
+        )
+
+    def flush(self):
+        """Wakes up the thread to send the queued actions, without waiting for them to be sent"""
+
+        self.asn_flush_event.set()
+
+    def clear(self):
+        """Forgets the queued actions"""
+
+        self.asn_queue.clear()
+
+    def run_actions_background(self):
+        """Actions runner function, it sends the queued actions each time they are flushed"""
+
+        while not self.asn_to_stop:
+            self.asn_flush_event.wait()
+            self.asn_flush_event.clear()
+            if not self.asn_to_stop:
+                self.__send_actions()
+        # The actions queued before stopping are still sent
+        self.__send_actions()
+
+    # Private functions
+
+    def __send_actions(self):
+        """Sends the queued actions, the types in coalesced_actions only send their latest action"""
+
+        latest_payloads = {}
+        actions = self.asn_queue
+        num_actions = 0
+        while actions:
+            player, bodypart, coalesce_key, payload = actions.popleft()
+            num_actions += 1
+            if coalesce_key is None:
+                # Never replaced
+                coalesce_key = num_actions
+            latest_payloads[coalesce_key] = (player, bodypart, payload)
+
+        # (ip_address, port) => encoded actions
+        payloads = {}
+        for player, bodypart, payload in latest_payloads.values():
+            address = self.asn_get_address(player, bodypart)
+            if address is None:
+                print("Player+Bodypart connection not existing\n")
+                continue
+            if address not in payloads:
+                payloads[address] = []
+            payloads[address].append(payload)
+
+        for address, encoded_actions in payloads.items():
+            if self.asn_batch_size is not None:
+                encoded_actions = self.__batch_payloads(encoded_actions)
+            for payload in encoded_actions:
+                try:
+                    self.asn_send_payload(payload, address)
+                except OSError as err:
+                    print("Cannot send the action: ", err)
+
+    def __batch_payloads(self, encoded_actions):
+        """Joins the encoded actions in datagrams not longer than the batch size"""
+
+        datagrams = []
+        datagram = b""
+        for payload in encoded_actions:
+            if datagram and len(datagram) + len(payload) > self.asn_batch_size:
+                datagrams.append(datagram)
+                datagram = b""
+            datagram += payload
+        if datagram:
+            datagrams.append(datagram)
+        return datagrams
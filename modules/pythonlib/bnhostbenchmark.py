@@ -0,0 +1,455 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Benchmarks of the Bodynode Wifi Host, end to end against simulated nodes and micro benchmarks of the hot path.
+The results are written as json, a previous result can be given to compare them.
+Example: python3 bnhostbenchmark.py --output after.json --compare before.json
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+from bncommon import BnConstants
+from bnhostcapture import BnCaptureReader
+from bnhostutils import BnJsonDecoder, BnJsonFramer, BnListenerRoutes, bodynodes_json
+from bnnodesimulator import encode_batch, run_simulation
+from bnwifibodynodeshost import BnWifiHostCommunicator, BodynodeListener
+
+bodynodes_benchmark = {
+    # Streams and rates of the end to end scenarios, each simulated node sends one stream
+    "streams": [11, 33, 110, 220],
+    "rates_hz": [50, 100, 200],
+    # Host options of each engine
+    "engines": {
+        "data_thread": {"kernel_drop_counters": True},
+        "ingest_shards_2": {"ingest_shards": 2, "kernel_drop_counters": True},
+    },
+    "duration_s": 5,
+    # Processes running the simulated nodes
+    "simulator_processes": 2,
+    # Seconds left to the host to handle the last datagrams
+    "drain_s": 0.5,
+    # Latencies kept to compute the percentiles
+    "max_latencies": 200000,
+    # Json payloads of a capture used to compare the json backends
+    "max_payloads": 1000,
+    # Messages of the batched datagrams of a super node
+    "batch_messages": 11,
+}
+
+benchmark_datagram = json.dumps(
+    {
+        BnConstants.MESSAGE_PLAYER_TAG: "mario",
+        BnConstants.MESSAGE_BODYPART_TAG: BnConstants.BODYPART_KATANA_TAG,
+        BnConstants.MESSAGE_SENSORTYPE_TAG: BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
+        BnConstants.MESSAGE_VALUE_TAG: [0.7071, 0.0, 0.7071, 0.0],
+    }
+).encode("utf-8")
+
+
+class BnBenchmarkListener(BodynodeListener):
+    """Listener counting the samples and measuring their latency from the simulated node"""
+
+    def __init__(self, max_latencies):
+        self.bl_num_samples = 0
+        self.bl_latencies = []
+        self.bl_max_latencies = max_latencies
+
+    def on_message_received(self, player, bodypart, sensortype, value):
+        self.bl_num_samples += 1
+        if len(self.bl_latencies) < self.bl_max_latencies:
+            # The simulator stamps the last element with its time.monotonic()
+            self.bl_latencies.append(time.monotonic() - value[-1])
+
+    def is_of_interest(self, player, bodypart, sensortype):
+        return True
+
+    def get_num_samples(self):
+        """Returns the number of samples received"""
+
+        return self.bl_num_samples
+
+    def get_latencies(self):
+        """Returns the latencies (s) measured"""
+
+        return self.bl_latencies
+
+
+class BnNullListener(BodynodeListener):
+    """Listener doing nothing, to measure the dispatch itself"""
+
+    def on_message_received(self, player, bodypart, sensortype, value):
+        return None
+
+    def is_of_interest(self, player, bodypart, sensortype):
+        return True
+
+
+def get_cpu_seconds(pids):
+    """Returns the user+system CPU seconds used by the processes, read from /proc"""
+
+    total = 0.0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", encoding="utf-8") as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime, fields 14 and 15 of proc(5)
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return total
+
+
+def get_percentiles(values):
+    """Returns the p50, p90, p99 and max of the values in ms, None if there are none"""
+
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    return {
+        name: ordered[min(len(ordered) - 1, len(ordered) * rank // 100)] * 1000
+        for name, rank in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+    }
+
+
+def run_simulation_process(options, results):
+    """Process function, it runs the simulated nodes out of the host process"""
+
+    results.put(run_simulation(options))
+
+
+def get_kernel_drops(communicator):
+    """Returns the datagrams dropped by the kernel in the receiving sockets of a communicator"""
+
+    return sum(
+        socket_stats["kernel_drops"] or 0
+        for socket_stats in communicator.get_socket_stats().values()
+    )
+
+
+def run_scenario(engine_options, streams, rate_hz):
+    """Runs the host against the simulated nodes. Returns the measures"""
+
+    communicator = BnWifiHostCommunicator()
+    communicator.start(["BN", dict(engine_options)])
+    listener = BnBenchmarkListener(bodynodes_benchmark["max_latencies"])
+    communicator.add_listener(listener)
+    pids = [os.getpid()] + communicator.whc_shard_pool.get_pids()
+
+    results = multiprocessing.Queue()
+    simulator = multiprocessing.Process(
+        target=run_simulation_process,
+        args=(
+            {
+                "host": "127.0.0.1",
+                "nodes": streams,
+                "rate_hz": rate_hz,
+                "sensortypes": [BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG],
+                "processes": bodynodes_benchmark["simulator_processes"],
+                "duration_s": bodynodes_benchmark["duration_s"],
+                "stamp_values": True,
+            },
+            results,
+        ),
+    )
+    cpu_start = get_cpu_seconds(pids)
+    wall_start = time.perf_counter()
+    simulator.start()
+    report = results.get()
+    simulator.join()
+    time.sleep(bodynodes_benchmark["drain_s"])
+    cpu_pct = (
+        100 * (get_cpu_seconds(pids) - cpu_start) / (time.perf_counter() - wall_start)
+    )
+    kernel_drops = get_kernel_drops(communicator)
+    communicator.stop()
+
+    sent = report["messages"] - report["lost"]
+    received = listener.get_num_samples()
+    return {
+        "streams": streams,
+        "rate_hz": rate_hz,
+        "connected": report["connected"],
+        "sent": sent,
+        "received": received,
+        "samples_per_s": received / report["elapsed_s"],
+        "loss_pct": 100 * (sent - received) / max(sent, 1),
+        # Datagrams dropped by the kernel as the receive buffer was full
+        "kernel_drops": kernel_drops,
+        "cpu_pct": cpu_pct,
+        "latency_ms": get_percentiles(listener.get_latencies()),
+    }
+
+
+def time_operation(operation, number):
+    """Returns the best time of an operation in ns"""
+
+    return (
+        min(timeit.repeat(operation, number=number, repeat=5)) / number * 1_000_000_000
+    )
+
+
+def run_micro_benchmarks(number):
+    """Runs the micro benchmarks of the hot path. Returns the ns of each operation"""
+
+    framer = BnJsonFramer()
+    batch_datagram = benchmark_datagram * 3
+
+    communicator = BnWifiHostCommunicator()
+    communicator.start(["BN", {"offline": True}])
+    address = ("127.0.0.1", 50000)
+    communicator.inject_datagram(address, benchmark_datagram)
+    connection_data = communicator.whc_connections.get_connection(address)
+    connection_data["received_bytes"] = benchmark_datagram
+    connection_data["num_received_bytes"] = len(benchmark_datagram)
+    messages = [json.loads(benchmark_datagram)]
+    # pylint: disable=protected-access # reason: The private hot path functions are measured on their own
+    parse_messages = communicator._BnWifiHostCommunicator__parse_messages
+    check_for_ackn = communicator._BnWifiHostCommunicator__check_for_ackn
+    # pylint: enable=protected-access
+
+    routes = BnListenerRoutes()
+    for _ in range(4):
+        routes.add(BnNullListener())
+    stream_key = ("mario", BnConstants.BODYPART_KATANA_TAG, "orientation_abs")
+    value = [0.7071, 0.0, 0.7071, 0.0]
+
+    results = {
+        "framer_feed_ns": time_operation(
+            lambda: framer.feed(benchmark_datagram), number
+        ),
+        "framer_feed_batch3_ns": time_operation(
+            lambda: framer.feed(batch_datagram), number
+        ),
+        "parse_messages_ns": time_operation(
+            lambda: parse_messages(address, messages), number
+        ),
+        "check_for_ackn_ns": time_operation(
+            lambda: check_for_ackn(connection_data), number
+        ),
+        "inject_datagram_ns": time_operation(
+            lambda: communicator.inject_datagram(address, benchmark_datagram), number
+        ),
+        "listener_dispatch_4_ns": time_operation(
+            lambda: routes.dispatch(0, stream_key, value), number
+        ),
+    }
+    communicator.stop()
+    return results
+
+
+def load_payloads(path):
+    """Returns the json payloads of a capture, or the simulator payloads when path is None"""
+
+    if path is None:
+        return [
+            benchmark_datagram,
+            json.dumps(
+                {
+                    BnConstants.MESSAGE_PLAYER_TAG: "mario",
+                    BnConstants.MESSAGE_BODYPART_TAG: BnConstants.BODYPART_UPPERARM_LEFT_TAG,
+                    BnConstants.MESSAGE_SENSORTYPE_TAG: BnConstants.SENSORTYPE_ACCELERATION_REL_TAG,
+                    BnConstants.MESSAGE_VALUE_TAG: [0.0012, -9.8061, 0.2173],
+                }
+            ).encode("utf-8"),
+            json.dumps(
+                {
+                    BnConstants.MESSAGE_PLAYER_TAG: "mario",
+                    BnConstants.MESSAGE_BODYPART_TAG: BnConstants.BODYPART_LOWERARM_RIGHT_TAG,
+                    BnConstants.MESSAGE_SENSORTYPE_TAG: BnConstants.SENSORTYPE_GLOVE_TAG,
+                    BnConstants.MESSAGE_VALUE_TAG: [90, 87, 64, 31, 12, 0, 1, 0, 1],
+                }
+            ).encode("utf-8"),
+        ]
+
+    payloads = []
+    reader = BnCaptureReader(path)
+    for _, _, _, payload in reader.records():
+        if payload[:1] == b"{":
+            payloads.append(bytes(payload))
+            if len(payloads) == bodynodes_benchmark["max_payloads"]:
+                break
+    reader.close()
+    return payloads
+
+
+def run_json_benchmarks(number, payloads):
+    """Feeds the payloads to a framer with each installed json backend. Returns the ns per payload of each backend"""
+
+    results = {}
+    for backend in bodynodes_json["backends"]:
+        if importlib.util.find_spec(backend) is None:
+            continue
+        framer = BnJsonFramer(BnJsonDecoder(backend))
+
+        def feed_payloads(framer=framer):
+            for payload in payloads:
+                framer.feed(payload)
+
+        results[f"framer_feed_{backend}_ns"] = time_operation(
+            feed_payloads, max(1, number // len(payloads))
+        ) / len(payloads)
+    return results
+
+
+def run_batch_benchmarks(number):
+    """Feeds the datagram of a super node batching messages in each format, and the messages one per datagram.
+    Returns the ns per message of each format"""
+
+    num_messages = bodynodes_benchmark["batch_messages"]
+    messages = [benchmark_datagram] * num_messages
+    results = {}
+    framer = BnJsonFramer()
+    results["one_per_datagram_ns"] = (
+        time_operation(
+            lambda: [framer.feed(message) for message in messages],
+            max(1, number // num_messages),
+        )
+        / num_messages
+    )
+    for batch_format in ("concatenated", "array", "ndjson"):
+        framer = BnJsonFramer()
+        datagram = encode_batch(messages, batch_format)
+        results[f"{batch_format}_ns"] = (
+            time_operation(
+                lambda framer=framer, datagram=datagram: framer.feed(datagram),
+                max(1, number // num_messages),
+            )
+            / num_messages
+        )
+    return results
+
+
+def get_git_commit():
+    """Returns the commit of the working tree, None if it is not known"""
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten_results(results, prefix=""):
+    """Returns the numeric results as {"path/of/the/measure": number}"""
+
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten_results(value, f"{prefix}{key}/"))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare_results(old_results, new_results):
+    """Prints the measures of both results and their change"""
+
+    old_flat = flatten_results(old_results["benchmarks"])
+    new_flat = flatten_results(new_results["benchmarks"])
+    print(f"{'measure':<60} {'old':>12} {'new':>12} {'change':>8}")
+    for measure, new_value in new_flat.items():
+        old_value = old_flat.get(measure)
+        if old_value is None:
+            continue
+        change = (
+            f"{100 * (new_value - old_value) / abs(old_value):+.1f}%"
+            if old_value
+            else "n/a"
+        )
+        print(f"{measure:<60} {old_value:>12.2f} {new_value:>12.2f} {change:>8}")
+
+
+def main():
+    """Main function running the benchmarks"""
+
+    parser = argparse.ArgumentParser(description="Benchmarks the Bodynodes Wifi host")
+    parser.add_argument("--output", default="bnhostbenchmark.json")
+    parser.add_argument("--compare", help="previous results to compare with")
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer and shorter scenarios"
+    )
+    parser.add_argument(
+        "--micro-only", action="store_true", help="skip the end to end scenarios"
+    )
+    parser.add_argument(
+        "--payloads",
+        help="capture whose json payloads compare the json backends, the simulator ones by default",
+    )
+    arguments = parser.parse_args()
+
+    if arguments.quick:
+        bodynodes_benchmark["streams"] = [11, 33]
+        bodynodes_benchmark["rates_hz"] = [50, 100]
+        bodynodes_benchmark["duration_s"] = 2
+
+    number = 2000 if arguments.quick else 20000
+    benchmarks = {
+        "micro": run_micro_benchmarks(number),
+        "json_backends": run_json_benchmarks(number, load_payloads(arguments.payloads)),
+        "batches": run_batch_benchmarks(number),
+    }
+    if not arguments.micro_only:
+        for engine, engine_options in bodynodes_benchmark["engines"].items():
+            benchmarks[engine] = {}
+            for streams in bodynodes_benchmark["streams"]:
+                for rate_hz in bodynodes_benchmark["rates_hz"]:
+                    print(f"Running {engine} with {streams} streams at {rate_hz} Hz")
+                    benchmarks[engine][f"{streams}x{rate_hz}hz"] = run_scenario(
+                        engine_options, streams, rate_hz
+                    )
+
+    results = {
+        "commit": get_git_commit(),
+        "time": time.time(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "benchmarks": benchmarks,
+    }
+    with open(arguments.output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written in {arguments.output}")
+
+    if arguments.compare is not None:
+        with open(arguments.compare, encoding="utf-8") as compare_file:
+            compare_results(json.load(compare_file), results)
+
+
+if __name__ == "__main__":
+    main()
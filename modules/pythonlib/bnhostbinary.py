@@ -0,0 +1,131 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Module with the binary frames the Bodynodes can send to the WiFi Bodynode Host next to the json messages.
+"""
+
+import struct
+
+# Binary frames, all fields are big-endian:
+#   header: magic (1 byte) | frame type (1 byte) | count (1 byte)
+#   "declare" frame, followed by count declarations of:
+#       stream id (1 byte) | length (1 byte) | "player|bodypart|sensortype" in utf-8
+#   "samples" frame, followed by count samples of:
+#       stream id (1 byte) | number of values (1 byte) | values as float32
+# Stream ids are chosen by the node and are valid only for its connection
+bodynodes_binary = {
+    # It cannot be the first byte of a json or ACKN message
+    "magic": 0xBD,
+    "frame_declare": 0x01,
+    "frame_samples": 0x02,
+    "max_values": 16,
+}
+
+binary_structs = {
+    "header": struct.Struct(">BBB"),
+    "item": struct.Struct(">BB"),
+    "values": [
+        struct.Struct(f">{num_values}f")
+        for num_values in range(bodynodes_binary["max_values"] + 1)
+    ],
+}
+
+
+def is_binary_frame(message_bytes):
+    """Returns true if the bytes hold a binary frame, false otherwise"""
+
+    return len(message_bytes) > 0 and message_bytes[0] == bodynodes_binary["magic"]
+
+
+class BnBinaryFramer:  # pylint: disable=too-few-public-methods # reason: Like BnJsonFramer, feed() is all a connection needs
+    """Decoder of the binary frames of a connection, it keeps the streams the node declared.
+    The streams are interned in stream_table, a BnStreamTable. The invalid frames are counted in stats, a BnConnectionStats
+    """
+
+    def __init__(self, stream_table, stats):
+        self.bf_stream_table = stream_table
+        self.bf_stats = stats
+        # Binary stream id => id in the stream table
+        self.bf_streams = {}
+
+    def feed(self, message_bytes):
+        """Feeds a binary frame (bytes or memoryview). Returns the list of (stream_id, values) samples found"""
+
+        samples = []
+        try:
+            _, frame_type, count = binary_structs["header"].unpack_from(
+                message_bytes, 0
+            )
+            if frame_type == bodynodes_binary["frame_declare"]:
+                self.__decode_declarations(message_bytes, count)
+            elif frame_type == bodynodes_binary["frame_samples"]:
+                self.__decode_samples(message_bytes, count, samples)
+            else:
+                print(f"Unknown binary frame type {frame_type}")
+        except (struct.error, IndexError, UnicodeDecodeError) as err:
+            print("Not a valid binary frame: ", err)
+            self.bf_stats.add_decode_errors()
+        return samples
+
+    # Private functions
+
+    def __decode_declarations(self, message_bytes, count):
+        """Decodes the stream declarations of a binary frame"""
+
+        offset = binary_structs["header"].size
+        for _ in range(count):
+            stream_id, length = binary_structs["item"].unpack_from(
+                message_bytes, offset
+            )
+            offset += binary_structs["item"].size
+            key = (
+                bytes(message_bytes[offset : offset + length])
+                .decode("utf-8")
+                .split("|")
+            )
+            offset += length
+            if len(key) != 3:
+                print("Binary stream declaration is incomplete")
+                continue
+            self.bf_streams[stream_id] = self.bf_stream_table.intern_stream(
+                key[0], key[1], key[2]
+            )
+
+    def __decode_samples(self, message_bytes, count, samples):
+        """Decodes the samples of a binary frame, appending them to samples"""
+
+        offset = binary_structs["header"].size
+        for _ in range(count):
+            stream_id, num_values = binary_structs["item"].unpack_from(
+                message_bytes, offset
+            )
+            offset += binary_structs["item"].size
+            values_struct = binary_structs["values"][num_values]
+            values = values_struct.unpack_from(message_bytes, offset)
+            offset += values_struct.size
+            if stream_id not in self.bf_streams:
+                print(f"Binary stream {stream_id} was not declared")
+                continue
+            samples.append((self.bf_streams[stream_id], list(values)))
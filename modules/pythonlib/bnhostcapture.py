@@ -0,0 +1,328 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Module with the raw capture of what the Bodynode Hosts receive.
+A capture file starts with capture_header and is followed by records, each one is capture_record,
+then the source address and the payload as received.
+"""
+
+import mmap
+import struct
+import threading
+import time
+
+bodynodes_capture = {
+    # Size of each of the two buffers, a record that does not fit in an empty buffer is dropped
+    "buffer_size": 4 * 1024 * 1024,
+    # Longest time a record waits in a buffer before it is written to the file
+    "flush_interval_s": 0.5,
+}
+
+capture_format = {
+    "magic": b"BNCAP\n",
+    "version": 1,
+    # Magic, version, wall clock time and monotonic time (ns) when the capture started
+    "header": struct.Struct("<6sHqq"),
+    # Monotonic time (ns), payload length, transport tag, address length
+    "record": struct.Struct("<qIBB"),
+}
+capture_transports = {
+    "wifi": 1,
+    "ble": 2,
+    "bluetooth": 3,
+}
+
+
+def decode_capture_address(transport, encoded_address):
+    """Returns the address as the host of the transport uses it, ip:port becomes (ip, port)"""
+
+    address = encoded_address.decode("utf-8")
+    if transport == "bluetooth":
+        return address
+    # Bluetooth addresses have colons, the port or characteristic is after the last one
+    first, second = address.rsplit(":", 1)
+    if transport == "wifi":
+        return (first, int(second))
+    return (first, second)
+
+
+class BnCaptureWriter:  # pylint: disable=too-many-instance-attributes # reason: The buffers state is read in the hot path, attributes are faster than a dict
+    """Appends the received datagrams to a capture file.
+    Records are copied in one of two preallocated buffers, a thread writes the other one to the file
+    """
+
+    def __init__(self, path, transport):
+        # pylint: disable-next=consider-using-with # reason: The file stays open until close()
+        self.cw_file = open(path, "wb")
+        self.cw_path = path
+        self.cw_transport = capture_transports[transport]
+        self.cw_buffers = [
+            bytearray(bodynodes_capture["buffer_size"]),
+            bytearray(bodynodes_capture["buffer_size"]),
+        ]
+        self.cw_active = 0
+        self.cw_used = 0
+        # (buffer index, length) waiting to be written to the file
+        self.cw_full = None
+        self.cw_dropped = 0
+        # Encoded source addresses
+        self.cw_addresses = {}
+        self.cw_condition = threading.Condition()
+        self.cw_to_stop = False
+        self.cw_file.write(
+            capture_format["header"].pack(
+                capture_format["magic"],
+                capture_format["version"],
+                time.time_ns(),
+                time.monotonic_ns(),
+            )
+        )
+        self.cw_thread = threading.Thread(target=self.run_writer_background)
+        self.cw_thread.start()
+
+    def get_path(self):
+        """Returns the path of the capture file"""
+
+        return self.cw_path
+
+    def get_dropped(self):
+        """Returns the number of records dropped because both buffers were full"""
+
+        return self.cw_dropped
+
+    def write(self, address, payload):
+        """Copies a received payload and its source address in the active buffer. Returns False if it was dropped"""
+
+        encoded_address = self.cw_addresses.get(address)
+        if encoded_address is None:
+            encoded_address = self.__encode_address(address)
+            self.cw_addresses[address] = encoded_address
+        timestamp_ns = time.monotonic_ns()
+        record_size = (
+            capture_format["record"].size + len(encoded_address) + len(payload)
+        )
+        with self.cw_condition:
+            if self.cw_used + record_size > len(self.cw_buffers[self.cw_active]):
+                if self.cw_full is not None or record_size > len(self.cw_buffers[0]):
+                    self.cw_dropped += 1
+                    return False
+                self.__swap_buffers()
+            buffer = self.cw_buffers[self.cw_active]
+            offset = self.cw_used
+            capture_format["record"].pack_into(
+                buffer,
+                offset,
+                timestamp_ns,
+                len(payload),
+                self.cw_transport,
+                len(encoded_address),
+            )
+            offset += capture_format["record"].size
+            buffer[offset : offset + len(encoded_address)] = encoded_address
+            offset += len(encoded_address)
+            buffer[offset : offset + len(payload)] = payload
+            self.cw_used = offset + len(payload)
+        return True
+
+    def close(self):
+        """Writes the buffered records and closes the file"""
+
+        with self.cw_condition:
+            self.cw_to_stop = True
+            self.cw_condition.notify()
+        self.cw_thread.join()
+        self.cw_file.write(memoryview(self.cw_buffers[self.cw_active])[: self.cw_used])
+        self.cw_used = 0
+        self.cw_file.close()
+
+    def run_writer_background(self):
+        """Writer runner function, it writes the full buffers, or the active one every flush_interval_s"""
+
+        while True:
+            with self.cw_condition:
+                if self.cw_full is None and not self.cw_to_stop:
+                    self.cw_condition.wait(bodynodes_capture["flush_interval_s"])
+                if self.cw_full is None:
+                    if self.cw_to_stop:
+                        return
+                    if self.cw_used == 0:
+                        continue
+                    self.__swap_buffers()
+                index, length = self.cw_full
+            try:
+                self.cw_file.write(memoryview(self.cw_buffers[index])[:length])
+                self.cw_file.flush()
+            except OSError as err:
+                print("Cannot write the capture: ", err)
+            with self.cw_condition:
+                self.cw_full = None
+
+    # Private functions
+
+    def __swap_buffers(self):
+        """Hands the active buffer to the writer thread and continues in the other one, the lock must be held"""
+
+        self.cw_full = (self.cw_active, self.cw_used)
+        self.cw_active = 1 - self.cw_active
+        self.cw_used = 0
+        self.cw_condition.notify()
+
+    def __encode_address(self, address):
+        """Returns the address as bytes, (ip, port) becomes ip:port"""
+
+        if isinstance(address, tuple):
+            address = f"{address[0]}:{address[1]}"
+        return str(address).encode("utf-8")[:255]
+
+
+class BnCaptureReader:
+    """Reads a capture file, it is memory mapped"""
+
+    def __init__(self, path):
+        with open(path, "rb") as capture_file:
+            self.cr_map = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = capture_format["header"]
+        if len(self.cr_map) < header.size:
+            self.cr_map.close()
+            raise ValueError(f"{path} is not a capture file")
+        magic, version, wall_time_ns, monotonic_ns = header.unpack_from(self.cr_map, 0)
+        if magic != capture_format["magic"] or version != capture_format["version"]:
+            self.cr_map.close()
+            raise ValueError(f"{path} is not a capture file of version {version}")
+        self.cr_start = (wall_time_ns, monotonic_ns)
+        self.cr_transports = {tag: name for name, tag in capture_transports.items()}
+
+    def get_start(self):
+        """Returns the wall clock time and the monotonic time (ns) when the capture started"""
+
+        return self.cr_start
+
+    def records(self):
+        """Yields (monotonic time in ns, transport, address, payload) of each record.
+        A record truncated at the end of the file is skipped
+        """
+
+        record = capture_format["record"]
+        capture_map = self.cr_map
+        offset = capture_format["header"].size
+        while offset + record.size <= len(capture_map):
+            timestamp_ns, payload_length, transport, address_length = (
+                record.unpack_from(capture_map, offset)
+            )
+            offset += record.size
+            end = offset + address_length + payload_length
+            if end > len(capture_map):
+                return
+            transport = self.cr_transports.get(transport)
+            yield (
+                timestamp_ns,
+                transport,
+                decode_capture_address(
+                    transport, capture_map[offset : offset + address_length]
+                ),
+                capture_map[offset + address_length : end],
+            )
+            offset = end
+
+    def close(self):
+        """Unmaps the file"""
+
+        self.cr_map.close()
+
+
+class BnCaptureReplay:
+    """Injects the records of a capture in a host, e.g. BnWifiHostCommunicator.inject_datagram.
+    speed is 1 for real time, N for N times faster, 0 for as fast as possible. loops 0 replays until stop()
+    """
+
+    def __init__(self, path, transport, inject, speed=1.0, loops=1):
+        self.crp_reader = BnCaptureReader(path)
+        self.crp_transport = transport
+        self.crp_inject = inject
+        self.crp_speed = speed
+        self.crp_loops = loops
+        self.crp_stop_event = threading.Event()
+        self.crp_report = None
+
+    def run(self):
+        """Replays the capture and returns the report with the throughput, it is dumpable as json"""
+
+        report = {"records": 0, "bytes": 0, "skipped": 0, "loops": 0}
+        self.crp_report = report
+        start_time = time.perf_counter()
+        try:
+            while not self.crp_stop_event.is_set() and (
+                self.crp_loops == 0 or report["loops"] < self.crp_loops
+            ):
+                self.__replay_once(report)
+                report["loops"] += 1
+        finally:
+            # The report is complete even when the replay is interrupted
+            report["elapsed_s"] = time.perf_counter() - start_time
+            report["records_per_s"] = report["records"] / max(report["elapsed_s"], 1e-9)
+            report["mbytes_per_s"] = (
+                report["bytes"] / 1e6 / max(report["elapsed_s"], 1e-9)
+            )
+        return report
+
+    def get_report(self):
+        """Returns the report of the latest run, None if it never ran"""
+
+        return self.crp_report
+
+    def stop(self):
+        """Stops the replay, run() returns its report"""
+
+        self.crp_stop_event.set()
+
+    def close(self):
+        """Closes the capture"""
+
+        self.crp_reader.close()
+
+    # Private functions
+
+    def __replay_once(self, report):
+        """Injects all the records once, pacing them as they were received"""
+
+        first_ns = None
+        start_ns = time.monotonic_ns()
+        for timestamp_ns, transport, address, payload in self.crp_reader.records():
+            if transport != self.crp_transport:
+                report["skipped"] += 1
+                continue
+            if first_ns is None:
+                first_ns = timestamp_ns
+            if self.crp_speed > 0:
+                wait_ns = (timestamp_ns - first_ns) / self.crp_speed - (
+                    time.monotonic_ns() - start_ns
+                )
+                if wait_ns > 0 and self.crp_stop_event.wait(wait_ns / 1e9):
+                    return
+            elif self.crp_stop_event.is_set():
+                return
+            self.crp_inject(address, payload)
+            report["records"] += 1
+            report["bytes"] += len(payload)
@@ -0,0 +1,195 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Module with the connections of the nodes to the WiFi Bodynode Host.
+"""
+
+import heapq
+import time
+from collections import deque
+
+from bnhostbinary import BnBinaryFramer
+from bnhoststats import BnConnectionStats
+from bnhostutils import BnJsonFramer
+
+
+class BnConnectionTable:
+    """Data of the connections of the nodes by (ip_address, port), with their received datagrams and keep-alive checks.
+    States: IS_WAITING_ACK -> CONNECTED -> STALE -> DISCONNECTED, on_disconnected() is called when a connection gets disconnected
+    """
+
+    def __init__(self, on_disconnected):
+        self.cnt_on_disconnected = on_disconnected
+        # Map the connections data to the (ip_address, port) of a connection (key)
+        self.cnt_connections = {}
+        # Connections with received datagrams not processed yet
+        self.cnt_pending = deque()
+        # Heap of (deadline, address) of the keep-alive checks of the connections
+        self.cnt_timers = []
+        self.cnt_messages = None
+        self.cnt_json_decoder = None
+        self.cnt_options = None
+
+    def start(self, messages, json_decoder, options):
+        """Empties the table. The connections parse into the messages table with json_decoder, options are the host options"""
+
+        self.cnt_connections = {}
+        self.cnt_pending = deque()
+        self.cnt_timers = []
+        self.cnt_messages = messages
+        self.cnt_json_decoder = json_decoder
+        self.cnt_options = options
+
+    def get_connection(self, address, status="IS_WAITING_ACK"):
+        """Returns the data of the connection of address, a new connection starts in status"""
+
+        if address not in self.cnt_connections:
+            new_connection_data = {}
+            new_connection_data["STATUS"] = status
+            new_connection_data["address"] = address
+            new_connection_data["ip_address"] = address[0]
+            new_connection_data["last_rec_time"] = round(time.time() * 1000)
+            # True while it is in the pending connections
+            new_connection_data["pending"] = False
+            # True while it is in the keep-alive timers
+            new_connection_data["timer_armed"] = False
+            new_connection_data["received_bytes"] = None
+            new_connection_data["num_received_bytes"] = 0
+            # Receive and parsing times in ns of the datagram being handled
+            new_connection_data["receive_ns"] = 0
+            new_connection_data["parse_ns"] = 0
+            new_connection_data["received_queue"] = deque(
+                maxlen=self.cnt_options["connection_queue_size"]
+            )
+            new_connection_data["dropped_datagrams"] = 0
+            # Samples of an ingest worker dropped because its ring was full
+            new_connection_data["dropped_samples"] = 0
+            new_connection_data["framer"] = BnJsonFramer(self.cnt_json_decoder)
+            new_connection_data["stats"] = BnConnectionStats()
+            new_connection_data["binary_framer"] = BnBinaryFramer(
+                self.cnt_messages, new_connection_data["stats"]
+            )
+            self.cnt_connections[address] = new_connection_data
+
+        return self.cnt_connections[address]
+
+    def queue_datagram(self, address, message_bytes, status, receive_ns):
+        """Queues a datagram with its monotonic receive time in ns in its connection, a new connection starts in status"""
+
+        connection_data = self.get_connection(address, status)
+        connection_data["stats"].add_datagram()
+        received_queue = connection_data["received_queue"]
+        if len(received_queue) == received_queue.maxlen:
+            # The oldest datagram is pushed out of the queue
+            connection_data["dropped_datagrams"] += 1
+        received_queue.append((message_bytes, receive_ns))
+        if not connection_data["pending"]:
+            connection_data["pending"] = True
+            self.cnt_pending.append(connection_data)
+
+    def take_datagrams(self):
+        """Generator emptying the queued datagrams in order of arrival of their connections.
+        Each one is yielded as its connection data, with received_bytes, receive_ns and parse_ns set to it
+        """
+
+        while self.cnt_pending:
+            connection_data = self.cnt_pending.popleft()
+            connection_data["pending"] = False
+            received_queue = connection_data["received_queue"]
+            while received_queue:
+                message_bytes, receive_ns = received_queue.popleft()
+                connection_data["receive_ns"] = receive_ns
+                connection_data["parse_ns"] = time.monotonic_ns()
+                connection_data["received_bytes"] = message_bytes
+                connection_data["num_received_bytes"] = len(message_bytes)
+                yield connection_data
+            connection_data["received_bytes"] = None
+            connection_data["num_received_bytes"] = 0
+
+    def set_connected(self, connection_data, now):
+        """Marks the connection as receiving data now, arming its keep-alive check if needed"""
+
+        connection_data["STATUS"] = "CONNECTED"
+        connection_data["last_rec_time"] = now
+        if not connection_data["timer_armed"]:
+            connection_data["timer_armed"] = True
+            heapq.heappush(
+                self.cnt_timers,
+                (
+                    now + self.cnt_options["connection_stale_ms"],
+                    connection_data["address"],
+                ),
+            )
+
+    def check_keep_alive(self, now):
+        """Moves the connections whose keep-alive deadline passed to STALE or DISCONNECTED"""
+
+        timers = self.cnt_timers
+        while timers and timers[0][0] <= now:
+            _, address = heapq.heappop(timers)
+            connection_data = self.cnt_connections[address]
+            last_rec_time = connection_data["last_rec_time"]
+            if (
+                now - last_rec_time
+                >= self.cnt_options["connection_keep_alive_rec_interval_ms"]
+            ):
+                connection_data["STATUS"] = "DISCONNECTED"
+                connection_data["timer_armed"] = False
+                self.cnt_on_disconnected()
+                continue
+            if now - last_rec_time >= self.cnt_options["connection_stale_ms"]:
+                connection_data["STATUS"] = "STALE"
+                deadline = (
+                    last_rec_time
+                    + self.cnt_options["connection_keep_alive_rec_interval_ms"]
+                )
+            else:
+                # Data arrived since the timer was armed
+                deadline = last_rec_time + self.cnt_options["connection_stale_ms"]
+            heapq.heappush(timers, (deadline, address))
+
+    def get_stats(self):
+        """Returns a dict with the counters, statistics and status of each connection ("ip_address:port")"""
+
+        stats = {}
+        for address, connection_data in list(self.cnt_connections.items()):
+            connection_str = f"{address[0]}:{address[1]}"
+            connection_stats = connection_data["stats"]
+            connection_stats.set_json_errors(connection_data["framer"].get_num_errors())
+            connection_stats.set_dropped(
+                connection_data["dropped_datagrams"]
+                + connection_data["dropped_samples"]
+            )
+            stats[connection_str] = connection_stats.get_snapshot()
+            stats[connection_str]["status"] = connection_data["STATUS"]
+        return stats
+
+    def get_dropped(self):
+        """Returns the number of datagrams dropped because a connection queue was full"""
+
+        return sum(
+            connection_data["dropped_datagrams"]
+            for connection_data in list(self.cnt_connections.values())
+        )
@@ -0,0 +1,289 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Module with the frame snapshots of the Bodynode Hosts.
+"""
+
+import threading
+import time
+from types import MappingProxyType
+
+bodynodes_frames = {
+    # Longest time a frame waits for all the streams of a player to refresh before it is given anyway
+    "window_ms": 20,
+}
+
+
+class BnFrame:
+    """Immutable snapshot of the latest value of each stream of a player, all taken at the same moment"""
+
+    def __init__(self, player, timestamp_ms, values, versions, complete):
+        self.fr_player = player
+        self.fr_timestamp_ms = timestamp_ms
+        # (bodypart, sensortype) => value, lists are given as tuples
+        self.fr_values = MappingProxyType(values)
+        # (bodypart, sensortype) => number of values received
+        self.fr_versions = MappingProxyType(versions)
+        self.fr_complete = complete
+
+    def get_player(self):
+        """Returns the player of the frame"""
+
+        return self.fr_player
+
+    def get_timestamp(self):
+        """Returns when the frame was taken, same clock as time.time() * 1000"""
+
+        return self.fr_timestamp_ms
+
+    def get_value(self, bodypart, sensortype):
+        """Returns the value of the bodypart+sensortype stream, None if there is none"""
+
+        return self.fr_values.get((bodypart, sensortype))
+
+    def get_values(self):
+        """Returns a read-only mapping of (bodypart, sensortype) => value"""
+
+        return self.fr_values
+
+    def get_version(self, bodypart, sensortype):
+        """Returns how many values of the bodypart+sensortype stream were received, 0 if there are none"""
+
+        return self.fr_versions.get((bodypart, sensortype), 0)
+
+    def is_complete(self):
+        """Returns true if all the streams of the player were refreshed since the previous frame"""
+
+        return self.fr_complete
+
+
+class BnFrameAssembler:
+    """Writes the values in a BnStreamTable under a lock and assembles the frames of the players.
+    Frames can be taken on request with get_frame or given to a callback as soon as they are complete
+    """
+
+    def __init__(self):
+        self.fa_table = None
+        self.fa_condition = threading.Condition()
+        # player => stream ids
+        self.fa_players = {}
+        # Number of threads waiting in get_frame
+        self.fa_waiters = 0
+        self.fa_callback = {
+            "on_frame": None,
+            "window_ms": bodynodes_frames["window_ms"],
+            # player => (time of the first refresh, stream ids refreshed since the previous frame)
+            "pending": {},
+        }
+
+    def set_table(self, table):
+        """Sets the table where the values are written, the players are forgotten"""
+
+        with self.fa_condition:
+            self.fa_table = table
+            self.fa_players = {}
+            self.fa_callback["pending"] = {}
+
+    def set_callback(self, on_frame, window_ms=None):
+        """Calls on_frame(frame) each time all the streams of a player refreshed, or window_ms after the first of them did.
+        None removes the callback
+        """
+
+        with self.fa_condition:
+            self.fa_callback["on_frame"] = on_frame
+            if window_ms is not None:
+                self.fa_callback["window_ms"] = window_ms
+            self.fa_callback["pending"] = {}
+
+    def store(self, stream_id, value, timestamp_ms=None):
+        """Sets the latest value of the stream, it replaces BnStreamTable.set_value"""
+
+        delivery = None
+        with self.fa_condition:
+            self.fa_table.set_value(stream_id, value, timestamp_ms)
+            player = self.fa_table.get_stream_key(stream_id)[0]
+            if player not in self.fa_players:
+                self.fa_players[player] = []
+            if stream_id not in self.fa_players[player]:
+                self.fa_players[player].append(stream_id)
+            if self.fa_waiters > 0:
+                self.fa_condition.notify_all()
+            if self.fa_callback["on_frame"] is not None:
+                frame = self.__refresh_pending(player, stream_id)
+                if frame is not None:
+                    delivery = (self.fa_callback["on_frame"], frame)
+        # Outside of the lock, the callback can take frames too
+        if delivery is not None:
+            on_frame, frame = delivery
+            # pylint: disable-next=not-callable # reason: Only callables are set by set_callback
+            on_frame(frame)
+
+    def get_value(self, stream_id):
+        """Returns the latest value of the stream, None if there is none. It is read under the lock of store"""
+
+        with self.fa_condition:
+            return self.fa_table.get_value(stream_id)
+
+    def get_message_value(self, player, bodypart, sensortype):
+        """Returns the latest value of the player+bodypart+sensortype stream, None if there is none.
+        It is read under the lock of store"""
+
+        with self.fa_condition:
+            return self.fa_table.get_message_value(player, bodypart, sensortype)
+
+    def get_frame(self, player, wait_ms=0):
+        """Returns the frame of the player, None if it was never received.
+        With wait_ms it first waits up to wait_ms for all the streams of the player to refresh
+        """
+
+        with self.fa_condition:
+            if player not in self.fa_players:
+                return None
+            stream_ids = list(self.fa_players[player])
+            complete = True
+            if wait_ms > 0:
+                versions = [
+                    self.fa_table.get_version(stream_id) for stream_id in stream_ids
+                ]
+                self.fa_waiters += 1
+                try:
+                    complete = self.fa_condition.wait_for(
+                        lambda: all(
+                            self.fa_table.get_version(stream_id) > version
+                            for stream_id, version in zip(stream_ids, versions)
+                        ),
+                        wait_ms / 1000,
+                    )
+                finally:
+                    self.fa_waiters -= 1
+            return self.__assemble(player, stream_ids, complete)
+
+    def wait_for_update(self, stream_keys, timeout_ms, versions=None):
+        """Waits up to timeout_ms for a new value of any of the (player, bodypart, sensortype) stream keys.
+        Returns the list of the keys with a new value, empty if none came.
+        versions (key => version) is the reference of the keys and it is updated with their latest versions, so a loop
+        passing the same dict does not miss the values received between two calls. Without it the reference is the call
+        """
+
+        with self.fa_condition:
+            if versions is None:
+                versions = {key: self.__get_key_version(key) for key in stream_keys}
+            self.fa_waiters += 1
+            try:
+                updated = self.fa_condition.wait_for(
+                    lambda: [
+                        key
+                        for key in stream_keys
+                        if self.__get_key_version(key) > versions.get(key, 0)
+                    ],
+                    timeout_ms / 1000,
+                )
+            finally:
+                self.fa_waiters -= 1
+            for key in stream_keys:
+                versions[key] = self.__get_key_version(key)
+            return updated
+
+    def wait_for_frame(self, player, timeout_ms, since=None):
+        """Waits up to timeout_ms for a new value of any stream of the player. Returns its frame, None if none came.
+        since is the previous frame of the player, so a loop passing it does not miss the values received between two calls.
+        Without it the reference is the call
+        """
+
+        with self.fa_condition:
+            reference = {}
+            for stream_id in self.fa_players.get(player, []):
+                if since is None:
+                    reference[stream_id] = self.fa_table.get_version(stream_id)
+                else:
+                    reference[stream_id] = since.get_version(
+                        *self.fa_table.get_stream_key(stream_id)[1:]
+                    )
+            self.fa_waiters += 1
+            try:
+                refreshed = self.fa_condition.wait_for(
+                    lambda: self.__get_refreshed(player, reference),
+                    timeout_ms / 1000,
+                )
+            finally:
+                self.fa_waiters -= 1
+            if not refreshed:
+                return None
+            stream_ids = self.fa_players[player]
+            return self.__assemble(
+                player, stream_ids, len(refreshed) == len(stream_ids)
+            )
+
+    # Private functions
+
+    def __get_key_version(self, stream_key):
+        """Returns the version of the stream of a (player, bodypart, sensortype) key, 0 if it was never received"""
+
+        if self.fa_table is None:
+            return 0
+        stream_id = self.fa_table.get_stream_id(*stream_key)
+        if stream_id is None:
+            return 0
+        return self.fa_table.get_version(stream_id)
+
+    def __get_refreshed(self, player, reference):
+        """Returns the stream ids of the player with a higher version than in reference (stream id => version)"""
+
+        return [
+            stream_id
+            for stream_id in self.fa_players.get(player, [])
+            if self.fa_table.get_version(stream_id) > reference.get(stream_id, 0)
+        ]
+
+    def __refresh_pending(self, player, stream_id):
+        """Marks the stream as refreshed, returns the frame of the player if it is due"""
+
+        pending = self.fa_callback["pending"]
+        now = time.monotonic()
+        if player not in pending:
+            pending[player] = (now, set())
+        first_refresh, refreshed = pending[player]
+        refreshed.add(stream_id)
+        complete = len(refreshed) == len(self.fa_players[player])
+        if (
+            not complete
+            and (now - first_refresh) * 1000 < self.fa_callback["window_ms"]
+        ):
+            return None
+        del pending[player]
+        return self.__assemble(player, self.fa_players[player], complete)
+
+    def __assemble(self, player, stream_ids, complete):
+        """Returns the frame of the streams, the lock must be held"""
+
+        values = {}
+        versions = {}
+        for stream_id in stream_ids:
+            value = self.fa_table.get_value(stream_id)
+            if value is None:
+                continue
+            key = self.fa_table.get_stream_key(stream_id)[1:]
+            values[key] = tuple(value) if isinstance(value, list) else value
+            versions[key] = self.fa_table.get_version(stream_id)
+        return BnFrame(player, time.time() * 1000, values, versions, complete)
@@ -0,0 +1,91 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Replays a capture written by start_capture in a host started offline, then prints the throughput.
+Example: python3 bnhostreplay.py capture.bin --speed 4 --loops 2
+"""
+
+import argparse
+import json
+
+from bnbluetoothbodynodeshost import BnBluetoothHostCommunicator
+from bnhostcapture import BnCaptureReader, BnCaptureReplay
+from bnwifibodynodeshost import BnWifiHostCommunicator
+
+
+def get_capture_transport(path):
+    """Returns the transport of the first record of the capture, None if it is empty"""
+
+    reader = BnCaptureReader(path)
+    transport = next((record[1] for record in reader.records()), None)
+    reader.close()
+    return transport
+
+
+def main():
+    """Main function replaying a capture"""
+
+    parser = argparse.ArgumentParser(description="Replays a Bodynodes capture")
+    parser.add_argument("path", help="capture file")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="1 is real time, N is N times faster, 0 is as fast as possible",
+    )
+    parser.add_argument(
+        "--loops", type=int, default=1, help="times to replay it, 0 until Ctrl+C"
+    )
+    arguments = parser.parse_args()
+
+    transport = get_capture_transport(arguments.path)
+    if transport == "wifi":
+        communicator = BnWifiHostCommunicator()
+        communicator.start(["BN", {"offline": True}])
+        inject = communicator.inject_datagram
+    elif transport == "bluetooth":
+        communicator = BnBluetoothHostCommunicator()
+        inject = communicator.inject_bytes
+    else:
+        # BLE notifications need the player and bodypart read from the device
+        print(f"Cannot replay a capture with transport {transport}")
+        return
+
+    replay = BnCaptureReplay(
+        arguments.path, transport, inject, arguments.speed, arguments.loops
+    )
+    try:
+        replay.run()
+    except KeyboardInterrupt:
+        print("Replay interrupted")
+    replay.close()
+    report = replay.get_report()
+    report["stats"] = communicator.get_stats()
+    print(json.dumps(report, indent=2))
+    communicator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Module with the ingest workers of the WiFi Bodynode Host, the processes sharing its data port.
+"""
+
+import socket
+import struct
+import time
+import multiprocessing
+import multiprocessing.connection
+
+from bnhoststats import BnLatencyHistogram
+from bnhostutils import BnSampleRing
+
+bodynodes_shards = {
+    # Pause of a worker between two tries to push a sample in a full ring
+    "ring_full_backoff_s": 0.0005,
+    # Seconds between two sendings of the stats of a worker to the host
+    "stats_interval_s": 1,
+}
+
+
+def run_ingest_shard(
+    communicator_class, identifier, options, ring_name, channel, stop_event
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments # reason: Process target, it gets everything the worker needs
+    """Ingest worker process function, it parses its share of the traffic and publishes the samples to the host"""
+
+    shard_options = dict(options)
+    shard_options["ingest_shards"] = 0
+    # The host reports the stats of the workers with its own
+    shard_options["stats_report_interval_s"] = 0
+    communicator = communicator_class()
+    publisher = BnShardPublisher(
+        ring_name, channel, options["shard_ring_full_wait_ms"], communicator.is_running
+    )
+    communicator.set_shard_publisher(publisher)
+    communicator.start([identifier, shard_options])
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        # The host stops the workers
+        stop_event.wait()
+    communicator.stop()
+    publisher.close()
+
+
+class BnShardPool:
+    """Host side, the ingest worker processes. Each one publishes its samples in a ring and
+    sends the streams, stats and wake ups in its channel
+    """
+
+    def __init__(self, on_stream, on_sample, on_disconnected):
+        # (stream_key, address) => id in the messages table of the host
+        self.spl_on_stream = on_stream
+        # (stream_id, value, receive_ns, parse_ns)
+        self.spl_on_sample = on_sample
+        # A node disconnected from a worker
+        self.spl_on_disconnected = on_disconnected
+        self.spl_stop_event = None
+        self.spl_workers = []
+
+    def start(self, communicator_class, identifier, options):
+        """Starts options["ingest_shards"] worker processes, each one running a communicator_class host.
+        It returns when all of them bound the data port, or after shard_start_timeout_s.
+        Returns false if the system cannot share the data port
+        """
+
+        if not hasattr(socket, "SO_REUSEPORT"):
+            print("SO_REUSEPORT is not available, ingesting in the data thread")
+            return False
+        self.spl_stop_event = multiprocessing.Event()
+        self.spl_workers = []
+        for worker_number in range(options["ingest_shards"]):
+            shard_options = dict(options)
+            if shard_options["capture_path"] is not None:
+                shard_options["capture_path"] += f".{worker_number}"
+            ring = BnSampleRing(slots=options["shard_ring_slots"])
+            channel, worker_channel = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=run_ingest_shard,
+                args=(
+                    communicator_class,
+                    identifier,
+                    shard_options,
+                    ring.get_name(),
+                    worker_channel,
+                    self.spl_stop_event,
+                ),
+                daemon=True,
+            )
+            process.start()
+            worker_channel.close()
+            self.spl_workers.append(
+                {
+                    "process": process,
+                    "ring": ring,
+                    "channel": channel,
+                    # Worker stream id => id in the messages table
+                    "streams": {},
+                    # Latest connection stats sent by the worker
+                    "stats": {},
+                    # Latency histograms accumulated from the worker increments
+                    "latency": {},
+                    # Latest socket stats sent by the worker
+                    "socket": {},
+                    # Datagrams the worker dropped because a connection queue was full
+                    "dropped_datagrams": 0,
+                }
+            )
+
+        # SO_REUSEPORT moves the nodes when a worker binds, the host advertises itself when all are bound
+        for worker in self.spl_workers:
+            if not worker["channel"].poll(options["shard_start_timeout_s"]):
+                print("Ingest worker did not start in time")
+                continue
+            worker["channel"].recv()
+        return True
+
+    def stop(self):
+        """Stops the worker processes and frees their rings"""
+
+        if not self.spl_workers:
+            return
+        self.spl_stop_event.set()
+        for worker in self.spl_workers:
+            worker["process"].join(timeout=2)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+                worker["process"].join()
+            if worker["channel"] is not None:
+                worker["channel"].close()
+            worker["ring"].close()
+        self.spl_workers = []
+        self.spl_stop_event = None
+
+    def is_running(self):
+        """Returns true if the workers are running, false otherwise"""
+
+        return bool(self.spl_workers)
+
+    def get_pids(self):
+        """Returns the process ids of the workers"""
+
+        return [worker["process"].pid for worker in self.spl_workers]
+
+    def collect(self, wakeup_connection, timeout_s):
+        """Sleeps until a worker rings, wakeup_connection is readable or timeout_s passed,
+        then delivers the samples of the workers that rang. Returns true if wakeup_connection is readable
+        """
+
+        workers = [
+            worker for worker in self.spl_workers if worker["channel"] is not None
+        ]
+        ready = multiprocessing.connection.wait(
+            [worker["channel"] for worker in workers] + [wakeup_connection],
+            timeout=timeout_s,
+        )
+        for worker in workers:
+            if worker["channel"] in ready:
+                self.__collect_worker(worker)
+        return wakeup_connection in ready
+
+    def merge_stats(self, stats):
+        """Adds the connection stats of the workers to the stats dict of the host"""
+
+        for worker in self.spl_workers:
+            for connection_str, connection_stats in worker["stats"].items():
+                # A node moves to another worker when one restarts, the latest is kept
+                if (
+                    connection_str not in stats
+                    or connection_stats["last_seen_ms"]
+                    < stats[connection_str]["last_seen_ms"]
+                ):
+                    stats[connection_str] = connection_stats
+
+    def merge_latency(self, name, histogram):
+        """Adds the latency histograms called name of the workers to histogram"""
+
+        for worker in self.spl_workers:
+            if name in worker["latency"]:
+                histogram.merge(worker["latency"][name].get_snapshot())
+
+    def reset_latency(self):
+        """Empties the latency histograms of the workers"""
+
+        for worker in self.spl_workers:
+            for histogram in worker["latency"].values():
+                histogram.reset()
+
+    def get_socket_stats(self):
+        """Returns a dict with the socket stats of each worker, "ingest_<worker number>" """
+
+        return {
+            f"ingest_{worker_number}": worker["socket"]
+            for worker_number, worker in enumerate(self.spl_workers)
+            if worker["socket"]
+        }
+
+    def get_dropped(self):
+        """Returns the number of datagrams the workers dropped because a connection queue was full,
+        and of samples dropped because a ring was full
+        """
+
+        return sum(
+            worker["dropped_datagrams"] + worker["ring"].get_dropped()
+            for worker in self.spl_workers
+        )
+
+    # Private functions
+
+    def __collect_worker(self, worker):
+        """Reads the streams and samples published by a worker"""
+
+        self.__read_channel(worker)
+        # The samples keep the receive time of the worker, the parsing is timed when the host delivers them
+        now_ns = time.monotonic_ns()
+        for shard_stream_id, value, receive_ns in worker["ring"].pop_all():
+            if shard_stream_id not in worker["streams"]:
+                # The stream was announced after the channel was read
+                self.__read_channel(worker)
+                if shard_stream_id not in worker["streams"]:
+                    continue
+            self.spl_on_sample(
+                worker["streams"][shard_stream_id], value, receive_ns, now_ns
+            )
+
+    def __read_channel(self, worker):
+        """Handles the messages a worker sent in its channel"""
+
+        try:
+            while worker["channel"].poll():
+                message = worker["channel"].recv()
+                if message[0] == "stream":
+                    _, shard_stream_id, stream_key, address = message
+                    worker["streams"][shard_stream_id] = self.spl_on_stream(
+                        stream_key, address
+                    )
+                elif message[0] == "stats":
+                    _, worker["stats"], worker["dropped_datagrams"] = message
+                elif message[0] == "socket":
+                    worker["socket"] = message[1]
+                elif message[0] == "latency":
+                    _, name, snapshot = message
+                    if name not in worker["latency"]:
+                        worker["latency"][name] = BnLatencyHistogram()
+                    worker["latency"][name].merge(snapshot)
+                elif message[0] == "disconnected":
+                    self.spl_on_disconnected()
+                elif message[0] == "value" and message[1] in worker["streams"]:
+                    self.spl_on_sample(
+                        worker["streams"][message[1]],
+                        message[2],
+                        message[3],
+                        time.monotonic_ns(),
+                    )
+        except (EOFError, OSError):
+            print("Ingest worker stopped unexpectedly")
+            worker["channel"].close()
+            worker["channel"] = None
+
+
+class BnShardPublisher:
+    """Worker side, publishes the streams and samples parsed by an ingest worker to the host.
+    The sending functions return false when the host is gone
+    """
+
+    def __init__(self, ring_name, channel, ring_full_wait_ms, is_running):
+        self.spb_ring = BnSampleRing(ring_name)
+        self.spb_channel = channel
+        # Longest time to wait for the host to make room in a full ring
+        self.spb_ring_full_wait_s = ring_full_wait_ms / 1000
+        # Returns false when the worker is stopping
+        self.spb_is_running = is_running
+        # Samples published since the last doorbell
+        self.spb_num_published = 0
+        # Last time the stats were sent to the host
+        self.spb_stats_sent_time = 0.0
+
+    def send_ready(self):
+        """Tells the host the worker bound the data port"""
+
+        self.spb_channel.send(("ready",))
+
+    def publish_stream(self, stream_id, stream_key, address):
+        """Tells the host about a new stream, before any of its samples"""
+
+        self.spb_channel.send(("stream", stream_id, stream_key, address))
+
+    def publish(self, stream_id, value, receive_ns):
+        """Publishes a sample value and its receive time. Returns false if the ring stayed full and it was dropped"""
+
+        try:
+            published = self.spb_ring.push(
+                stream_id, value, receive_ns
+            ) or self.__wait_for_ring_room(stream_id, value, receive_ns)
+        except (TypeError, IndexError, struct.error):
+            # Strings, nested values and so on take the slow way
+            self.spb_channel.send(("value", stream_id, value, receive_ns))
+            published = True
+        if published:
+            self.spb_num_published += 1
+        else:
+            self.spb_ring.add_dropped()
+        return published
+
+    def ring_doorbell(self, force=False):
+        """Wakes up the host if samples were published since the last call, or always with force"""
+
+        if self.spb_num_published == 0 and not force:
+            return True
+        self.spb_num_published = 0
+        return self.__send(("doorbell",))
+
+    def is_stats_due(self):
+        """Returns true if stats_interval_s passed since the stats were sent"""
+
+        return (
+            time.monotonic() - self.spb_stats_sent_time
+            >= bodynodes_shards["stats_interval_s"]
+        )
+
+    def send_stats(self, stats, dropped_datagrams, socket_stats, latency=None):
+        """Sends the connection stats, the socket stats and the latency histogram snapshots (name => snapshot) to the host"""
+
+        self.spb_stats_sent_time = time.monotonic()
+        messages = [("stats", stats, dropped_datagrams), ("socket", socket_stats)]
+        for name, snapshot in (latency or {}).items():
+            messages.append(("latency", name, snapshot))
+        return all(self.__send(message) for message in messages)
+
+    def send_disconnected(self):
+        """Asks the host to advertise itself quickly again"""
+
+        return self.__send(("disconnected",))
+
+    def close(self):
+        """Closes the ring and the channel"""
+
+        self.spb_ring.close()
+        self.spb_channel.close()
+
+    # Private functions
+
+    def __send(self, message):
+        """Sends a message to the host. Returns false if the host is gone"""
+
+        try:
+            self.spb_channel.send(message)
+        except OSError:
+            return False
+        return True
+
+    def __wait_for_ring_room(self, stream_id, value, receive_ns):
+        """The ring is full. Wakes up the host and retries to push the sample until shard_ring_full_wait_ms.
+        Returns true if it was pushed
+        """
+
+        if not self.ring_doorbell(force=True):
+            return False
+        deadline = time.monotonic() + self.spb_ring_full_wait_s
+        while self.spb_is_running() and time.monotonic() < deadline:
+            time.sleep(bodynodes_shards["ring_full_backoff_s"])
+            if self.spb_ring.push(stream_id, value, receive_ns):
+                return True
+        return False
@@ -0,0 +1,336 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Module with the sockets of the WiFi Bodynode Host, the receiving of the data socket and the multicast beacon.
+"""
+
+import socket
+import struct
+import sys
+import threading
+import time
+
+from bncommon import BnConstants
+
+# Not exposed by the socket module of every Python version, None where they are unknown
+SO_TIMESTAMPNS = getattr(
+    socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None
+)
+SO_RXQ_OVFL = getattr(
+    socket, "SO_RXQ_OVFL", 40 if sys.platform.startswith("linux") else None
+)
+SO_BUSY_POLL = getattr(
+    socket, "SO_BUSY_POLL", 46 if sys.platform.startswith("linux") else None
+)
+
+# Control messages of SO_TIMESTAMPNS (struct timespec) and SO_RXQ_OVFL (drops since the socket was created)
+ancillary_structs = {
+    "timespec": struct.Struct("@qq"),
+    "drops": struct.Struct("@I"),
+}
+
+bodynodes_receive = {
+    # Largest UDP payload
+    "max_datagram_size": 65535,
+    # Linux reports the real length of a truncated datagram, other systems truncate it silently
+    "flags": socket.MSG_TRUNC if sys.platform.startswith("linux") else 0,
+}
+
+
+class BnDatagramReceiver:
+    """Receives the datagrams of the data socket in batches, each one in a preallocated slot.
+    options are the host options, the ones the system does not support are disabled in them
+    """
+
+    def __init__(self, data_socket, options):
+        self.dr_socket = data_socket
+        self.dr_options = options
+        # Preallocated buffers the datagrams of a batch are received in, as memoryview
+        self.dr_slots = []
+        # Buffer sizes granted by the kernel and kernel drops of the socket
+        self.dr_stats = {}
+
+    def configure(self):
+        """Applies the socket options of the host to the data socket, keeping what the kernel granted in the socket stats"""
+
+        self.dr_stats = {
+            "receive_buffer": self.__set_buffer_size(
+                socket.SO_RCVBUF, "socket_receive_buffer"
+            ),
+            "send_buffer": self.__set_buffer_size(
+                socket.SO_SNDBUF, "socket_send_buffer"
+            ),
+            "busy_poll_us": 0,
+            "kernel_drops": None,
+        }
+        if self.dr_options["socket_busy_poll_us"] > 0:
+            try:
+                if SO_BUSY_POLL is None:
+                    raise OSError("SO_BUSY_POLL is not available on this system")
+                self.dr_socket.setsockopt(
+                    socket.SOL_SOCKET,
+                    SO_BUSY_POLL,
+                    self.dr_options["socket_busy_poll_us"],
+                )
+                self.dr_stats["busy_poll_us"] = self.dr_socket.getsockopt(
+                    socket.SOL_SOCKET, SO_BUSY_POLL
+                )
+            except OSError as er:
+                # Raising it over net.core.busy_read needs CAP_NET_ADMIN
+                print("Cannot busy poll the data socket")
+                print(er)
+        if self.dr_options["kernel_timestamps"]:
+            self.__enable_socket_flag("kernel_timestamps", SO_TIMESTAMPNS)
+        if self.dr_options["kernel_drop_counters"]:
+            self.__enable_socket_flag("kernel_drop_counters", SO_RXQ_OVFL)
+        if self.dr_options["kernel_drop_counters"]:
+            self.dr_stats["kernel_drops"] = 0
+
+    def allocate_slots(self):
+        """Preallocates one receive slot for each datagram of a batch, they are reused once the batch is processed"""
+
+        if (
+            self.dr_options["max_datagram_size"]
+            > bodynodes_receive["max_datagram_size"]
+        ):
+            print(
+                f"max_datagram_size is limited to {bodynodes_receive['max_datagram_size']} bytes"
+            )
+            self.dr_options["max_datagram_size"] = bodynodes_receive[
+                "max_datagram_size"
+            ]
+        self.dr_slots = [
+            memoryview(bytearray(self.dr_options["max_datagram_size"]))
+            for _ in range(self.dr_options["receive_batch_size"])
+        ]
+
+    def bind(self, port, reuse_port=False):
+        """Configures the data socket and binds it to port, reuse_port shares the port with other sockets (SO_REUSEPORT).
+        Then it allocates the receive slots
+        """
+
+        try:
+            if reuse_port:
+                self.dr_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.configure()
+            self.dr_socket.bind(("", port))
+        except OSError:
+            print(
+                "Cannot start the data socket. Is the IP address correct? Or is there any ip connection?"
+            )
+        self.allocate_slots()
+
+    def get_socket_stats(self):
+        """Returns the buffer sizes granted by the kernel and the kernel drops, empty if the socket is not configured"""
+
+        return self.dr_stats
+
+    def receive_batch(self):
+        """Generator of the pending datagrams, as (address, message_bytes, monotonic receive time in ns).
+        message_bytes is a memoryview of a slot, valid until the next batch, or None if the datagram was truncated
+        """
+
+        # The kernel timestamps and drop counters come as control messages
+        ancillary = (
+            self.dr_options["kernel_timestamps"]
+            or self.dr_options["kernel_drop_counters"]
+        )
+        max_datagram_size = self.dr_options["max_datagram_size"]
+        flags = bodynodes_receive["flags"]
+        for slot in self.dr_slots:
+            try:
+                if ancillary:
+                    num_bytes, address, receive_ns = self.__receive_with_ancillary(slot)
+                else:
+                    num_bytes, address = self.dr_socket.recvfrom_into(
+                        slot, max_datagram_size, flags
+                    )
+                    receive_ns = time.monotonic_ns()
+            except OSError:
+                # BlockingIOError when there is nothing left
+                break
+
+            if num_bytes > max_datagram_size:
+                yield address, None, receive_ns
+                continue
+            yield address, slot[:num_bytes], receive_ns
+
+    # Private functions
+
+    def __set_buffer_size(self, socket_option, option):
+        """Requests the buffer size of a host option for the data socket. Returns the size granted by the kernel"""
+
+        requested = self.dr_options[option]
+        if requested is not None:
+            try:
+                self.dr_socket.setsockopt(socket.SOL_SOCKET, socket_option, requested)
+            except OSError as er:
+                print(f"Cannot set {option}")
+                print(er)
+        granted = self.dr_socket.getsockopt(socket.SOL_SOCKET, socket_option)
+        if requested is not None:
+            print(f"{option}: requested {requested} bytes, granted {granted} bytes")
+        return granted
+
+    def __enable_socket_flag(self, option, socket_option):
+        """Enables the socket option of a boolean host option on the data socket, the host option is disabled if it cannot"""
+
+        try:
+            if socket_option is None:
+                raise OSError(f"{option} is not available on this system")
+            self.dr_socket.setsockopt(socket.SOL_SOCKET, socket_option, 1)
+        except OSError as er:
+            print(f"Cannot enable {option}, disabling it")
+            print(er)
+            self.dr_options[option] = False
+
+    def __receive_with_ancillary(self, slot):
+        """Receives a datagram in slot with its control messages, the kernel timestamp and the kernel drops.
+        Returns (number of bytes, address, monotonic receive time in ns), the number of bytes is past the slot if it was truncated
+        """
+
+        num_bytes, ancdata, msg_flags, address = self.dr_socket.recvmsg_into(
+            [slot],
+            socket.CMSG_SPACE(ancillary_structs["timespec"].size)
+            + socket.CMSG_SPACE(ancillary_structs["drops"].size),
+        )
+        if msg_flags & socket.MSG_TRUNC:
+            num_bytes = len(slot) + 1
+        receive_ns = time.monotonic_ns()
+        for level, msg_type, data in ancdata:
+            if level != socket.SOL_SOCKET:
+                continue
+            if (
+                msg_type == SO_TIMESTAMPNS
+                and len(data) >= ancillary_structs["timespec"].size
+            ):
+                seconds, nanoseconds = ancillary_structs["timespec"].unpack_from(data)
+                # The kernel stamps the realtime clock, moved to the monotonic one
+                realtime_ns = seconds * 1_000_000_000 + nanoseconds
+                receive_ns -= time.time_ns() - realtime_ns
+            elif (
+                msg_type == SO_RXQ_OVFL and len(data) >= ancillary_structs["drops"].size
+            ):
+                # Sent only once the kernel dropped something, it counts since the socket was created
+                self.dr_stats["kernel_drops"] = ancillary_structs["drops"].unpack_from(
+                    data
+                )[0]
+        return num_bytes, address, receive_ns
+
+
+class BnMulticastBeacon:
+    """Thread that advertises the host in the multicast group, in bursts that back off to a steady rate"""
+
+    def __init__(self):
+        self.mb_socket = None
+        self.mb_message = None
+        self.mb_options = None
+        # Set to restart the bursts, or to wake up the beacon when stopping
+        self.mb_burst_event = threading.Event()
+        self.mb_to_stop = False
+        self.mb_thread = None
+
+    def start(self, multicast_socket, identifier, options):
+        """Joins the multicast group with multicast_socket and starts advertising identifier.
+        options are the host options
+        """
+
+        self.mb_socket = multicast_socket
+        self.mb_message = identifier.encode("utf-8")
+        self.mb_options = options
+        try:
+            print("Interfaces = ")
+            all_ifaces = socket.gethostbyname_ex(socket.gethostname())[2]
+            print(all_ifaces)
+
+            group = socket.inet_aton(BnConstants.WIFI_MULTICASTGROUP_DEFAULT)
+            self.mb_socket.setsockopt(
+                socket.IPPROTO_IP,
+                socket.IP_MULTICAST_TTL,
+                options["multicast_ttl"],
+            )
+            for iface in all_ifaces:
+                print("Using interface = " + str(iface))
+                self.mb_socket.setsockopt(
+                    socket.IPPROTO_IP,
+                    socket.IP_ADD_MEMBERSHIP,
+                    group + socket.inet_aton(iface),
+                )
+        except OSError as er:
+            print("Cannot start multicast socket. No network connections available?")
+            print(er)
+
+        # The beacon starts with a burst
+        self.mb_to_stop = False
+        self.mb_burst_event.clear()
+        self.mb_thread = threading.Thread(target=self.run_multicast_background)
+        self.mb_thread.start()
+
+    def stop(self):
+        """Stops advertising the host"""
+
+        if self.mb_thread is None:
+            return
+        self.mb_to_stop = True
+        self.mb_burst_event.set()
+        self.mb_thread.join()
+        self.mb_thread = None
+
+    def burst(self):
+        """Advertises the host quickly again, e.g. when a node disconnected"""
+
+        self.mb_burst_event.set()
+
+    def run_multicast_background(self):
+        """Multicast runner function, it advertises the host in bursts that back off to a steady rate"""
+
+        interval_ms = self.mb_options["multicast_burst_interval_ms"]
+        while not self.mb_to_stop:
+            self.__send_message()
+            if self.mb_burst_event.wait(interval_ms / 1000):
+                # A node disconnected, or the beacon is stopping
+                self.mb_burst_event.clear()
+                interval_ms = self.mb_options["multicast_burst_interval_ms"]
+            else:
+                interval_ms = min(
+                    interval_ms * self.mb_options["multicast_backoff_factor"],
+                    self.mb_options["multicast_steady_interval_ms"],
+                )
+
+    # Private functions
+
+    def __send_message(self):
+        """Sends the identifier in the multicast channel"""
+
+        try:
+            self.mb_socket.sendto(
+                self.mb_message,
+                (
+                    BnConstants.WIFI_MULTICASTGROUP_DEFAULT,
+                    BnConstants.WIFI_MULTICAST_PORT,
+                ),
+            )
+        except OSError as err:
+            print("Cannot send the multicast message: ", err)
@@ -0,0 +1,349 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Module with the connection statistics of the Bodynode Hosts.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+bodynodes_stats = {
+    # Length of the window the rates are computed on
+    "rate_window_ms": 1000,
+    # Latest inter-arrival times kept to compute the percentiles
+    "interarrival_samples": 256,
+    # Buckets of the latency histograms, 4 per power of two of ns, the last one has all the longer latencies
+    "histogram_buckets": 160,
+}
+
+
+class BnConnectionStats:
+    """Counters and rolling statistics of the traffic of a connection.
+    The receiving thread adds to them while other threads take snapshots
+    """
+
+    def __init__(self):
+        # Held while the window and the arrivals change or are read
+        self.cs_lock = threading.Lock()
+        self.cs_counters = {
+            "datagrams": 0,
+            "samples": 0,
+            "ackn": 0,
+            "json_errors": 0,
+            "decode_errors": 0,
+            "dropped": 0,
+            "truncated": 0,
+        }
+        # sensortype => samples received
+        self.cs_sensortypes = {}
+        self.cs_window = {
+            "start": time.monotonic(),
+            "datagrams": 0,
+            # sensortype => samples received in the window
+            "samples": {},
+            # Rates of the latest complete window
+            "datagrams_per_s": 0.0,
+            "samples_per_s": {},
+        }
+        self.cs_arrivals = {
+            "last": None,
+            "intervals_ms": deque(maxlen=bodynodes_stats["interarrival_samples"]),
+            # Difference between consecutive inter-arrival times
+            "jitters_ms": deque(maxlen=bodynodes_stats["interarrival_samples"]),
+        }
+
+    def add_datagram(self):
+        """Counts a datagram, or a chunk of a stream, received now"""
+
+        now = time.monotonic()
+        with self.cs_lock:
+            self.__roll_window(now)
+            arrivals = self.cs_arrivals
+            if arrivals["last"] is not None:
+                interval_ms = (now - arrivals["last"]) * 1000
+                if arrivals["intervals_ms"]:
+                    arrivals["jitters_ms"].append(
+                        abs(interval_ms - arrivals["intervals_ms"][-1])
+                    )
+                arrivals["intervals_ms"].append(interval_ms)
+            arrivals["last"] = now
+            self.cs_counters["datagrams"] += 1
+            self.cs_window["datagrams"] += 1
+
+    def add_sample(self, sensortype):
+        """Counts a sample of the sensortype"""
+
+        with self.cs_lock:
+            self.cs_counters["samples"] += 1
+            self.cs_sensortypes[sensortype] = self.cs_sensortypes.get(sensortype, 0) + 1
+            window_samples = self.cs_window["samples"]
+            window_samples[sensortype] = window_samples.get(sensortype, 0) + 1
+
+    def add_ackn(self):
+        """Counts an ACKN"""
+
+        self.cs_counters["ackn"] += 1
+
+    def add_decode_errors(self, num_errors=1):
+        """Counts data that could not be decoded, other than json"""
+
+        self.cs_counters["decode_errors"] += num_errors
+
+    def add_truncated(self):
+        """Counts a datagram longer than the receive buffer, dropped without being processed"""
+
+        self.cs_counters["truncated"] += 1
+
+    def set_json_errors(self, num_errors):
+        """Sets the number of json messages that could not be decoded"""
+
+        self.cs_counters["json_errors"] = num_errors
+
+    def set_dropped(self, num_dropped):
+        """Sets the number of datagrams or samples dropped before being processed"""
+
+        self.cs_counters["dropped"] = num_dropped
+
+    def get_snapshot(self):
+        """Returns a dict with the counters and statistics, it can be dumped as json"""
+
+        now = time.monotonic()
+        with self.cs_lock:
+            self.__roll_window(now)
+            snapshot = dict(self.cs_counters)
+            snapshot["samples_by_sensortype"] = dict(self.cs_sensortypes)
+            snapshot["datagrams_per_s"] = self.cs_window["datagrams_per_s"]
+            snapshot["samples_per_s"] = dict(self.cs_window["samples_per_s"])
+            intervals_ms = list(self.cs_arrivals["intervals_ms"])
+            jitters_ms = list(self.cs_arrivals["jitters_ms"])
+            last = self.cs_arrivals["last"]
+        snapshot["interarrival_ms"] = self.__get_percentiles(intervals_ms)
+        snapshot["jitter_ms"] = self.__get_percentiles(jitters_ms)
+        if last is None:
+            snapshot["last_seen_ms"] = None
+        else:
+            snapshot["last_seen_ms"] = (now - last) * 1000
+        return snapshot
+
+    # Private functions
+
+    def __roll_window(self, now):
+        """Computes the rates when the window is over and starts a new one, the lock must be held"""
+
+        window = self.cs_window
+        elapsed_s = now - window["start"]
+        if elapsed_s * 1000 < bodynodes_stats["rate_window_ms"]:
+            return
+        window["datagrams_per_s"] = window["datagrams"] / elapsed_s
+        window["samples_per_s"] = {
+            sensortype: num_samples / elapsed_s
+            for sensortype, num_samples in window["samples"].items()
+        }
+        window["start"] = now
+        window["datagrams"] = 0
+        window["samples"] = {}
+
+    def __get_percentiles(self, values):
+        """Returns the p50 and p99 of the values, None if there are none"""
+
+        if not values:
+            return {"p50": None, "p99": None}
+        ordered = sorted(values)
+        return {
+            "p50": ordered[len(ordered) // 2],
+            "p99": ordered[min(len(ordered) - 1, len(ordered) * 99 // 100)],
+        }
+
+
+class BnLatencyHistogram:
+    """Histogram of latencies, with 4 buckets per power of two so that the percentiles are within 25%"""
+
+    def __init__(self):
+        self.lh_buckets = [0] * bodynodes_stats["histogram_buckets"]
+        self.lh_max_ns = 0
+
+    def add(self, latency_ns):
+        """Adds a latency in ns"""
+
+        if latency_ns < 4:
+            index = max(0, latency_ns)
+        else:
+            exponent = latency_ns.bit_length() - 1
+            index = min(
+                4 * (exponent - 1) + ((latency_ns >> (exponent - 2)) & 3),
+                len(self.lh_buckets) - 1,
+            )
+        self.lh_buckets[index] += 1
+        self.lh_max_ns = max(self.lh_max_ns, latency_ns)
+
+    def merge(self, snapshot):
+        """Adds the latencies of a snapshot, e.g. taken in another process"""
+
+        for index, count in enumerate(snapshot["buckets"]):
+            self.lh_buckets[index] += count
+        self.lh_max_ns = max(self.lh_max_ns, round(snapshot["max_us"] * 1000))
+
+    def reset(self):
+        """Removes all the latencies"""
+
+        self.lh_buckets = [0] * bodynodes_stats["histogram_buckets"]
+        self.lh_max_ns = 0
+
+    def get_snapshot(self):
+        """Returns a dict with the count, percentiles and buckets, it can be dumped as json"""
+
+        buckets = list(self.lh_buckets)
+        count = sum(buckets)
+        snapshot = {"count": count, "max_us": self.lh_max_ns / 1000}
+        for name, rank in (("p50_us", 50), ("p90_us", 90), ("p99_us", 99)):
+            snapshot[name] = self.__get_percentile(buckets, count * rank / 100)
+        snapshot["buckets"] = buckets
+        return snapshot
+
+    # Private functions
+
+    def __get_percentile(self, buckets, rank):
+        """Returns the upper bound (us) of the bucket with the latency of the given rank, at most the longest latency.
+        None if there are none"""
+
+        if rank <= 0:
+            return None
+        max_us = self.lh_max_ns / 1000
+        seen = 0
+        for index, count in enumerate(buckets):
+            seen += count
+            if seen >= rank:
+                if index + 1 < 4:
+                    return min((index + 1) / 1000, max_us)
+                exponent = (index + 1) // 4 + 1
+                return min(((4 + (index + 1) % 4) << (exponent - 2)) / 1000, max_us)
+        return max_us
+
+
+class BnLatencyTracker:
+    """Latency histograms of a host in ns: kernel_to_parse from the receive time of a datagram to its parsing,
+    parse_to_listener_return from the parsing of a sample to the return of its listeners,
+    sample_to_consumer_read from the receive time of a sample to its first read
+    """
+
+    def __init__(self):
+        self.ltr_histograms = {
+            "kernel_to_parse": BnLatencyHistogram(),
+            "parse_to_listener_return": BnLatencyHistogram(),
+            "sample_to_consumer_read": BnLatencyHistogram(),
+        }
+        # Receive time in ns of the latest sample of each stream id not read yet
+        self.ltr_unread = {}
+
+    def add_parse(self, receive_ns, parse_ns):
+        """Adds the latency of a datagram received at receive_ns and parsed at parse_ns"""
+
+        self.ltr_histograms["kernel_to_parse"].add(parse_ns - receive_ns)
+
+    def add_delivery(self, stream_id, receive_ns, parse_ns):
+        """Adds the latency of the listeners of a sample, its first read is measured by add_read"""
+
+        self.ltr_histograms["parse_to_listener_return"].add(
+            time.monotonic_ns() - parse_ns
+        )
+        self.ltr_unread[stream_id] = receive_ns
+
+    def add_read(self, stream_id):
+        """Adds the latency of the first read of the latest sample of a stream"""
+
+        receive_ns = self.ltr_unread.pop(stream_id, None)
+        if receive_ns is not None:
+            self.ltr_histograms["sample_to_consumer_read"].add(
+                time.monotonic_ns() - receive_ns
+            )
+
+    def take_increment(self, name):
+        """Returns the snapshot of a histogram and empties it, the increments can be merged in another process"""
+
+        histogram = self.ltr_histograms[name]
+        snapshot = histogram.get_snapshot()
+        histogram.reset()
+        return snapshot
+
+    def get_snapshots(self, merge_latency=None):
+        """Returns a dict with the snapshot of each histogram, merge_latency(name, histogram) adds the latencies of other processes"""
+
+        snapshots = {}
+        for name, histogram in self.ltr_histograms.items():
+            merged = BnLatencyHistogram()
+            merged.merge(histogram.get_snapshot())
+            if merge_latency is not None:
+                merge_latency(name, merged)
+            snapshots[name] = merged.get_snapshot()
+        return snapshots
+
+    def reset(self):
+        """Empties the histograms"""
+
+        for histogram in self.ltr_histograms.values():
+            histogram.reset()
+
+
+class BnStatsReporter:
+    """Thread that periodically prints the stats of a communicator, or appends them as json lines to a file.
+    get_socket_stats adds the stats of the sockets of the communicator to the reports
+    """
+
+    def __init__(self, get_stats, interval_s, path=None, get_socket_stats=None):
+        self.srp_get_stats = get_stats
+        self.srp_get_socket_stats = get_socket_stats
+        self.srp_interval_s = interval_s
+        self.srp_path = path
+        self.srp_stop_event = threading.Event()
+        self.srp_thread = threading.Thread(target=self.run_report_background)
+
+    def start(self):
+        """Starts reporting"""
+
+        self.srp_thread.start()
+
+    def stop(self):
+        """Stops reporting, it waits for the ongoing report"""
+
+        self.srp_stop_event.set()
+        self.srp_thread.join()
+
+    def run_report_background(self):
+        """Report runner function"""
+
+        while not self.srp_stop_event.wait(self.srp_interval_s):
+            report = {"time": time.time(), "stats": self.srp_get_stats()}
+            if self.srp_get_socket_stats is not None:
+                report["sockets"] = self.srp_get_socket_stats()
+            report = json.dumps(report)
+            if self.srp_path is None:
+                print(report)
+                continue
+            try:
+                with open(self.srp_path, "a", encoding="utf-8") as report_file:
+                    report_file.write(report + "\n")
+            except OSError as err:
+                print("Cannot write the stats report: ", err)
@@ -0,0 +1,266 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Module with the sample subscriptions of the Bodynode Hosts, read as generators or async iterators.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque, namedtuple
+
+from bnhostutils import BnListenerRoutes
+
+bodynodes_subscriptions = {
+    # Samples a subscription keeps until they are read
+    "queue_size": 1024,
+    # "latest": a full queue drops its oldest sample, "block": the receiving thread waits until there is room
+    "backpressure": "latest",
+}
+
+# Sample given by the subscriptions, timestamp_ms is when the host received it (same clock as time.time() * 1000)
+BnSample = namedtuple(
+    "BnSample", ["player", "bodypart", "sensortype", "value", "timestamp_ms"]
+)
+
+
+class BnSubscription:
+    """Bounded queue of the samples of the streams matching a filter, filled by the receiving thread.
+    stream_filter is None for all the streams, a (player, bodypart, sensortype) tuple where None matches anything,
+    or a function (player, bodypart, sensortype) => bool
+    """
+
+    def __init__(self, stream_filter, queue_size, backpressure, on_close):
+        self.sb_filter = stream_filter
+        self.sb_queue = {
+            "samples": deque(),
+            "size": queue_size,
+            "block": backpressure == "block",
+            # Samples dropped because the queue was full
+            "dropped": 0,
+        }
+        self.sb_condition = threading.Condition()
+        self.sb_on_close = on_close
+        self.sb_closed = False
+        # (loop, event) of the async iterator waiting for samples
+        self.sb_async_waiter = None
+
+    def is_of_interest(self, player, bodypart, sensortype):
+        """Returns true if the stream matches the filter"""
+
+        if self.sb_filter is None:
+            return True
+        if callable(self.sb_filter):
+            return self.sb_filter(player, bodypart, sensortype)
+        return all(
+            wanted is None or wanted == actual
+            for wanted, actual in zip(self.sb_filter, (player, bodypart, sensortype))
+        )
+
+    def put(self, stream_key, value, timestamp_ms):
+        """Queues a sample of the (player, bodypart, sensortype) stream, it is called in the receiving thread"""
+
+        sample = BnSample(
+            stream_key[0], stream_key[1], stream_key[2], value, timestamp_ms
+        )
+        queue = self.sb_queue
+        with self.sb_condition:
+            if queue["block"]:
+                self.sb_condition.wait_for(
+                    lambda: len(queue["samples"]) < queue["size"] or self.sb_closed
+                )
+            if self.sb_closed:
+                return
+            if len(queue["samples"]) >= queue["size"]:
+                queue["samples"].popleft()
+                queue["dropped"] += 1
+            queue["samples"].append(sample)
+            self.sb_condition.notify_all()
+            self.__wake_async_waiter()
+
+    def get_dropped(self):
+        """Returns the number of samples dropped because the queue was full"""
+
+        return self.sb_queue["dropped"]
+
+    def is_closed(self):
+        """Returns true if the subscription is closed"""
+
+        return self.sb_closed
+
+    def close(self):
+        """Stops the subscription, the samples still queued are given before the iteration ends"""
+
+        with self.sb_condition:
+            if self.sb_closed:
+                return
+            self.sb_closed = True
+            self.sb_condition.notify_all()
+            self.__wake_async_waiter()
+        self.sb_on_close(self)
+
+    def samples(self):
+        """Generator of the samples, it blocks until they come and ends when the subscription is closed"""
+
+        try:
+            while True:
+                with self.sb_condition:
+                    self.sb_condition.wait_for(
+                        lambda: self.sb_queue["samples"] or self.sb_closed
+                    )
+                    samples = self.__take_all()
+                if not samples:
+                    return
+                yield from samples
+        finally:
+            self.close()
+
+    async def async_samples(self):
+        """Async iterator of the samples, it ends when the subscription is closed"""
+
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                event = None
+                with self.sb_condition:
+                    samples = self.__take_all()
+                    if not samples and not self.sb_closed:
+                        event = asyncio.Event()
+                        self.sb_async_waiter = (loop, event)
+                if event is not None:
+                    await event.wait()
+                    continue
+                if not samples:
+                    return
+                for sample in samples:
+                    yield sample
+        finally:
+            self.close()
+
+    # Private functions
+
+    def __take_all(self):
+        """Empties the queue and returns its samples, the lock must be held"""
+
+        samples = list(self.sb_queue["samples"])
+        self.sb_queue["samples"].clear()
+        if self.sb_queue["block"] and samples:
+            self.sb_condition.notify_all()
+        return samples
+
+    def __wake_async_waiter(self):
+        """Wakes up the async iterator waiting for samples, the lock must be held"""
+
+        if self.sb_async_waiter is None:
+            return
+        loop, event = self.sb_async_waiter
+        self.sb_async_waiter = None
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # The loop of the iterator is closed
+            pass
+
+
+class BnSubscriptions:
+    """Subscriptions of a communicator, the receiving thread dispatches the samples to them like to the listeners"""
+
+    def __init__(self):
+        self.ss_routes = BnListenerRoutes()
+        self.ss_lock = threading.Lock()
+        # No subscription is accepted until the communicator starts
+        self.ss_closed = True
+
+    def open(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Returns a new BnSubscription, see bodynodes_subscriptions for the defaults.
+        It is already closed when the communicator is not started, so its iteration ends at once
+        """
+
+        if queue_size is None:
+            queue_size = bodynodes_subscriptions["queue_size"]
+        if backpressure is None:
+            backpressure = bodynodes_subscriptions["backpressure"]
+        if backpressure not in ("latest", "block"):
+            print("Unknown backpressure " + str(backpressure) + ", using latest")
+        subscription = BnSubscription(
+            stream_filter, max(1, queue_size), backpressure, self.__remove
+        )
+        with self.ss_lock:
+            if not self.ss_closed:
+                self.ss_routes.add(subscription)
+                return subscription
+        subscription.close()
+        return subscription
+
+    def stream(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Generator of the samples of a new subscription, the subscription starts with the iteration"""
+
+        yield from self.open(stream_filter, queue_size, backpressure).samples()
+
+    async def astream(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Async iterator of the samples of a new subscription, the subscription starts with the iteration"""
+
+        subscription = self.open(stream_filter, queue_size, backpressure)
+        try:
+            async for sample in subscription.async_samples():
+                yield sample
+        finally:
+            subscription.close()
+
+    def dispatch(self, stream_id, stream_key, value, timestamp_ms=None):
+        """Gives the value to the subscriptions interested in the stream.
+        timestamp_ms is when it was received (same clock as time.time() * 1000), now when not given
+        """
+
+        if not self.ss_routes.get_listeners():
+            return
+        if timestamp_ms is None:
+            timestamp_ms = time.time() * 1000
+        for subscription in self.ss_routes.get_interested(stream_id, stream_key):
+            subscription.put(stream_key, value, timestamp_ms)
+
+    def start(self):
+        """Accepts new subscriptions, the communicator calls it when it starts"""
+
+        with self.ss_lock:
+            self.ss_closed = False
+
+    def close_all(self):
+        """Closes all the subscriptions, their iterations end. The new ones are closed until start() is called"""
+
+        with self.ss_lock:
+            self.ss_closed = True
+            subscriptions = list(self.ss_routes.get_listeners())
+        for subscription in subscriptions:
+            subscription.close()
+
+    # Private functions
+
+    def __remove(self, subscription):
+        """Forgets a closed subscription"""
+
+        with self.ss_lock:
+            if subscription in self.ss_routes.get_listeners():
+                self.ss_routes.remove(subscription)
@@ -0,0 +1,993 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Module with the utilities shared by the Bodynode Hosts.
+"""
+
+import codecs
+import importlib
+import json
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from multiprocessing import resource_tracker, shared_memory
+
+bodynodes_framer = {
+    # Max characters of a partial message kept while waiting for the rest of it
+    "max_pending_chars": 65536,
+}
+
+bodynodes_json = {
+    # Json backends from the fastest, the first installed one is used when none is chosen
+    "backends": ("orjson", "ujson", "json"),
+    # Backends that decode a memoryview without copying it to bytes first
+    "memoryview_backends": ("orjson",),
+}
+
+framer_patterns = {
+    # Searched in the datagrams without copying them
+    "newline": re.compile(b"\n"),
+}
+
+bodynodes_streams = {
+    # Number of streams allocated at once when the table is full
+    "capacity_step": 64,
+    # Max number of values of a sample kept in the arrays, longer values are kept as objects
+    "max_values": 16,
+}
+
+bodynodes_rings = {
+    # Samples a ring can hold before the consumer reads them
+    "slots": 16384,
+}
+
+# Sample ring layout, native byte order as both sides run on the same machine:
+#   header: head | tail | slots | dropped samples (uint64 each)
+#   slots: stream id (uint32) | number of values (uint8) | integers flag (uint8) | 2 padding bytes |
+#       monotonic receive time in ns (uint64) | max_values float64
+ring_structs = {
+    "header": struct.Struct("=4Q"),
+    "item": struct.Struct("=IBB2xQ"),
+    "values": [
+        struct.Struct(f"={num_values}d")
+        for num_values in range(bodynodes_streams["max_values"] + 1)
+    ],
+}
+
+bodynodes_pose_tables = {
+    # Streams a shared pose table can hold
+    "max_streams": 256,
+    # Longest "player|bodypart|sensortype" key in utf-8
+    "max_key_bytes": 127,
+    # Room for the value of each stream, numbers as float64 or json
+    "max_value_bytes": 128,
+    # Times a reader tries to read a slot while it is written, a host that died while writing leaves it so
+    "max_read_retries": 10000,
+}
+
+# Shared pose table layout, native byte order as both sides run on the same machine:
+#   header: magic (8 bytes) | max streams (uint64) | number of streams (uint64)
+#   keys: max streams times key length (uint8) | "player|bodypart|sensortype" in utf-8
+#   slots: max streams times seqlock counter (uint64) | receive time in ms (float64) | value kind (uint8) |
+#       1 padding byte | value length (uint16) | 4 padding bytes | value
+# The seqlock counter is odd while the slot is written, readers retry until they see the same even counter
+pose_table_structs = {
+    "header": struct.Struct("=8sQQ"),
+    "key": struct.Struct(f"=B{bodynodes_pose_tables['max_key_bytes']}s"),
+    "slot": struct.Struct("=QdBxH4x"),
+    "values": [
+        struct.Struct(f"={num_values}d")
+        for num_values in range(bodynodes_streams["max_values"] + 1)
+    ],
+}
+
+pose_table_kinds = {
+    "magic": b"BNPOSE01",
+    "empty": 0,
+    "floats": 1,
+    "integers": 2,
+    "json": 3,
+}
+
+# Length of a stream that has no value yet
+STREAM_NO_VALUE = -1
+# Length of a stream whose value could not be kept in the arrays
+STREAM_OBJECT_VALUE = -2
+
+
+class BnJsonDecoder:
+    """Decoder of whole json documents from bytes or memoryview, with orjson or ujson when installed and json otherwise.
+    backend is one of bodynodes_json["backends"], None picks the fastest installed one
+    """
+
+    def __init__(self, backend=None):
+        self.jd_name = "json"
+        self.jd_loads = json.loads
+        backends = bodynodes_json["backends"]
+        if backend is not None:
+            if backend not in backends:
+                print(
+                    f"Unknown json backend {backend}, using the fastest installed one"
+                )
+            else:
+                backends = (backend,)
+        for name in backends:
+            try:
+                module = importlib.import_module(name)
+            except ImportError:
+                if backend is not None:
+                    print(f"Json backend {name} is not installed, using json")
+                continue
+            self.jd_name = name
+            self.jd_loads = module.loads
+            break
+        self.jd_memoryview = self.jd_name in bodynodes_json["memoryview_backends"]
+
+    def get_name(self):
+        """Returns the name of the backend in use"""
+
+        return self.jd_name
+
+    def loads(self, message_bytes):
+        """Returns the json document in message_bytes (bytes, bytearray or memoryview).
+        Raises ValueError if it is not valid json"""
+
+        if not self.jd_memoryview and isinstance(message_bytes, memoryview):
+            message_bytes = message_bytes.tobytes()
+        return self.jd_loads(message_bytes)
+
+
+class BnJsonFramer:
+    """Incremental framer extracting json messages from a stream of bytes.
+    Partial messages are kept until the following bytes complete them.
+    A datagram holding one message, a json array of messages or newline delimited messages is decoded at once by json_decoder,
+    a BnJsonDecoder that can be shared by several framers
+    """
+
+    def __init__(self, json_decoder=None):
+        self.jf_json_decoder = (
+            json_decoder if json_decoder is not None else BnJsonDecoder()
+        )
+        self.jf_decoder = json.JSONDecoder()
+        # True while the datagrams hold one message each
+        self.jf_single = True
+        self.jf_utf8_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # Beginning of a message not yet completed
+        self.jf_pending = ""
+        self.jf_num_errors = 0
+
+    def feed(self, message_bytes):
+        """Feeds bytes (or memoryview) to the framer. Returns the list of complete json messages found"""
+
+        if not self.jf_pending:
+            json_messages = self.__decode_datagram(message_bytes)
+            if json_messages is not None:
+                return json_messages
+
+        message_str = self.jf_utf8_decoder.decode(message_bytes)
+        if self.jf_pending:
+            message_str = self.jf_pending + message_str
+            self.jf_pending = ""
+
+        json_messages = []
+        raw_decode = self.jf_decoder.raw_decode
+        index_st = message_str.find("{")
+        while index_st != -1:
+            try:
+                # The decoder reads from index_st, the rest of the string is not copied
+                json_message, index_end = raw_decode(message_str, index_st)
+            except json.decoder.JSONDecodeError as err:
+                index_end = message_str.find("}", err.pos)
+                if index_end == -1:
+                    # The message is not complete yet
+                    self.__keep_pending(message_str, index_st)
+                    break
+                print(message_str[index_st : index_end + 1])
+                print("Not a valid json: ", err)
+                self.jf_num_errors += 1
+                index_st = message_str.find("{", index_st + 1)
+                continue
+
+            json_messages.append(json_message)
+            index_st = message_str.find("{", index_end)
+
+        # Senders batching several messages per datagram do not try the single message decoding again
+        self.jf_single = len(json_messages) == 1
+        return json_messages
+
+    def get_num_errors(self):
+        """Returns the number of invalid json messages found"""
+
+        return self.jf_num_errors
+
+    def reset(self):
+        """Drops any partial message"""
+
+        self.jf_utf8_decoder.reset()
+        self.jf_pending = ""
+        self.jf_single = True
+
+    # Private functions
+
+    def __decode_datagram(self, message_bytes):
+        """Decodes straight from the bytes a datagram holding one message, a json array of messages or newline delimited messages.
+        Returns the list of messages, None if the datagram holds something else (e.g. concatenated or partial messages)
+        """
+
+        first_byte = message_bytes[:1]
+        if first_byte == b"[":
+            return self.__decode_batch(message_bytes)
+        if first_byte != b"{":
+            return None
+        if self.jf_single and message_bytes[-1:] == b"}":
+            # Most datagrams hold exactly one message
+            json_message = self.__loads(message_bytes)
+            if isinstance(json_message, dict):
+                return [json_message]
+        if framer_patterns["newline"].search(message_bytes) is None:
+            return None
+        # Newline delimited messages are decoded as the json array of their lines
+        lines = [line for line in bytes(message_bytes).split(b"\n") if line.strip()]
+        return self.__decode_batch(b"[" + b",".join(lines) + b"]")
+
+    def __decode_batch(self, batch_bytes):
+        """Returns the messages of a json array, None if it is not a valid json array"""
+
+        json_batch = self.__loads(batch_bytes)
+        if not isinstance(json_batch, list):
+            return None
+        json_messages = [item for item in json_batch if isinstance(item, dict)]
+        if len(json_messages) < len(json_batch):
+            print("Json batch with items that are not messages")
+            self.jf_num_errors += len(json_batch) - len(json_messages)
+        self.jf_single = len(json_messages) == 1
+        return json_messages
+
+    def __loads(self, message_bytes):
+        """Returns the json document in message_bytes, None if it is not valid json"""
+
+        try:
+            return self.jf_json_decoder.loads(message_bytes)
+        except ValueError:
+            # Several messages, or invalid ones, are left to the incremental decoding
+            return None
+
+    def __keep_pending(self, message_str, index_st):
+        """Keeps the partial message starting at index_st"""
+
+        if len(message_str) - index_st > bodynodes_framer["max_pending_chars"]:
+            print("Partial json message too long, dropping it")
+            self.jf_num_errors += 1
+            return
+        self.jf_pending = message_str[index_st:]
+
+
+class BnStreamTable:  # pylint: disable=too-many-instance-attributes # reason: Each attribute is a column of the streams, grouping them would slow the hot path down
+    """Table of the latest value of each player+bodypart+sensortype stream.
+    Each stream gets a small integer id the first time it is seen, values live in preallocated arrays
+    """
+
+    def __init__(self):
+        # (player, bodypart, sensortype) => stream id
+        self.st_ids = {}
+        # stream id => (player, bodypart, sensortype)
+        self.st_keys = []
+        # stream id => address of the connection that sent the latest value
+        self.st_sources = []
+        # stream id => value that could not be kept in the arrays
+        self.st_objects = []
+        self.st_capacity = 0
+        # Held while a value is written or read, so a reader never gets the values of two samples mixed
+        self.st_lock = threading.Lock()
+        self.st_history = {
+            # Samples kept in the history of each stream, 0 means no history
+            "capacity": 0,
+            # stream id => BnStreamHistory
+            "streams": [],
+        }
+        self.st_arrays = {
+            # max_values slots for each stream id
+            "values": array("d"),
+            # Number of values in the slots, or one of the STREAM_* lengths
+            "lengths": array("b"),
+            # 1 if all the values were integers
+            "integers": array("b"),
+            # Incremented at every new value
+            "versions": array("Q"),
+        }
+
+    def get_stream_id(self, player, bodypart, sensortype):
+        """Returns the id of the stream, None if it was never seen"""
+
+        return self.st_ids.get((player, bodypart, sensortype))
+
+    def intern_stream(self, player, bodypart, sensortype):
+        """Returns the id of the stream, registering it the first time it is seen.
+        None if the player, bodypart or sensortype is not a string"""
+
+        key = (player, bodypart, sensortype)
+        try:
+            stream_id = self.st_ids.get(key)
+        except TypeError:
+            # Lists, objects and so on
+            return None
+        if stream_id is None:
+            if not all(isinstance(key_str, str) for key_str in key):
+                return None
+            stream_id = self.__add_stream(key)
+        return stream_id
+
+    def get_stream_key(self, stream_id):
+        """Returns the (player, bodypart, sensortype) of the stream"""
+
+        return self.st_keys[stream_id]
+
+    def get_num_streams(self):
+        """Returns the number of streams seen"""
+
+        return len(self.st_keys)
+
+    def get_source(self, stream_id):
+        """Returns the address of the connection that sent the latest value of the stream"""
+
+        return self.st_sources[stream_id]
+
+    def set_source(self, stream_id, source):
+        """Sets the address of the connection sending the stream. Returns true if it changed, false otherwise"""
+
+        if self.st_sources[stream_id] == source:
+            return False
+        self.st_sources[stream_id] = source
+        return True
+
+    def get_version(self, stream_id):
+        """Returns the number of values received by the stream"""
+
+        return self.st_arrays["versions"][stream_id]
+
+    def get_value(self, stream_id):
+        """Returns the latest value of the stream, None if there is none"""
+
+        with self.st_lock:
+            length = self.st_arrays["lengths"][stream_id]
+            if length == STREAM_NO_VALUE:
+                return None
+            if length == STREAM_OBJECT_VALUE:
+                return self.st_objects[stream_id]
+
+            index_st = stream_id * bodynodes_streams["max_values"]
+            value = self.st_arrays["values"][index_st : index_st + length].tolist()
+            integers = self.st_arrays["integers"][stream_id]
+        if integers:
+            return [int(number) for number in value]
+        return value
+
+    def set_value(self, stream_id, value, timestamp_ms=None):
+        """Sets the latest value of the stream. timestamp_ms is when it was received (same clock as time.time() * 1000),
+        now when not given"""
+
+        arrays = self.st_arrays
+        try:
+            length = len(value)
+            if length > bodynodes_streams["max_values"]:
+                raise TypeError("Too many values")
+            integers = length > 0 and all(isinstance(number, int) for number in value)
+            index = stream_id * bodynodes_streams["max_values"]
+            values = arrays["values"]
+            with self.st_lock:
+                values[index : index + length] = array("d", value)
+                arrays["lengths"][stream_id] = length
+                arrays["integers"][stream_id] = integers
+                self.st_objects[stream_id] = None
+                arrays["versions"][stream_id] += 1
+            if self.st_history["capacity"] and length > 0:
+                self.__add_to_history(stream_id, value, timestamp_ms)
+        except TypeError:
+            # Strings, nested values and so on
+            with self.st_lock:
+                arrays["lengths"][stream_id] = STREAM_OBJECT_VALUE
+                self.st_objects[stream_id] = value
+                arrays["versions"][stream_id] += 1
+
+    def get_message_value(self, player, bodypart, sensortype):
+        """Returns the latest value of the player+bodypart+sensortype stream, None if there is none"""
+
+        stream_id = self.st_ids.get((player, bodypart, sensortype))
+        if stream_id is None:
+            return None
+        return self.get_value(stream_id)
+
+    def set_history_capacity(self, capacity):
+        """Keeps the latest capacity samples of each stream with their receive time, 0 disables the history"""
+
+        self.st_history["capacity"] = capacity
+        self.st_history["streams"] = [None] * len(self.st_keys)
+
+    def get_history(self, stream_id, since_ms):
+        """Returns the samples of the stream received after since_ms (same clock as time.time() * 1000).
+        See BnStreamHistory.get_window for the returned views"""
+
+        if not self.st_history["capacity"]:
+            return None
+        history = self.st_history["streams"][stream_id]
+        if history is None:
+            return None
+        return history.get_since(since_ms)
+
+    def get_window(self, stream_id, num_samples):
+        """Returns the latest num_samples samples of the stream.
+        See BnStreamHistory.get_window for the returned views"""
+
+        if not self.st_history["capacity"]:
+            return None
+        history = self.st_history["streams"][stream_id]
+        if history is None:
+            return None
+        return history.get_window(num_samples)
+
+    # Private functions
+
+    def __add_to_history(self, stream_id, value, timestamp_ms):
+        """Adds the value to the history of the stream, timestamp_ms None means now"""
+
+        history = self.st_history["streams"][stream_id]
+        if history is None or history.get_width() != len(value):
+            # The number of values changed, the old samples cannot be kept
+            history = BnStreamHistory(self.st_history["capacity"], len(value))
+            self.st_history["streams"][stream_id] = history
+        if timestamp_ms is None:
+            timestamp_ms = time.time() * 1000
+        history.append(timestamp_ms, value)
+
+    def __add_stream(self, key):
+        """Registers a new stream and returns its id"""
+
+        stream_id = len(self.st_keys)
+        if stream_id == self.st_capacity:
+            self.__grow()
+        key = tuple(sys.intern(key_str) for key_str in key)
+        self.st_keys.append(key)
+        self.st_sources.append(None)
+        self.st_objects.append(None)
+        self.st_history["streams"].append(None)
+        self.st_ids[key] = stream_id
+        return stream_id
+
+    def __grow(self):
+        """Preallocates the arrays for the next capacity_step streams"""
+
+        step = bodynodes_streams["capacity_step"]
+        self.st_arrays["values"].extend(
+            array("d", [0.0]) * (step * bodynodes_streams["max_values"])
+        )
+        self.st_arrays["lengths"].extend(array("b", [STREAM_NO_VALUE]) * step)
+        self.st_arrays["integers"].extend(array("b", [0]) * step)
+        self.st_arrays["versions"].extend(array("Q", [0]) * step)
+        self.st_capacity += step
+
+
+class BnListenerRoutes:
+    """Listeners of a communicator, with the listeners interested in each stream id cached.
+    is_of_interest is asked once per stream, until listeners are added or removed
+    """
+
+    def __init__(self):
+        # The list and the routes are replaced, never modified, so the receive thread can use them while they change
+        self.lr_listeners = []
+        # stream id => listeners interested in the stream
+        self.lr_routes = {}
+
+    def add(self, listener):
+        """Adds a listener"""
+
+        self.lr_listeners = self.lr_listeners + [listener]
+        self.lr_routes = {}
+
+    def remove(self, listener):
+        """Removes a listener"""
+
+        listeners = list(self.lr_listeners)
+        listeners.remove(listener)
+        self.lr_listeners = listeners
+        self.lr_routes = {}
+
+    def clear(self):
+        """Removes all listeners"""
+
+        self.lr_listeners = []
+        self.lr_routes = {}
+
+    def get_listeners(self):
+        """Returns the listeners"""
+
+        return self.lr_listeners
+
+    def get_interested(self, stream_id, stream_key):
+        """Returns the listeners interested in the stream"""
+
+        routes = self.lr_routes
+        interested = routes.get(stream_id)
+        if interested is None:
+            player, bodypart, sensortype = stream_key
+            interested = [
+                listener
+                for listener in self.lr_listeners
+                if listener.is_of_interest(player, bodypart, sensortype)
+            ]
+            routes[stream_id] = interested
+        return interested
+
+    def dispatch(self, stream_id, stream_key, value):
+        """Calls the listeners interested in the stream with the given value"""
+
+        for listener in self.get_interested(stream_id, stream_key):
+            listener.on_message_received(
+                stream_key[0], stream_key[1], stream_key[2], value
+            )
+
+
+class BnStreamHistory:
+    """Fixed capacity ring buffer of the samples of a stream with their receive time.
+    Every sample is written twice, at index and index + capacity, so the latest samples are always contiguous
+    """
+
+    def __init__(self, capacity, width):
+        self.sh_capacity = capacity
+        self.sh_width = width
+        self.sh_count = 0
+        self.sh_timestamps = array("d", [0.0]) * (2 * capacity)
+        self.sh_values = array("d", [0.0]) * (2 * capacity * width)
+
+    def get_width(self):
+        """Returns the number of values of each sample"""
+
+        return self.sh_width
+
+    def get_count(self):
+        """Returns the number of samples appended since the creation"""
+
+        return self.sh_count
+
+    def append(self, timestamp_ms, value):
+        """Appends a sample, overwriting the oldest one when full"""
+
+        index = self.sh_count % self.sh_capacity
+        self.sh_timestamps[index] = timestamp_ms
+        self.sh_timestamps[index + self.sh_capacity] = timestamp_ms
+        index_values = index * self.sh_width
+        index_mirror = index_values + self.sh_capacity * self.sh_width
+        values = self.sh_values
+        for number in value:
+            values[index_values] = number
+            values[index_mirror] = number
+            index_values += 1
+            index_mirror += 1
+        self.sh_count += 1
+
+    def get_window(self, num_samples):
+        """Returns (timestamps, values) of the latest num_samples samples, oldest first.
+        They are zero-copy memoryviews: timestamps has shape (n,) and values (n, width).
+        The memory is reused by the following samples, copy what must be kept
+        """
+
+        num_samples = min(num_samples, self.sh_count, self.sh_capacity)
+        index_end = (self.sh_count - 1) % self.sh_capacity + self.sh_capacity + 1
+        index_st = index_end - num_samples
+        timestamps = memoryview(self.sh_timestamps)[index_st:index_end]
+        values = (
+            memoryview(self.sh_values)[
+                index_st * self.sh_width : index_end * self.sh_width
+            ]
+            .cast("B")
+            .cast("d", [num_samples, self.sh_width])
+        )
+        return timestamps, values
+
+    def get_since(self, since_ms):
+        """Returns (timestamps, values) of the samples received after since_ms, as get_window does"""
+
+        timestamps, _ = self.get_window(self.sh_capacity)
+        return self.get_window(len(timestamps) - bisect_left(timestamps, since_ms))
+
+
+class BnSampleRing:
+    """Single producer single consumer ring of numeric samples in shared memory, it can be shared across processes.
+    Only the producer moves the head and only the consumer moves the tail, so no lock is needed
+    """
+
+    def __init__(self, name=None, slots=None):
+        slot_size = (
+            ring_structs["item"].size
+            + ring_structs["values"][bodynodes_streams["max_values"]].size
+        )
+        if name is None:
+            if slots is None:
+                slots = bodynodes_rings["slots"]
+            self.sr_memory = shared_memory.SharedMemory(
+                create=True, size=ring_structs["header"].size + slots * slot_size
+            )
+            self.sr_header = self.sr_memory.buf[: ring_structs["header"].size].cast("Q")
+            self.sr_header[2] = slots
+        else:
+            self.sr_memory = shared_memory.SharedMemory(name=name)
+            self.sr_header = self.sr_memory.buf[: ring_structs["header"].size].cast("Q")
+        self.sr_layout = {
+            "slots": self.sr_header[2],
+            "slot_size": slot_size,
+            "owner": name is None,
+        }
+
+    def get_name(self):
+        """Returns the name to give to the other process to attach to the ring"""
+
+        return self.sr_memory.name
+
+    def get_dropped(self):
+        """Returns the number of samples dropped because the ring was full"""
+
+        return self.sr_header[3]
+
+    def add_dropped(self):
+        """Producer side, counts a sample dropped because the ring was full"""
+
+        self.sr_header[3] += 1
+
+    def push(self, stream_id, value, receive_ns):
+        """Producer side, appends a sample received at receive_ns (time.monotonic_ns). Returns false if the ring is full,
+        the producer can retry or count the sample with add_dropped.
+        Raises TypeError, IndexError or struct.error if the value is not a short list of numbers
+        """
+
+        header = self.sr_header
+        head = header[0]
+        if head - header[1] >= self.sr_layout["slots"]:
+            return False
+        length = len(value)
+        offset = (
+            ring_structs["header"].size
+            + (head % self.sr_layout["slots"]) * self.sr_layout["slot_size"]
+        )
+        ring_structs["values"][length].pack_into(
+            self.sr_memory.buf, offset + ring_structs["item"].size, *value
+        )
+        ring_structs["item"].pack_into(
+            self.sr_memory.buf,
+            offset,
+            stream_id,
+            length,
+            length > 0 and all(isinstance(number, int) for number in value),
+            receive_ns,
+        )
+        # The sample is complete, it can be published
+        header[0] = head + 1
+        return True
+
+    def pop_all(self):
+        """Consumer side, returns the list of (stream id, value, receive time in ns) samples pushed since the previous call"""
+
+        header = self.sr_header
+        head = header[0]
+        tail = header[1]
+        samples = []
+        while tail < head:
+            offset = (
+                ring_structs["header"].size
+                + (tail % self.sr_layout["slots"]) * self.sr_layout["slot_size"]
+            )
+            stream_id, length, integers, receive_ns = ring_structs["item"].unpack_from(
+                self.sr_memory.buf, offset
+            )
+            value = ring_structs["values"][length].unpack_from(
+                self.sr_memory.buf, offset + ring_structs["item"].size
+            )
+            if integers:
+                samples.append(
+                    (stream_id, [int(number) for number in value], receive_ns)
+                )
+            else:
+                samples.append((stream_id, list(value), receive_ns))
+            tail += 1
+        header[1] = tail
+        return samples
+
+    def close(self):
+        """Detaches from the ring, the process that created it also frees it"""
+
+        self.sr_header.release()
+        self.sr_memory.close()
+        if self.sr_layout["owner"]:
+            self.sr_memory.unlink()
+
+
+def pose_table_size(max_streams):
+    """Returns the bytes of a shared pose table"""
+
+    return (
+        pose_table_structs["header"].size
+        + max_streams * pose_table_structs["key"].size
+        + max_streams
+        * (pose_table_structs["slot"].size + bodynodes_pose_tables["max_value_bytes"])
+    )
+
+
+def pose_slot_offset(max_streams, stream_id):
+    """Returns the offset of the slot of a stream in a shared pose table"""
+
+    return (
+        pose_table_structs["header"].size
+        + max_streams * pose_table_structs["key"].size
+        + stream_id
+        * (pose_table_structs["slot"].size + bodynodes_pose_tables["max_value_bytes"])
+    )
+
+
+def attach_shared_memory(name):
+    """Attaches to shared memory created by another process, without letting this process free it at exit"""
+
+    if sys.version_info >= (3, 13):
+        # pylint: disable-next=unexpected-keyword-arg
+        return shared_memory.SharedMemory(name=name, track=False)
+    memory = shared_memory.SharedMemory(name=name)
+    if sys.platform != "win32":
+        # Before Python 3.13 every attached segment is tracked and freed at exit
+        resource_tracker.unregister(
+            memory._name, "shared_memory"  # pylint: disable=protected-access
+        )
+    return memory
+
+
+class BnSharedPoseTable:
+    """Writer side of a table in shared memory with the latest value of each stream.
+    Any number of local processes can read it with BnSharedPoseReader
+    """
+
+    def __init__(self, name, max_streams=None):
+        if max_streams is None:
+            max_streams = bodynodes_pose_tables["max_streams"]
+        try:
+            self.spt_memory = shared_memory.SharedMemory(
+                name=name, create=True, size=pose_table_size(max_streams)
+            )
+        except FileExistsError as err:
+            # Removing it would pull the table from under the host and the readers using it
+            raise FileExistsError(
+                f"The shared memory {name} is used by another host, or was left behind by a host that did not stop. "
+                f"Choose another name or remove it (/dev/shm/{name} on Linux)"
+            ) from err
+        self.spt_words = self.spt_memory.buf.cast("Q")
+        self.spt_max_streams = max_streams
+        # Stream ids whose key is already in the table
+        self.spt_declared = set()
+        pose_table_structs["header"].pack_into(
+            self.spt_memory.buf, 0, pose_table_kinds["magic"], max_streams, 0
+        )
+
+    def get_name(self):
+        """Returns the name the readers attach to"""
+
+        return self.spt_memory.name
+
+    def publish(self, stream_id, stream_key, value, timestamp_ms):
+        """Writes the latest value of a stream. Returns false if it does not fit in the table"""
+
+        if stream_id >= self.spt_max_streams:
+            return False
+        try:
+            length = len(value)
+            payload = pose_table_structs["values"][length].pack(*value)
+            if all(isinstance(number, int) for number in value):
+                kind = pose_table_kinds["integers"]
+            else:
+                kind = pose_table_kinds["floats"]
+        except (TypeError, IndexError, struct.error):
+            payload = json.dumps(value).encode("utf-8")
+            length = len(payload)
+            kind = pose_table_kinds["json"]
+            if length > bodynodes_pose_tables["max_value_bytes"]:
+                return False
+
+        if stream_id not in self.spt_declared:
+            self.__declare(stream_id, stream_key)
+
+        offset = pose_slot_offset(self.spt_max_streams, stream_id)
+        seq_index = offset // 8
+        self.spt_words[seq_index] += 1
+        pose_table_structs["slot"].pack_into(
+            self.spt_memory.buf,
+            offset,
+            self.spt_words[seq_index],
+            timestamp_ms,
+            kind,
+            length,
+        )
+        self.spt_memory.buf[
+            offset
+            + pose_table_structs["slot"].size : offset
+            + pose_table_structs["slot"].size
+            + len(payload)
+        ] = payload
+        self.spt_words[seq_index] += 1
+        return True
+
+    def close(self):
+        """Frees the table, the readers keep their mapping until they close"""
+
+        self.spt_words.release()
+        self.spt_memory.close()
+        self.spt_memory.unlink()
+
+    # Private functions
+
+    def __declare(self, stream_id, stream_key):
+        """Writes the key of a stream and makes it visible to the readers"""
+
+        key_bytes = "|".join(stream_key).encode("utf-8")[
+            : bodynodes_pose_tables["max_key_bytes"]
+        ]
+        pose_table_structs["key"].pack_into(
+            self.spt_memory.buf,
+            pose_table_structs["header"].size
+            + stream_id * pose_table_structs["key"].size,
+            len(key_bytes),
+            key_bytes,
+        )
+        self.spt_declared.add(stream_id)
+        # Number of streams, the readers reload the keys when it changes
+        self.spt_words[2] = max(self.spt_words[2], stream_id + 1)
+
+
+class BnSharedPoseReader:
+    """Reader side of a BnSharedPoseTable, it attaches to the table of a running host by name"""
+
+    def __init__(self, name):
+        self.spr_memory = attach_shared_memory(name)
+        self.spr_words = self.spr_memory.buf.cast("Q")
+        magic, self.spr_max_streams, _ = pose_table_structs["header"].unpack_from(
+            self.spr_memory.buf, 0
+        )
+        if magic != pose_table_kinds["magic"]:
+            self.close()
+            raise ValueError(f"{name} is not a Bodynodes pose table")
+        # (player, bodypart, sensortype) => stream id
+        self.spr_ids = {}
+        self.spr_num_streams = 0
+
+    def get_stream_id(self, player, bodypart, sensortype):
+        """Returns the id of the player+bodypart+sensortype stream, None if it was never published"""
+
+        key = (player, bodypart, sensortype)
+        if key not in self.spr_ids and self.spr_words[2] != self.spr_num_streams:
+            self.__load_keys()
+        return self.spr_ids.get(key)
+
+    def get_stream_keys(self):
+        """Returns the (player, bodypart, sensortype) keys of the published streams"""
+
+        if self.spr_words[2] != self.spr_num_streams:
+            self.__load_keys()
+        return list(self.spr_ids)
+
+    def get_version(self, stream_id):
+        """Returns how many values were published for the stream"""
+
+        return (
+            self.spr_words[pose_slot_offset(self.spr_max_streams, stream_id) // 8] // 2
+        )
+
+    def get_sample(self, stream_id):
+        """Returns (receive time in ms, value) of the latest value of the stream.
+        None if there is none, or if the slot stayed in writing for max_read_retries tries
+        """
+
+        offset = pose_slot_offset(self.spr_max_streams, stream_id)
+        seq_index = offset // 8
+        for _ in range(bodynodes_pose_tables["max_read_retries"]):
+            seq = self.spr_words[seq_index]
+            if seq % 2 == 1:
+                # The host is writing the slot
+                continue
+            _, timestamp_ms, kind, length = pose_table_structs["slot"].unpack_from(
+                self.spr_memory.buf, offset
+            )
+            offset_value = offset + pose_table_structs["slot"].size
+            try:
+                if kind == pose_table_kinds["json"]:
+                    payload = bytes(
+                        self.spr_memory.buf[offset_value : offset_value + length]
+                    )
+                elif kind != pose_table_kinds["empty"]:
+                    payload = pose_table_structs["values"][length].unpack_from(
+                        self.spr_memory.buf, offset_value
+                    )
+            except (IndexError, struct.error):
+                # The length was read while the host was writing the slot
+                continue
+            if self.spr_words[seq_index] == seq:
+                break
+        else:
+            return None
+
+        if kind == pose_table_kinds["empty"]:
+            return None
+        if kind == pose_table_kinds["json"]:
+            return timestamp_ms, json.loads(payload)
+        if kind == pose_table_kinds["integers"]:
+            return timestamp_ms, [int(number) for number in payload]
+        return timestamp_ms, list(payload)
+
+    def get_value(self, stream_id):
+        """Returns the latest value of the stream, None if there is none"""
+
+        sample = self.get_sample(stream_id)
+        if sample is None:
+            return None
+        return sample[1]
+
+    def get_message_value(self, player, bodypart, sensortype):
+        """Returns the latest value of the player+bodypart+sensortype stream, None if there is none"""
+
+        stream_id = self.get_stream_id(player, bodypart, sensortype)
+        if stream_id is None:
+            return None
+        return self.get_value(stream_id)
+
+    def get_values_view(self, stream_id):
+        """Returns a zero-copy float64 memoryview of the value slot of the stream, for numeric values.
+        The host can write it at any time, compare get_version before and after reading to detect that
+        """
+
+        offset = (
+            pose_slot_offset(self.spr_max_streams, stream_id)
+            + pose_table_structs["slot"].size
+        )
+        return self.spr_memory.buf[
+            offset : offset + bodynodes_pose_tables["max_value_bytes"]
+        ].cast("d")
+
+    def close(self):
+        """Detaches from the table, the views given by get_values_view must be released before"""
+
+        self.spr_words.release()
+        self.spr_memory.close()
+
+    # Private functions
+
+    def __load_keys(self):
+        """Reloads the keys of the published streams"""
+
+        num_streams = self.spr_words[2]
+        for stream_id in range(num_streams):
+            length, key_bytes = pose_table_structs["key"].unpack_from(
+                self.spr_memory.buf,
+                pose_table_structs["header"].size
+                + stream_id * pose_table_structs["key"].size,
+            )
+            key = tuple(key_bytes[:length].decode("utf-8").split("|"))
+            if len(key) == 3:
+                self.spr_ids[key] = stream_id
+        self.spr_num_streams = num_streams
@@ -0,0 +1,379 @@
+#
+# MIT License
+#
+# Copyright (c) 2026 Manuel Bottini
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Simulator of Bodynodes Wifi nodes, to load a host with realistic traffic without a suit.
+Each virtual node waits for the multicast beacon of the host, does the ACKN/ACKH handshake and then streams its sensors.
+Example: python3 bnnodesimulator.py --nodes 100 --rate 60 --processes 4
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import random
+import socket
+import struct
+import time
+
+from bncommon import BnConstants
+
+bodynodes_simulator = {
+    "identifier": "BN",
+    # Host ip address, None discovers it with the multicast beacon
+    "host": None,
+    "nodes": 10,
+    # Ticks per second, each tick every node produces one message per sensortype
+    "rate_hz": 50,
+    # Messages sent in each datagram
+    "batch_size": 1,
+    # Layout of the messages of a datagram: "concatenated", "array" (json array) or "ndjson" (one message per line)
+    "batch_format": "concatenated",
+    "sensortypes": [
+        BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
+        BnConstants.SENSORTYPE_ACCELERATION_REL_TAG,
+        BnConstants.SENSORTYPE_GLOVE_TAG,
+    ],
+    # Probability of a datagram to be lost
+    "loss": 0.0,
+    # Probability of a datagram to be sent after the following one
+    "reorder": 0.0,
+    # Seconds the nodes keep their datagrams before sending them all at once, 0 sends them at each tick
+    "burst_interval_s": 0,
+    # Processes sharing the nodes, each one runs its nodes as asyncio tasks
+    "processes": 1,
+    "duration_s": 10,
+    "ack_interval_ms": 1000,
+    # Seconds to wait for the multicast beacon
+    "discovery_timeout_s": 10,
+    "seed": 0,
+    # Replace the last element of each value with the time.monotonic() of the tick, to measure latencies
+    "stamp_values": False,
+}
+
+simulator_bodyparts = [
+    BnConstants.BODYPART_KATANA_TAG,
+    BnConstants.BODYPART_UPPERARM_LEFT_TAG,
+    BnConstants.BODYPART_UPPERARM_RIGHT_TAG,
+    BnConstants.BODYPART_LOWERARM_RIGHT_TAG,
+]
+
+
+class BnSimulatedNode(asyncio.DatagramProtocol):
+    """Virtual node, it streams the messages of its player+bodypart to the host"""
+
+    def __init__(self, index, options):
+        self.sn_options = options
+        # Player and bodypart of all the messages
+        self.sn_source = {
+            BnConstants.MESSAGE_PLAYER_TAG: f"sim{index // len(simulator_bodyparts)}",
+            BnConstants.MESSAGE_BODYPART_TAG: simulator_bodyparts[
+                index % len(simulator_bodyparts)
+            ],
+        }
+        self.sn_random = random.Random(options["seed"] * 100003 + index)
+        self.sn_transport = None
+        self.sn_acknowledged = asyncio.Event()
+        # Datagram held back to be sent after the following one
+        self.sn_held = None
+        self.sn_stats = {
+            "connected": False,
+            "datagrams": 0,
+            "messages": 0,
+            "lost": 0,
+            "reordered": 0,
+            "actions": 0,
+        }
+
+    def connection_made(self, transport):
+        self.sn_transport = transport
+
+    def datagram_received(self, data, addr):
+        if data.find(b"ACKH") >= 0:
+            self.sn_acknowledged.set()
+        else:
+            self.sn_stats["actions"] += 1
+
+    def get_stats(self):
+        """Returns the counters of the node"""
+
+        return self.sn_stats
+
+    async def run(self, host_address, deadline):
+        """Connects to the host and streams until the deadline (loop time)"""
+
+        loop = asyncio.get_running_loop()
+        while not self.sn_acknowledged.is_set():
+            if loop.time() >= deadline:
+                return
+            self.sn_transport.sendto(b"ACKN", host_address)
+            try:
+                await asyncio.wait_for(
+                    self.sn_acknowledged.wait(),
+                    self.sn_options["ack_interval_ms"] / 1000,
+                )
+            except asyncio.TimeoutError:
+                continue
+        self.sn_stats["connected"] = True
+
+        period = 1 / self.sn_options["rate_hz"]
+        # Nodes do not start in sync
+        next_tick = loop.time() + self.sn_random.random() * period
+        last_flush = next_tick
+        pending = []
+        tick = 0
+        while next_tick < deadline:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            pending.extend(self.__create_messages(tick))
+            tick += 1
+            next_tick += period
+            if (
+                loop.time() - last_flush >= self.sn_options["burst_interval_s"]
+                or next_tick >= deadline
+            ):
+                self.__send_messages(pending, host_address)
+                pending = []
+                last_flush = loop.time()
+        if self.sn_held is not None:
+            self.sn_transport.sendto(self.sn_held, host_address)
+            self.sn_held = None
+
+    # Private functions
+
+    def __create_messages(self, tick):
+        """Returns the encoded messages of a tick, one per sensortype"""
+
+        angle = tick * 0.01
+        messages = []
+        for sensortype in self.sn_options["sensortypes"]:
+            if sensortype == BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG:
+                value = [math.cos(angle), 0.0, math.sin(angle), 0.0]
+            elif sensortype == BnConstants.SENSORTYPE_GLOVE_TAG:
+                value = [(tick + finger * 20) % 180 for finger in range(9)]
+            else:
+                value = [self.sn_random.uniform(-1, 1) for _ in range(3)]
+            if self.sn_options["stamp_values"]:
+                value[-1] = time.monotonic()
+            messages.append(
+                json.dumps(
+                    {
+                        **self.sn_source,
+                        BnConstants.MESSAGE_SENSORTYPE_TAG: sensortype,
+                        BnConstants.MESSAGE_VALUE_TAG: value,
+                    }
+                ).encode("utf-8")
+            )
+        return messages
+
+    def __send_messages(self, messages, host_address):
+        """Sends the messages in datagrams of batch_size messages, applying loss and reordering"""
+
+        batch_size = self.sn_options["batch_size"]
+        for index in range(0, len(messages), batch_size):
+            batch = messages[index : index + batch_size]
+            datagram = encode_batch(batch, self.sn_options["batch_format"])
+            self.sn_stats["datagrams"] += 1
+            self.sn_stats["messages"] += len(batch)
+            if self.sn_random.random() < self.sn_options["loss"]:
+                self.sn_stats["lost"] += 1
+                continue
+            if self.sn_held is None and (
+                self.sn_random.random() < self.sn_options["reorder"]
+            ):
+                self.sn_held = datagram
+                self.sn_stats["reordered"] += 1
+                continue
+            self.sn_transport.sendto(datagram, host_address)
+            if self.sn_held is not None:
+                self.sn_transport.sendto(self.sn_held, host_address)
+                self.sn_held = None
+
+
+def encode_batch(messages, batch_format):
+    """Returns the datagram of the encoded messages in the batch_format of bodynodes_simulator"""
+
+    if batch_format == "array":
+        return b"[" + b",".join(messages) + b"]"
+    if batch_format == "ndjson":
+        return b"\n".join(messages) + b"\n"
+    return b"".join(messages)
+
+
+def discover_host(identifier, timeout_s):
+    """Waits for the multicast beacon with the identifier. Returns the host ip address, None if it did not come"""
+
+    beacon_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    beacon_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    beacon_socket.bind(("", BnConstants.WIFI_MULTICAST_PORT))
+    beacon_socket.setsockopt(
+        socket.IPPROTO_IP,
+        socket.IP_ADD_MEMBERSHIP,
+        struct.pack(
+            "4s4s",
+            socket.inet_aton(BnConstants.WIFI_MULTICASTGROUP_DEFAULT),
+            socket.inet_aton("0.0.0.0"),
+        ),
+    )
+    deadline = time.monotonic() + timeout_s
+    try:
+        while time.monotonic() < deadline:
+            beacon_socket.settimeout(max(0.01, deadline - time.monotonic()))
+            try:
+                message, address = beacon_socket.recvfrom(64)
+            except socket.timeout:
+                break
+            if message.rstrip(b"\0").decode("utf-8", "replace") == identifier:
+                return address[0]
+    finally:
+        beacon_socket.close()
+    return None
+
+
+async def run_nodes(indexes, options, host_ip):
+    """Runs the nodes with the given indexes as asyncio tasks. Returns their stats"""
+
+    loop = asyncio.get_running_loop()
+    nodes = []
+    for index in indexes:
+        _, node = await loop.create_datagram_endpoint(
+            lambda index=index: BnSimulatedNode(index, options),
+            local_addr=("0.0.0.0", 0),
+        )
+        nodes.append(node)
+    deadline = loop.time() + options["duration_s"]
+    host_address = (host_ip, BnConstants.WIFI_PORT)
+    await asyncio.gather(*(node.run(host_address, deadline) for node in nodes))
+    for node in nodes:
+        node.sn_transport.close()
+    return [node.get_stats() for node in nodes]
+
+
+def run_nodes_process(indexes, options, host_ip, results):
+    """Process function, it runs its nodes and puts their stats in results"""
+
+    results.put(asyncio.run(run_nodes(indexes, options, host_ip)))
+
+
+def run_simulation(options=None):
+    """Runs the simulated nodes, options override bodynodes_simulator. Returns the report, it is dumpable as json"""
+
+    simulation_options = dict(bodynodes_simulator)
+    simulation_options.update(options or {})
+    host_ip = simulation_options["host"]
+    if host_ip is None:
+        host_ip = discover_host(
+            simulation_options["identifier"],
+            simulation_options["discovery_timeout_s"],
+        )
+        if host_ip is None:
+            print("No host found")
+            return None
+
+    start_time = time.perf_counter()
+    indexes = list(range(simulation_options["nodes"]))
+    num_processes = max(1, min(simulation_options["processes"], len(indexes)))
+    if num_processes == 1:
+        nodes_stats = asyncio.run(run_nodes(indexes, simulation_options, host_ip))
+    else:
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=run_nodes_process,
+                args=(
+                    indexes[number::num_processes],
+                    simulation_options,
+                    host_ip,
+                    results,
+                ),
+            )
+            for number in range(num_processes)
+        ]
+        for process in processes:
+            process.start()
+        nodes_stats = []
+        for _ in processes:
+            nodes_stats.extend(results.get())
+        for process in processes:
+            process.join()
+    elapsed_s = time.perf_counter() - start_time
+
+    report = {"host": host_ip, "nodes": len(nodes_stats), "elapsed_s": elapsed_s}
+    for counter in ("datagrams", "messages", "lost", "reordered", "actions"):
+        report[counter] = sum(node_stats[counter] for node_stats in nodes_stats)
+    report["connected"] = sum(node_stats["connected"] for node_stats in nodes_stats)
+    report["messages_per_s"] = report["messages"] / max(elapsed_s, 1e-9)
+    return report
+
+
+def main():
+    """Main function running the simulator"""
+
+    parser = argparse.ArgumentParser(description="Simulates Bodynodes Wifi nodes")
+    parser.add_argument("--identifier", default=bodynodes_simulator["identifier"])
+    parser.add_argument("--host", help="host ip address, skips the discovery")
+    parser.add_argument("--nodes", type=int, default=bodynodes_simulator["nodes"])
+    parser.add_argument("--rate", type=float, default=bodynodes_simulator["rate_hz"])
+    parser.add_argument("--batch", type=int, default=bodynodes_simulator["batch_size"])
+    parser.add_argument(
+        "--batch-format",
+        choices=["concatenated", "array", "ndjson"],
+        default=bodynodes_simulator["batch_format"],
+    )
+    parser.add_argument("--loss", type=float, default=bodynodes_simulator["loss"])
+    parser.add_argument("--reorder", type=float, default=bodynodes_simulator["reorder"])
+    parser.add_argument(
+        "--burst-interval",
+        type=float,
+        default=bodynodes_simulator["burst_interval_s"],
+    )
+    parser.add_argument(
+        "--processes", type=int, default=bodynodes_simulator["processes"]
+    )
+    parser.add_argument(
+        "--duration", type=float, default=bodynodes_simulator["duration_s"]
+    )
+    arguments = parser.parse_args()
+
+    report = run_simulation(
+        {
+            "identifier": arguments.identifier,
+            "host": arguments.host,
+            "nodes": arguments.nodes,
+            "rate_hz": arguments.rate,
+            "batch_size": arguments.batch,
+            "batch_format": arguments.batch_format,
+            "loss": arguments.loss,
+            "reorder": arguments.reorder,
+            "burst_interval_s": arguments.burst_interval,
+            "processes": arguments.processes,
+            "duration_s": arguments.duration,
+        }
+    )
+    if report is not None:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
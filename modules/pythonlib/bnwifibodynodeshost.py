@@ -26,19 +26,99 @@ Module implementation of the WiFi Bodynode Host.
 """
 
 import socket
+import selectors
+import re
 import threading
-import json
 import time
 import sys
 
 from bncommon import BnConstants
-
-# TO REMOVE
+from bnhostactions import BnActionSender
+from bnhostbinary import is_binary_frame
+from bnhostcapture import BnCaptureWriter
+from bnhostconnections import BnConnectionTable
+from bnhostframes import BnFrameAssembler
+from bnhostshards import BnShardPool
+from bnhostsockets import BnDatagramReceiver, BnMulticastBeacon
+from bnhoststats import BnLatencyTracker, BnStatsReporter
+from bnhoststreams import BnSubscriptions
+from bnhostutils import (
+    BnJsonDecoder,
+    BnListenerRoutes,
+    BnSharedPoseTable,
+    BnStreamTable,
+)
+
+# Host options, start() takes a dict overriding any of them
 bodynodes_server = {
+    # Longest datagram of batched actions sent to a node
     "buffer_size": 1024,
     "connection_keep_alive_rec_interval_ms": 60000,
+    # Time without data after which a connection is stale, it is disconnected after connection_keep_alive_rec_interval_ms
+    "connection_stale_ms": 3000,
     "connection_ack_interval_ms": 1000,
     "multicast_ttl": 2,
+    # The multicast beacon starts with bursts at this interval, and goes back to them when a node disconnects
+    "multicast_burst_interval_ms": 200,
+    # The beacon interval is multiplied by this factor after each message, up to the steady interval
+    "multicast_backoff_factor": 2,
+    "multicast_steady_interval_ms": 5000,
+    # Longest time the data thread sleeps without data, used for keep-alive checks
+    "receive_idle_timeout_ms": 100,
+    # Max datagrams read from the socket before they get processed
+    "receive_batch_size": 1024,
+    # Longest datagram received (up to 65535 bytes), longer ones are dropped and counted as truncated.
+    # Each of the receive_batch_size receive slots is preallocated with this size
+    "max_datagram_size": 4096,
+    # Max datagrams waiting to be processed for each connection, the oldest are dropped
+    "connection_queue_size": 256,
+    # Accept the binary frames described below next to the json messages
+    "binary_frames": False,
+    # Samples kept in the history of each stream, 0 means no history
+    "history_capacity": 0,
+    # Worker processes sharing the data port with SO_REUSEPORT, each one parsing the traffic of its nodes.
+    # 0 parses everything in the data thread
+    "ingest_shards": 0,
+    # Samples each worker can publish before the host reads them
+    "shard_ring_slots": 16384,
+    # Longest time a worker waits for the host to make room in a full ring, then the sample is dropped
+    "shard_ring_full_wait_ms": 100,
+    # Longest time to wait for a worker to bind the data port
+    "shard_start_timeout_s": 5,
+    # Name of the shared memory table where the latest values are published for the local processes,
+    # see BnSharedPoseReader. None does not publish them
+    "shared_table_name": None,
+    # Streams the shared memory table can hold
+    "shared_table_streams": 256,
+    # Seconds between two reports of the connection stats, 0 does not report them
+    "stats_report_interval_s": 0,
+    # File where the stats reports are appended as json lines, None prints them
+    "stats_report_path": None,
+    # Send the actions of a node in as few datagrams as possible, the node must accept several json in a datagram
+    "action_batching": False,
+    # Capture file of the received datagrams, each ingest worker writes capture_path.<worker number>. None does not capture
+    "capture_path": None,
+    # Do not receive nor send anything, the datagrams are injected with inject_datagram (e.g. replaying a capture)
+    "offline": False,
+    # Take the receive time of the datagrams from the kernel (SO_TIMESTAMPNS) instead of after reading them
+    "kernel_timestamps": False,
+    # Keep the latency histograms given by get_latency_histograms
+    "latency_histograms": False,
+    # Kernel receive and send buffers of the data socket (of each ingest worker) in bytes, None keeps the system default.
+    # The kernel can grant a different size (Linux doubles it and caps it to net.core.rmem_max/wmem_max), see get_socket_stats
+    "socket_receive_buffer": None,
+    "socket_send_buffer": None,
+    # Time in us the kernel busy polls the device when the data socket has no datagrams (SO_BUSY_POLL, Linux). 0 does not busy poll
+    "socket_busy_poll_us": 0,
+    # Count the datagrams the kernel dropped because the receive buffer was full (SO_RXQ_OVFL, Linux), see get_socket_stats
+    "kernel_drop_counters": False,
+    # Json backend of the single message datagrams: "orjson", "ujson", "json". None picks the fastest installed one
+    "json_backend": None,
+}
+
+receive_patterns = {
+    # Searched in the received memoryview without copying it
+    "ackn": re.compile(b"ACKN"),
 }
 
 
@@ -57,7 +137,9 @@ class BodynodeListener:
         )
 
     def is_of_interest(self, player, bodypart, sensortype):
-        """By overriding this function you can set which set of player / bodypart / sensortype the listerner returns data of"""
+        """By overriding this function you can set which set of player / bodypart / sensortype the listerner returns data of.
+        It is called once per stream, the answer is kept until listeners are added or removed
+        """
         print(
             f"is_of_interest: returning True for player={player} bodypart={bodypart} sensortype={sensortype}"
         )
@@ -71,56 +153,87 @@ class BodynodeListenerTest(BodynodeListener):
         print("This is a test class")
 
 
-class BnWifiHostCommunicator:
+class BnWifiHostCommunicator:  # pylint: disable=too-many-instance-attributes,too-many-public-methods # reason: State is grouped in dicts and the API mirrors the other hosts, further splitting would not help readability
     """Bodynodes Wifi Host ommunicator implementation"""
 
     def __init__(self):
         # Connection threads
         self.whc_connection_threads = {
             "data": None,
-            "multicast": None,
         }
         # Boolean to stop the thread
         self.whc_to_stop = True
 
         self.whc_maps = {
-            # Json object containing the messages for each player+bodypart+sensortype combination (key)
+            # Table with the latest message of each player+bodypart+sensortype stream
             "messages": None,
-            # Map the connections (ip_address) to the player+bodypart combination (key)
+            # Map the connections (ip_address, port) to the (player, bodypart) combination (key)
             "connections": None,
-            # Map temporary connections data to an arbitrary string representation of a connection (key)
-            "tempconnections_data": None,
+            # Shared memory copy of the messages table for the local processes
+            "shared_table": None,
+            # Monotonic receive time in ns of the latest sample of each stream id
+            "receive_times": None,
         }
         # Connector object that can receive and send data
         self.whc_connectors = {
             "data": None,
             "multicast": None,
+            # Socket pair used to wake up the data thread when stopping
+            "wakeup_reader": None,
+            "wakeup_writer": None,
         }
-        # Connector object that can advertise itself in the network
-        # List of actions to send
-        self.whc_actions_tosend = None
-        self.whc_bodynodes_listeners = []
+        # Sends the queued actions to the nodes when flushed
+        self.whc_actions = BnActionSender(self.__get_node_address)
+        # Advertises the host in the multicast group
+        self.whc_beacon = BnMulticastBeacon()
+        # Temporary connections data of the nodes, with their received datagrams
+        self.whc_connections = BnConnectionTable(self.__burst_multicast)
+        self.whc_bodynodes_listeners = BnListenerRoutes()
+        self.whc_subscriptions = BnSubscriptions()
         self.whc_identifier = None
+        # Host options, they default to bodynodes_server
+        self.whc_options = dict(bodynodes_server)
+        # Host side, the ingest worker processes
+        self.whc_shard_pool = BnShardPool(
+            self.__add_shard_stream,
+            self.__deliver_message,
+            self.whc_beacon.burst,
+        )
+        # Worker side, where the samples are published for the host
+        self.whc_shard_publisher = None
+        self.whc_stats_reporter = None
+        self.whc_frames = BnFrameAssembler()
+        self.whc_capture = None
+        # Receives the datagrams of the data socket, None if it does not receive
+        self.whc_receiver = None
+        # Json decoder shared by the framers of all the connections
+        self.whc_json_decoder = BnJsonDecoder()
+        # Latency histograms, kept with the latency_histograms option
+        self.whc_latency = BnLatencyTracker()
 
     # Public functions
     def start(self, communication_parameters):
-        """Starts the communicator"""
+        """Starts the communicator.
+        communication_parameters is [identifier] or [identifier, options], where options is a dict overriding bodynodes_server
+        """
         print("BnWifiHostCommunicator - Starting")
 
         self.whc_maps = {
-            "messages": {},
+            "messages": BnStreamTable(),
             "connections": {},
-            "tempconnections_data": {},
+            "shared_table": None,
+            "receive_times": {},
         }
         self.whc_connectors = {
             "data": None,
             "multicast": None,
+            "wakeup_reader": None,
+            "wakeup_writer": None,
         }
         self.whc_connection_threads = {
             "data": None,
-            "multicast": None,
         }
-        self.whc_actions_tosend = []
+        self.whc_actions.clear()
         self.whc_identifier = None
 
         try:
@@ -142,78 +255,105 @@ class BnWifiHostCommunicator:
 
         self.whc_connectors["data"].setblocking(False)
         self.whc_connectors["multicast"].setblocking(False)
+        (
+            self.whc_connectors["wakeup_reader"],
+            self.whc_connectors["wakeup_writer"],
+        ) = socket.socketpair()
+        self.whc_connectors["wakeup_reader"].setblocking(False)
 
-        self.whc_connection_threads["data"] = threading.Thread(
-            target=self.run_data_connection_background
-        )
-        self.whc_connection_threads["multicast"] = threading.Thread(
-            target=self.run_multicast_connection_background
-        )
-
-        if communication_parameters is None or len(communication_parameters) != 1:
+        if not communication_parameters or len(communication_parameters) > 2:
             print('Please provide a Multicast Identifier, example ["BN"]')
             return
 
         self.whc_identifier = communication_parameters[0]
-        try:
-            self.whc_connectors["data"].bind(("", BnConstants.WIFI_PORT))
-        except OSError:
-            print(
-                "Cannot start the data socket. Is the IP address correct? Or is there any ip connection?"
-            )
-
-        try:
-            print("Interfaces = ")
-            all_ifaces = socket.gethostbyname_ex(socket.gethostname())[2]
-            print(all_ifaces)
-
-            group = socket.inet_aton(BnConstants.WIFI_MULTICASTGROUP_DEFAULT)
-            # iface = inet_aton(self.whc_host_ip) # Connect the multicast packets on this interface.
-            self.whc_connectors["multicast"].setsockopt(
-                socket.IPPROTO_IP,
-                socket.IP_MULTICAST_TTL,
-                bodynodes_server["multicast_ttl"],
-            )
-            for iface in all_ifaces:
-                print("Using interface = " + str(iface))
-                self.whc_connectors["multicast"].setsockopt(
-                    socket.IPPROTO_IP,
-                    socket.IP_ADD_MEMBERSHIP,
-                    group + socket.inet_aton(iface),
+        self.__set_options(
+            communication_parameters[1] if len(communication_parameters) == 2 else {}
+        )
+        self.whc_json_decoder = BnJsonDecoder(self.whc_options["json_backend"])
+        self.whc_connections.start(
+            self.whc_maps["messages"], self.whc_json_decoder, self.whc_options
+        )
+        self.whc_maps["messages"].set_history_capacity(
+            self.whc_options["history_capacity"]
+        )
+        self.whc_frames.set_table(self.whc_maps["messages"])
+        if (
+            self.whc_options["shared_table_name"] is not None
+            and self.whc_shard_publisher is None
+        ):
+            try:
+                self.whc_maps["shared_table"] = BnSharedPoseTable(
+                    self.whc_options["shared_table_name"],
+                    self.whc_options["shared_table_streams"],
                 )
-        except OSError as er:
-            print("Cannot start multicast socket. No network connections available?")
-            print(er)
+            except FileExistsError as err:
+                print("Cannot publish the shared table: ", err)
 
         self.whc_to_stop = False
-        self.whc_connection_threads["data"].start()
-        self.whc_connection_threads["multicast"].start()
+        self.whc_subscriptions.start()
+        self.__start_ingest()
+        if self.whc_options["stats_report_interval_s"] > 0:
+            self.start_stats_report(
+                self.whc_options["stats_report_interval_s"],
+                self.whc_options["stats_report_path"],
+            )
+        if self.whc_shard_publisher is not None or self.whc_options["offline"]:
+            # Workers and offline hosts do not advertise the host nor send actions
+            return
+
+        self.whc_actions.start(
+            self.whc_connectors["data"].sendto,
+            (
+                self.whc_options["buffer_size"]
+                if self.whc_options["action_batching"]
+                else None
+            ),
+        )
+        self.whc_beacon.start(
+            self.whc_connectors["multicast"], self.whc_identifier, self.whc_options
+        )
 
     def stop(self):
         """Stops the communicator"""
 
         print("BnWifiHostCommunicator - Stopping")
+        self.stop_stats_report()
+        # The receiving thread can be waiting for room in a subscription
+        self.whc_subscriptions.close_all()
         self.whc_to_stop = True
+        self.whc_connectors["wakeup_writer"].send(b"\0")
+        if self.whc_connection_threads["data"] is not None:
+            self.whc_connection_threads["data"].join()
+        self.stop_capture()
+        # The actions queued until now are sent before the data socket is closed
+        self.whc_actions.stop()
+        self.whc_beacon.stop()
         self.whc_connectors["data"].close()
         self.whc_connectors["multicast"].close()
-        self.whc_connection_threads["data"].join()
-        self.whc_connection_threads["multicast"].join()
+        self.whc_shard_pool.stop()
+        if self.whc_maps["shared_table"] is not None:
+            self.whc_maps["shared_table"].close()
+        self.whc_connectors["wakeup_reader"].close()
+        self.whc_connectors["wakeup_writer"].close()
         print("BnWifiHostCommunicator - Stopped!")
-        self.whc_bodynodes_listeners = []
+        self.whc_bodynodes_listeners.clear()
 
         self.whc_connection_threads = {
             "data": None,
-            "multicast": None,
         }
         self.whc_connectors = {
             "data": None,
             "multicast": None,
+            "wakeup_reader": None,
+            "wakeup_writer": None,
         }
         self.whc_maps = {
             "messages": None,
             "connections": None,
-            "tempconnections_data": None,
+            "shared_table": None,
+            "receive_times": None,
         }
+        self.whc_frames.set_table(None)
 
     def is_running(self):
         """Returns true if the communicator is running, false otherwise"""
@@ -226,92 +366,243 @@ class BnWifiHostCommunicator:
         print("Update function called [NOT IN USE]")
 
     def run_data_connection_background(self):
-        """Data connection runner function"""
+        """Data connection runner function, it sleeps until the data socket is readable and then drains every pending datagram"""
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.whc_connectors["data"], selectors.EVENT_READ, "data")
+        selector.register(
+            self.whc_connectors["wakeup_reader"], selectors.EVENT_READ, "wakeup"
+        )
+        idle_timeout_s = self.whc_options["receive_idle_timeout_ms"] / 1000
 
         while not self.whc_to_stop:
-            self.check_all_ok()
-            time.sleep(0.01)
+            events = selector.select(timeout=idle_timeout_s)
+            if not events:
+                # Nothing arrived, only the keep-alive checks are needed
+                self.__check_connections()
+                self.__send_shard_stats()
+                continue
+
+            for key, _ in events:
+                if key.data == "wakeup":
+                    self.__drain_wakeup()
+                elif key.data == "data":
+                    while not self.whc_to_stop and self.__receive_bytes() > 0:
+                        self.__check_connections()
+                        self.__ring_shard_doorbell()
+                    self.__send_shard_stats()
 
-    def run_multicast_connection_background(self):
-        """Multicast connection runner function"""
+        selector.close()
 
+    def run_shards_connection_background(self):
+        """Ingest workers runner function, it sleeps until a worker rings and then collects its samples"""
+
+        idle_timeout_s = self.whc_options["receive_idle_timeout_ms"] / 1000
         while not self.whc_to_stop:
-            self.__send_multicast_message()
-            time.sleep(5)
+            if self.whc_shard_pool.collect(
+                self.whc_connectors["wakeup_reader"], idle_timeout_s
+            ):
+                self.__drain_wakeup()
 
     def get_message_value(self, player, bodypart, sensortype):
         """Returns the message associated to the requested player+bodypart+sensortype combination"""
 
-        pbs_key = f"{player}|{bodypart}|{sensortype}"
-        if pbs_key in self.whc_maps["messages"]:
-            return self.whc_maps["messages"][pbs_key]
-        return None
+        if self.whc_options["latency_histograms"]:
+            self.whc_latency.add_read(self.get_stream_id(player, bodypart, sensortype))
+        return self.whc_frames.get_message_value(player, bodypart, sensortype)
+
+    def get_stream_id(self, player, bodypart, sensortype):
+        """Returns the id of the player+bodypart+sensortype stream, None if it was never received.
+        The id stays the same until the communicator is restarted"""
+
+        return self.whc_maps["messages"].get_stream_id(player, bodypart, sensortype)
+
+    def get_message_value_by_id(self, stream_id):
+        """Returns the message associated to the stream id given by get_stream_id"""
+
+        if self.whc_options["latency_histograms"]:
+            self.whc_latency.add_read(stream_id)
+        return self.whc_frames.get_value(stream_id)
+
+    def get_receive_time(self, player, bodypart, sensortype):
+        """Returns the monotonic time in ns (time.monotonic_ns) when the latest message of the
+        player+bodypart+sensortype combination was received, None if it was never received
+        """
+
+        stream_id = self.get_stream_id(player, bodypart, sensortype)
+        return self.whc_maps["receive_times"].get(stream_id)
+
+    def set_history_capacity(self, capacity):
+        """Keeps the latest capacity samples of each stream with their receive time, 0 disables the history"""
+
+        self.whc_options["history_capacity"] = capacity
+        self.whc_maps["messages"].set_history_capacity(capacity)
+
+    def get_history(self, player, bodypart, sensortype, since_ms):
+        """Returns (timestamps, values) of the samples received after since_ms (same clock as time.time() * 1000).
+        They are zero-copy memoryviews, overwritten by the following samples. None if there is no history
+        """
+
+        stream_id = self.get_stream_id(player, bodypart, sensortype)
+        if stream_id is None:
+            return None
+        return self.whc_maps["messages"].get_history(stream_id, since_ms)
+
+    def get_window(self, player, bodypart, sensortype, num_samples):
+        """Returns (timestamps, values) of the latest num_samples samples, as get_history does"""
+
+        stream_id = self.get_stream_id(player, bodypart, sensortype)
+        if stream_id is None:
+            return None
+        return self.whc_maps["messages"].get_window(stream_id, num_samples)
+
+    def get_frame(self, player, wait_ms=0):
+        """Returns a BnFrame, an immutable snapshot of the latest value of each stream of the player taken at once.
+        With wait_ms it first waits up to wait_ms for all of them to refresh. None if the player was never received
+        """
+
+        return self.whc_frames.get_frame(player, wait_ms)
+
+    def wait_for_update(self, keys, timeout_ms, versions=None):
+        """Waits up to timeout_ms for a new value of any of the (player, bodypart, sensortype) keys.
+        Returns the list of the keys with a new value, empty if none came.
+        A loop passing the same versions dict does not miss the values received between two calls
+        """
+
+        return self.whc_frames.wait_for_update(keys, timeout_ms, versions)
+
+    def wait_for_frame(self, player, timeout_ms, since=None):
+        """Waits up to timeout_ms for a new value of any stream of the player. Returns its BnFrame, None if none came.
+        A loop passing the previous frame as since does not miss the values received between two calls
+        """
+
+        return self.whc_frames.wait_for_frame(player, timeout_ms, since)
+
+    def set_frame_callback(self, on_frame, window_ms=None):
+        """Calls on_frame(frame) each time all the streams of a player refreshed, or window_ms after the first of them did.
+        It is called in the receiving thread. None removes the callback
+        """
+
+        self.whc_frames.set_callback(on_frame, window_ms)
 
     def add_action(self, action):
         """Adds an action to the list of actions to be sent"""
 
-        self.whc_actions_tosend.append(action)
+        self.whc_actions.add(action)
 
     def send_all_actions(self):
-        """Sends all actions in the list"""
+        """Sends all actions in the list, without waiting for them to be sent.
+        The actions thread sends only the latest action of each player+bodypart+type
+        """
 
-        for action in self.whc_actions_tosend:
-            player_bodypart = f"{action[BnConstants.ACTION_PLAYER_TAG]}|{action[BnConstants.ACTION_BODYPART_TAG]}"
-            if (
-                player_bodypart not in self.whc_maps["connections"]
-                or self.whc_maps["connections"][player_bodypart] is None
-            ):
-                print("Player+Bodypart connection not existing\n")
-                continue
+        if self.whc_options["offline"]:
+            self.whc_actions.clear()
+            return
+        self.whc_actions.flush()
+
+    def inject_datagram(self, address, message_bytes):
+        """Handles a datagram as if it was received from address (ip_address, port), the host must be started offline.
+        The connection of a new address starts as connected, a capture might not include its ACKN
+        """
+
+        self.whc_connections.queue_datagram(
+            address, message_bytes, "CONNECTED", time.monotonic_ns()
+        )
+        self.__check_connections()
+
+    def get_stats(self):
+        """Returns a dict with the counters and statistics of each connection ("ip_address:port"), it can be dumped as json"""
+
+        stats = self.whc_connections.get_stats()
+        self.whc_shard_pool.merge_stats(stats)
+        return stats
 
-            action_str = json.dumps(action)
-            self.whc_connectors["data"].sendto(
-                str.encode(action_str),
-                (self.whc_maps["connections"][player_bodypart], 12345),
+    def start_stats_report(self, interval_s, path=None):
+        """Reports the connection stats every interval_s seconds, printing them or appending them as json lines to path"""
+
+        self.stop_stats_report()
+        self.whc_stats_reporter = BnStatsReporter(
+            self.get_stats, interval_s, path, self.get_socket_stats
+        )
+        self.whc_stats_reporter.start()
+
+    def stop_stats_report(self):
+        """Stops reporting the connection stats"""
+
+        if self.whc_stats_reporter is not None:
+            self.whc_stats_reporter.stop()
+            self.whc_stats_reporter = None
+
+    def start_capture(self, path):
+        """Appends every received datagram to the capture file in path. Returns True if the capture started"""
+
+        if self.whc_shard_pool.is_running():
+            print(
+                "The ingest workers capture the datagrams, use the capture_path option"
             )
+            return False
+        self.stop_capture()
+        try:
+            self.whc_capture = BnCaptureWriter(path, "wifi")
+        except OSError as err:
+            print("Cannot start the capture: ", err)
+            return False
+        return True
+
+    def stop_capture(self):
+        """Stops the capture, writing the buffered datagrams to the file"""
+
+        if self.whc_capture is not None:
+            capture = self.whc_capture
+            self.whc_capture = None
+            capture.close()
+
+    def get_latency_histograms(self):
+        """Returns a dict with the snapshot of each latency histogram, the latency_histograms option must be enabled.
+        kernel_to_parse: from the receive time of a datagram to its parsing, it includes the ingest workers
+        parse_to_listener_return: from the parsing of a sample to the return of its listeners
+        sample_to_consumer_read: from the receive time of a sample to its first read with get_message_value
+        """
+
+        return self.whc_latency.get_snapshots(self.whc_shard_pool.merge_latency)
+
+    def reset_latency_histograms(self):
+        """Empties the latency histograms"""
+
+        self.whc_latency.reset()
+        self.whc_shard_pool.reset_latency()
 
-        self.whc_actions_tosend = []
+    def get_socket_stats(self):
+        """Returns a dict with the buffer sizes granted by the kernel and the kernel drops of each receiving socket,
+        "data" or "ingest_<worker number>". kernel_drops is None if kernel_drop_counters is not enabled. It can be dumped as json
+        """
+
+        sockets = {}
+        if self.whc_receiver is not None and self.whc_receiver.get_socket_stats():
+            sockets["data"] = dict(self.whc_receiver.get_socket_stats())
+        sockets.update(self.whc_shard_pool.get_socket_stats())
+        return sockets
+
+    def get_dropped_datagrams(self):
+        """Returns the number of datagrams dropped because a connection queue was full,
+        and of samples dropped because the ring of an ingest worker was full
+        """
+
+        return self.whc_connections.get_dropped() + self.whc_shard_pool.get_dropped()
 
     def check_all_ok(self):
         """Checks if everything is ok. Returns true if it is indeed ok, false otherwise"""
 
-        self.__receive_bytes()
-        for _, tempconnections_data in self.whc_maps["tempconnections_data"].items():
-
-            # print("Connection to check "+tmp_connection_str+"\n", )
-            # if (
-            #    tempconnections_data[
-            #        "received_bytes"
-            #    ]
-            #    is not None
-            # ):
-            # print("Connection to check "+tmp_connection_str+"\n", )
-            # received_bytes_str = self.whc_maps["tempconnections_data"][
-            #    tmp_connection_str
-            # ]["received_bytes"].decode("utf-8")
-            # print("Data in the received bytes "+received_bytes_str+"\n" )
-            # print("Status connection "
-            #   +tempconnections_data["STATUS"] )
-            if tempconnections_data["STATUS"] == "IS_WAITING_ACK":
-                # print("Connetion is waiting ACKN")
-                if self.__check_for_ackn(tempconnections_data):
-                    self.__send_ackh(tempconnections_data)
-                    tempconnections_data["STATUS"] = "CONNECTED"
-            else:
-                if (
-                    current_milli_time() - tempconnections_data["last_rec_time"]
-                    > bodynodes_server["connection_keep_alive_rec_interval_ms"]
-                ):
-                    tempconnections_data["STATUS"] = "DISCONNECTED"
-                if self.__check_for_ackn(tempconnections_data):
-                    print("Received ACKN")
-                    self.__send_ackh(tempconnections_data)
-                else:
-                    self.__check_for_messages(tempconnections_data)
-            tempconnections_data["received_bytes"] = None
-            tempconnections_data["num_received_bytes"] = 0
+        if not self.whc_shard_pool.is_running():
+            self.__receive_bytes()
+            self.__check_connections()
         return not self.whc_to_stop
 
+    def set_shard_publisher(self, publisher):
+        """Makes the communicator an ingest worker publishing its samples with a BnShardPublisher, before start()"""
+
+        self.whc_shard_publisher = publisher
+
     def add_listener(self, listener):
         """Add a listener to the communicator"""
 
@@ -321,7 +612,7 @@ class BnWifiHostCommunicator:
         if not isinstance(listener, BodynodeListener):
             print("Given listener does not extend BodynodeListener")
             return False
-        self.whc_bodynodes_listeners.append(listener)
+        self.whc_bodynodes_listeners.add(listener)
         return True
 
     def remove_listener(self, listener):
@@ -332,80 +623,167 @@ class BnWifiHostCommunicator:
     def remove_all_listeners(self):
         """Remove all listeners in the communicator"""
 
-        self.whc_bodynodes_listeners = []
+        self.whc_bodynodes_listeners.clear()
+
+    def stream(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Returns a generator of the BnSample of the streams matching stream_filter, it blocks until they come.
+        stream_filter is None for all the streams, a (player, bodypart, sensortype) tuple where None matches anything,
+        or a function (player, bodypart, sensortype) => bool. When queue_size samples are not read yet, backpressure
+        "latest" drops the oldest of them and "block" makes the receiving thread wait. It ends when the communicator stops
+        """
+
+        return self.whc_subscriptions.stream(stream_filter, queue_size, backpressure)
+
+    def astream(self, stream_filter=None, queue_size=None, backpressure=None):
+        """Returns an async iterator of the BnSample of the streams matching stream_filter, see stream"""
+
+        return self.whc_subscriptions.astream(stream_filter, queue_size, backpressure)
 
     # Private functions
 
+    def __check_connections(self):
+        """Handles the datagrams of the connections with new data, then expires the silent connections"""
+
+        now = current_milli_time()
+        for tempconnections_data in self.whc_connections.take_datagrams():
+            if self.whc_options["latency_histograms"]:
+                self.whc_latency.add_parse(
+                    tempconnections_data["receive_ns"], tempconnections_data["parse_ns"]
+                )
+            self.__check_connection(tempconnections_data, now)
+        self.whc_connections.check_keep_alive(now)
+
+    def __check_connection(self, tempconnections_data, now):
+        """Checks a connection, handling ACKN and messages of its current received bytes.
+        States: IS_WAITING_ACK -> CONNECTED -> STALE -> DISCONNECTED, any data brings a known connection back to CONNECTED
+        """
+
+        if tempconnections_data["STATUS"] == "IS_WAITING_ACK":
+            if self.__check_for_ackn(tempconnections_data):
+                self.__send_ackh(tempconnections_data)
+                self.whc_connections.set_connected(tempconnections_data, now)
+            return
+
+        self.whc_connections.set_connected(tempconnections_data, now)
+        if self.whc_options["binary_frames"] and is_binary_frame(
+            tempconnections_data["received_bytes"]
+        ):
+            # Float values could contain the ACKN bytes, no need to look for it
+            for stream_id, values in tempconnections_data["binary_framer"].feed(
+                tempconnections_data["received_bytes"]
+            ):
+                self.__store_message(tempconnections_data["address"], stream_id, values)
+        elif self.__check_for_ackn(tempconnections_data):
+            print("Received ACKN")
+            self.__send_ackh(tempconnections_data)
+        else:
+            self.__check_for_messages(tempconnections_data)
+
+    def __start_ingest(self):
+        """Starts receiving the datagrams, in the data thread or in the ingest workers"""
+
+        if self.whc_options["offline"]:
+            return
+        if self.whc_options["ingest_shards"] > 0 and self.whc_shard_pool.start(
+            BnWifiHostCommunicator, self.whc_identifier, self.whc_options
+        ):
+            # The workers own the data port, this socket only sends the actions
+            self.whc_connection_threads["data"] = threading.Thread(
+                target=self.run_shards_connection_background
+            )
+        else:
+            self.whc_receiver = BnDatagramReceiver(
+                self.whc_connectors["data"], self.whc_options
+            )
+            self.whc_receiver.bind(
+                BnConstants.WIFI_PORT, self.whc_shard_publisher is not None
+            )
+            if self.whc_shard_publisher is not None:
+                # The data port is shared, the host can let the nodes in
+                self.whc_shard_publisher.send_ready()
+            self.whc_connection_threads["data"] = threading.Thread(
+                target=self.run_data_connection_background
+            )
+            if self.whc_options["capture_path"] is not None:
+                self.start_capture(self.whc_options["capture_path"])
+        self.whc_connection_threads["data"].start()
+
+    def __set_options(self, options):
+        """Sets the host options, the ones not given default to bodynodes_server"""
+
+        self.whc_options = dict(bodynodes_server)
+        for option, value in options.items():
+            if option not in bodynodes_server:
+                print(f"Unknown option {option}, ignoring it")
+                continue
+            self.whc_options[option] = value
+
     def __receive_bytes(self):
-        """Receive bytes from the socket"""
+        """Receive all pending datagrams from the socket and queue them in their connections.
+        Each datagram of the batch is queued as a memoryview of its receive slot,
+        the slots are reused by the next batch as the queues are emptied in between.
+        Returns the number of datagrams received"""
+
+        if self.whc_receiver is None:
+            return 0
+        num_datagrams = 0
+        capture = self.whc_capture
+        for address, message_bytes, receive_ns in self.whc_receiver.receive_batch():
+            if message_bytes is None:
+                self.whc_connections.get_connection(address)["stats"].add_truncated()
+                continue
+            if capture is not None:
+                capture.write(address, message_bytes)
+            self.whc_connections.queue_datagram(
+                address, message_bytes, "IS_WAITING_ACK", receive_ns
+            )
+            num_datagrams += 1
+
+        return num_datagrams
+
+    def __drain_wakeup(self):
+        """Empties the wakeup socket"""
 
         try:
-            bytes_address_pair = self.whc_connectors["data"].recvfrom(
-                bodynodes_server["buffer_size"]
-            )
-        except BlockingIOError:
-            return
+            while self.whc_connectors["wakeup_reader"].recv(64):
+                pass
         except OSError:
-            return
+            pass
 
-        if not bytes_address_pair:
-            return
+    def __get_node_address(self, player, bodypart):
+        """Returns the (ip_address, port) of the connection of a player+bodypart, None if it is not connected"""
 
-        message_bytes = bytes_address_pair[0]
-        ip_address = bytes_address_pair[1][0]
-        # print(ip_address)
-        # print(message_bytes)
-        connection_str = str(ip_address)
-        if connection_str not in self.whc_maps["tempconnections_data"]:
-            new_connection_data = {}
-            new_connection_data["STATUS"] = "IS_WAITING_ACK"
-            new_connection_data["ip_address"] = ip_address
-            self.whc_maps["tempconnections_data"][connection_str] = new_connection_data
-
-        self.whc_maps["tempconnections_data"][connection_str]["num_received_bytes"] = (
-            len(message_bytes)
-        )
-        self.whc_maps["tempconnections_data"][connection_str][
-            "received_bytes"
-        ] = message_bytes
+        # The actions go to the source port of the node like ACKH does
+        return self.whc_maps["connections"].get((player, bodypart))
 
     def __send_ackh(self, connection_data):
         """Sends ACKH to a connection"""
 
         # print( "Sending ACKH to = " +connection_data["ip_address"] )
+        if self.whc_options["offline"]:
+            return
+        # Replying to the source port and not to the data port, as the Unity host does,
+        # lets several nodes behind one ip address get their own replies
         self.whc_connectors["data"].sendto(
-            str.encode("ACKH"), (connection_data["ip_address"], BnConstants.WIFI_PORT)
+            str.encode("ACKH"), connection_data["address"]
         )
 
-    def __send_multicast_message(self):
-        """Sends a message in the multicast channel"""
+    def __burst_multicast(self):
+        """Makes the beacon advertise the host quickly again, workers ask the host to do it"""
 
-        # print("self.multicast_socket = "+str(self.multicast_socket))
-        # print("Sending a BN multicast: "+str(self.whc_identifier))
-        self.whc_connectors["multicast"].sendto(
-            self.whc_identifier.encode("utf-8"),
-            (BnConstants.WIFI_MULTICASTGROUP_DEFAULT, BnConstants.WIFI_MULTICAST_PORT),
-        )
+        if self.whc_shard_publisher is None:
+            self.whc_beacon.burst()
+        elif not self.whc_shard_publisher.send_disconnected():
+            # The host is gone
+            self.whc_to_stop = True
 
     def __check_for_ackn(self, connection_data):
         """Checks if there is an ACK in the connection data. Returns true if there is, false otherwise"""
 
-        if connection_data["num_received_bytes"] < 4:
-            # print( "Check for ACKN - not enough bytes = "
-            #   + str(connection_data["num_received_bytes"]) )
+        if receive_patterns["ackn"].search(connection_data["received_bytes"]) is None:
             return False
-
-        for index in range(0, connection_data["num_received_bytes"] - 2):
-            # ACKN
-            if (
-                connection_data["received_bytes"][index] == 65
-                and connection_data["received_bytes"][index + 1] == 67
-                and connection_data["received_bytes"][index + 2] == 75
-                and connection_data["received_bytes"][index + 3] == 78
-            ):
-                connection_data["last_rec_time"] = current_milli_time()
-                return True
-        return False
+        connection_data["stats"].add_ackn()
+        return True
 
     def __check_for_messages(self, connection_data):
         """Checks if there are messages in the connection data and puts them in jsons"""
@@ -413,37 +791,14 @@ class BnWifiHostCommunicator:
         if connection_data["num_received_bytes"] == 0:
             return
 
-        message_str = connection_data["received_bytes"].decode("utf-8")
-
-        index_st = 0
-        json_messages = []
-        # print( "Original message_str = " + str(message_str) )
-        while index_st != -1:
-            index_st = message_str.find("{")
-            message_str = message_str[index_st:]
-            index_end = message_str.find("}")
-            remaining_message_str = message_str[index_end + 1 :]
-            message_str = message_str[: index_end + 1]
-            if message_str == "":
-                break
-
-            json_message = None
-            try:
-                # It loads arrays too
-                json_message = json.loads(message_str)
-                json_messages.append(json_message)
-            except json.decoder.JSONDecodeError as err:
-                print(message_str)
-                print("Not a valid json: ", err)
-            message_str = remaining_message_str
-
-        tmp_connection_str = connection_data["ip_address"]
-        self.whc_maps["tempconnections_data"][tmp_connection_str][
-            "last_rec_time"
-        ] = current_milli_time()
-        self.__parse_messages(tmp_connection_str, json_messages)
-
-    def __parse_messages(self, ip_address, json_messages):
+        # The framer keeps partial messages until the next bytes complete them
+        json_messages = connection_data["framer"].feed(
+            connection_data["received_bytes"]
+        )
+
+        self.__parse_messages(connection_data["address"], json_messages)
+
+    def __parse_messages(self, address, json_messages):
         """Puts the json messages in the messages map and associated them with the connection"""
 
         for message in json_messages:
@@ -455,24 +810,107 @@ class BnWifiHostCommunicator:
             ):
                 print("Json message received is incomplete")
                 continue
-            player = message[BnConstants.MESSAGE_PLAYER_TAG]
-            bodypart = message[BnConstants.MESSAGE_BODYPART_TAG]
-            sensortype = message[BnConstants.MESSAGE_SENSORTYPE_TAG]
-
-            pb_key = f"{player}|{bodypart}"
-            pbs_key = f"{player}|{bodypart}|{sensortype}"
-
-            self.whc_maps["connections"][pb_key] = ip_address
-            self.whc_maps["messages"][pbs_key] = message[BnConstants.MESSAGE_VALUE_TAG]
-
-            for listener in self.whc_bodynodes_listeners:
-                if listener.is_of_interest(player, bodypart, sensortype):
-                    listener.on_message_received(
-                        player,
-                        bodypart,
-                        sensortype,
-                        message[BnConstants.MESSAGE_VALUE_TAG],
-                    )
+            stream_id = self.whc_maps["messages"].intern_stream(
+                message[BnConstants.MESSAGE_PLAYER_TAG],
+                message[BnConstants.MESSAGE_BODYPART_TAG],
+                message[BnConstants.MESSAGE_SENSORTYPE_TAG],
+            )
+            if stream_id is None:
+                print("Json message received is malformed")
+                self.whc_connections.get_connection(address)[
+                    "stats"
+                ].add_decode_errors()
+                continue
+            self.__store_message(
+                address, stream_id, message[BnConstants.MESSAGE_VALUE_TAG]
+            )
+
+    def __store_message(self, address, stream_id, value):
+        """Puts a message value in the messages table, associates it with the connection and notifies the listeners.
+        Workers publish it to the host instead
+        """
+
+        tempconnections_data = self.whc_connections.get_connection(address)
+        messages = self.whc_maps["messages"]
+        stream_key = messages.get_stream_key(stream_id)
+        tempconnections_data["stats"].add_sample(stream_key[2])
+        new_source = messages.set_source(stream_id, address)
+        if self.whc_shard_publisher is not None:
+            if new_source:
+                # The host learns the stream before any of its samples
+                self.whc_shard_publisher.publish_stream(stream_id, stream_key, address)
+            if not self.whc_shard_publisher.publish(
+                stream_id, value, tempconnections_data["receive_ns"]
+            ):
+                tempconnections_data["dropped_samples"] += 1
+            return
+
+        if new_source:
+            self.whc_maps["connections"][stream_key[:2]] = address
+        self.__deliver_message(
+            stream_id,
+            value,
+            tempconnections_data["receive_ns"],
+            tempconnections_data["parse_ns"],
+        )
+
+    def __deliver_message(self, stream_id, value, receive_ns, parse_ns):
+        """Puts a message value in the messages table and notifies the listeners.
+        receive_ns and parse_ns are the monotonic times in ns when the sample was received and parsed
+        """
+
+        messages = self.whc_maps["messages"]
+        # Same clock as time.time() * 1000
+        receive_ms = time.time() * 1000 - (time.monotonic_ns() - receive_ns) / 1e6
+        self.whc_frames.store(stream_id, value, receive_ms)
+        stream_key = messages.get_stream_key(stream_id)
+        if self.whc_maps["shared_table"] is not None:
+            self.whc_maps["shared_table"].publish(
+                stream_id, stream_key, value, receive_ms
+            )
+        self.whc_maps["receive_times"][stream_id] = receive_ns
+        self.whc_bodynodes_listeners.dispatch(stream_id, stream_key, value)
+        self.whc_subscriptions.dispatch(stream_id, stream_key, value, receive_ms)
+        if self.whc_options["latency_histograms"]:
+            self.whc_latency.add_delivery(stream_id, receive_ns, parse_ns)
+
+    def __ring_shard_doorbell(self):
+        """Worker side, wakes up the host if samples were published since the last call"""
+
+        publisher = self.whc_shard_publisher
+        if publisher is not None and not publisher.ring_doorbell():
+            # The host is gone
+            self.whc_to_stop = True
+
+    def __send_shard_stats(self):
+        """Worker side, sends the connection stats to the host once per rate window"""
+
+        publisher = self.whc_shard_publisher
+        if publisher is None or not publisher.is_stats_due():
+            return
+        latency = {}
+        if self.whc_options["latency_histograms"]:
+            # Sent as the increment since the last time, the host accumulates them
+            latency["kernel_to_parse"] = self.whc_latency.take_increment(
+                "kernel_to_parse"
+            )
+        if not publisher.send_stats(
+            self.get_stats(),
+            self.get_dropped_datagrams(),
+            self.whc_receiver.get_socket_stats(),
+            latency,
+        ):
+            # The host is gone
+            self.whc_to_stop = True
+
+    def __add_shard_stream(self, stream_key, address):
+        """Host side, adds a stream announced by an ingest worker. Returns its id in the messages table"""
+
+        messages = self.whc_maps["messages"]
+        stream_id = messages.intern_stream(*stream_key)
+        if messages.set_source(stream_id, address):
+            self.whc_maps["connections"][stream_key[:2]] = address
+        return stream_id
 
 
 def main():
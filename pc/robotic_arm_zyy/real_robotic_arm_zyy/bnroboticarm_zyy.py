@@ -74,6 +74,8 @@ bodynodes_axis_config_ua = {
 bodynodes_robotic_arm = {
     "event": {"reset": False},
     "pin": {"servo1": 0, "servo2": 1, "servo3": 2, "servo4": 3, "servo5": 4},
+    # Shortest time between two commands of the servos, ~30 FPS
+    "command_interval_s": 0.03,
 }
 
 
@@ -140,8 +142,8 @@ def on_press(key):
         pass  # Special keys like shift, ctrl, etc.
 
 
-def compute_sensor_values(communicator, robot_mt):
-    """Compute sensor values"""
+def compute_sensor_values(frame, robot_mt):
+    """Compute sensor values from the frame of the player, None if there is no new one"""
 
     if bodynodes_robotic_arm["event"]["reset"] is True:
         print("Resetting sensors values")
@@ -152,16 +154,19 @@ def compute_sensor_values(communicator, robot_mt):
         internal.la_right_last = [1, 0, 0, 0]
         internal.ua_right_last = [1, 0, 0, 0]
 
-    la_right = communicator.getMessageValue(
-        "1",
-        BnConstants.BODYPART_LOWERARM_RIGHT_TAG,
-        BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
-    )
-    ua_right = communicator.getMessageValue(
-        "1",
-        BnConstants.BODYPART_UPPERARM_RIGHT_TAG,
-        BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
-    )
+    # Both arms from the same moment, so the IK does not mix two poses
+    if frame is None:
+        la_right = None
+        ua_right = None
+    else:
+        la_right = frame.get_value(
+            BnConstants.BODYPART_LOWERARM_RIGHT_TAG,
+            BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
+        )
+        ua_right = frame.get_value(
+            BnConstants.BODYPART_UPPERARM_RIGHT_TAG,
+            BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
+        )
 
     if ua_right is not None:
         [internal.la_right_last, internal.la_right_first] = (
@@ -226,9 +231,21 @@ def main(serial_com):
         # it might crash, add the proper try-catch
         setup_robotic_arm(serial_com)
 
+        frame = None
+        last_command_s = 0.0
         while True:
-            compute_sensor_values(communicator, robot_mt)
-            time.sleep(0.03)  # ~30 FPS
+            # The sensors refresh at hundreds of Hz, the servos get at most one command per interval.
+            # Sleep only what is left of the interval, then send the newest frame
+            time.sleep(
+                max(
+                    0.0,
+                    bodynodes_robotic_arm["command_interval_s"]
+                    - (time.monotonic() - last_command_s),
+                )
+            )
+            frame = communicator.wait_for_frame("1", 100, frame)
+            last_command_s = time.monotonic()
+            compute_sensor_values(frame, robot_mt)
     except KeyboardInterrupt:
         print("Ctrl+C Pressed. Stopping the bnwifibodynodeshost")
     finally:
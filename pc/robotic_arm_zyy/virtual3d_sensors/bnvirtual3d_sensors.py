@@ -101,8 +101,8 @@ def setup_robot_tracker():
     return robot_mt
 
 
-def compute_sensor_values(communicator, robot_mt, virt3d):
-    """Do computations based on bodynodes data"""
+def compute_sensor_values(frame, robot_mt, virt3d):
+    """Do computations based on the frame of the player, None if there is no new one"""
 
     if virt3d["event"]["reset"]:
         virt3d["event"]["reset"] = False
@@ -112,16 +112,19 @@ def compute_sensor_values(communicator, robot_mt, virt3d):
         internal.la_right_last = [1, 0, 0, 0]
         internal.ua_right_last = [1, 0, 0, 0]
 
-    la_right = communicator.getMessageValue(
-        "1",
-        bncommon.BnConstants.BODYPART_LOWERARM_RIGHT_TAG,
-        bncommon.BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
-    )
-    ua_right = communicator.getMessageValue(
-        "1",
-        bncommon.BnConstants.BODYPART_UPPERARM_RIGHT_TAG,
-        bncommon.BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
-    )
+    # Both arms from the same moment, so the IK does not mix two poses
+    if frame is None:
+        la_right = None
+        ua_right = None
+    else:
+        la_right = frame.get_value(
+            bncommon.BnConstants.BODYPART_LOWERARM_RIGHT_TAG,
+            bncommon.BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
+        )
+        ua_right = frame.get_value(
+            bncommon.BnConstants.BODYPART_UPPERARM_RIGHT_TAG,
+            bncommon.BnConstants.SENSORTYPE_ORIENTATION_ABS_TAG,
+        )
 
     if ua_right is not None:
         [internal.ua_right_last, internal.ua_right_first] = (
@@ -165,9 +168,11 @@ def main():
     communicator.start(["BN"])
 
     try:
+        frame = None
         while virtualworld.update_virtual3d_environment(virt3d):
-            compute_sensor_values(communicator, robot_mt, virt3d)
-            virtualworld.wait(30)  # ~30 FPS
+            compute_sensor_values(frame, robot_mt, virt3d)
+            # Redraws as soon as the sensors move, at least every 30 ms for the window events
+            frame = communicator.wait_for_frame("1", 30, frame)
     except KeyboardInterrupt:
         print("Ctrl+C Pressed. Stopping the bnwifibodynodeshost")
     finally: